@@ -0,0 +1,76 @@
+"""
+Benchmark the cost of proxy failover in :class:`pypac.PACSession` with a DNS-heavy PAC file.
+
+Every proxy in the PAC's chain fails except DIRECT, so each request fails over through the whole chain.
+DNS lookups made by the PAC are simulated with a fixed latency, and no network traffic occurs.
+
+Usage::
+
+    python benchmarks/bench_failover.py [--requests N] [--dns-latency SECONDS]
+"""
+
+import argparse
+import time
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from requests.exceptions import ProxyError
+
+from pypac import PACSession
+from pypac.parser import PACFile
+
+DNS_HEAVY_PAC = """
+function FindProxyForURL(url, host) {
+    if (isInNet(host, "10.0.0.0", "255.0.0.0")) return "DIRECT";
+    if (isInNet(host, "172.16.0.0", "255.240.0.0")) return "DIRECT";
+    if (isInNet(host, "192.168.0.0", "255.255.0.0")) return "DIRECT";
+    if (isResolvable("intranet.corp.example")) {
+        return "PROXY a.corp.example:8080; PROXY b.corp.example:8080; PROXY c.corp.example:8080; DIRECT";
+    }
+    return "DIRECT";
+}
+"""
+
+
+def _fake_gethostbyname(latency):
+    def gethostbyname(host):
+        time.sleep(latency)
+        return "203.0.113.1"
+
+    return gethostbyname
+
+
+def _fail_proxied_requests(method, url, proxies=None, **kwargs):
+    if proxies and proxies.get("http"):
+        raise ProxyError()
+
+
+def run(num_requests, dns_latency, reresolve):
+    sess = PACSession(pac=PACFile(DNS_HEAVY_PAC), reresolve_on_failover=reresolve)
+    with patch("socket.gethostbyname", _fake_gethostbyname(dns_latency)), patch(
+        "requests.Session.request", side_effect=_fail_proxied_requests
+    ):
+        start = time.time()
+        for i in range(num_requests):
+            sess.get("http://host{}.example.org/".format(i))
+            sess._proxy_resolver.unban_all()  # Make every request walk the full chain.
+        return (time.time() - start) / num_requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--dns-latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    print("{} requests, {:.1f} ms simulated DNS latency, 4-entry chain".format(args.requests, args.dns_latency * 1000))
+    for reresolve in (True, False):
+        per_request = run(args.requests, args.dns_latency, reresolve)
+        print("  reresolve_on_failover={!s:<5}  {:8.2f} ms/request".format(reresolve, per_request * 1000))
+
+
+if __name__ == "__main__":
+    main()
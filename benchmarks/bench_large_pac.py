@@ -0,0 +1,127 @@
+"""
+Benchmark loading a large, heavily commented PAC file with and without minification.
+
+Each configuration is loaded in a fresh process, which reports the time taken to load the PAC file,
+and the time and memory the JavaScript engine takes to parse it on its own.
+The PAC file is generated, and no network traffic occurs.
+
+Usage::
+
+    python benchmarks/bench_large_pac.py [--rules N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+CONFIGURATIONS = [
+    ("as given", {}),
+    ("minify", {"minify": True}),
+    ("minify, keep_source=False", {"minify": True, "keep_source": False}),
+]
+
+
+def generate_pac(num_rules):
+    lines = [
+        "/*",
+        " * Generated PAC file for benchmarking.",
+        " * " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+        " */",
+        "function FindProxyForURL(url, host) {",
+    ]
+    for i in range(num_rules):
+        lines += [
+            "    // Rule {}: route the d{}.example department through its own proxy,".format(i, i),
+            "    // unless the host is on the internal network.",
+            '    if (dnsDomainIs(host, ".d{}.example") ||'.format(i),
+            '            shExpMatch(host, "*.s{}.example")) {{'.format(i),
+            '        return "PROXY " + "proxy{}.example" + ":8080; " + "DIRECT";'.format(i % 10),
+            "    }",
+            "",
+        ]
+    lines += ['    return "DIRECT";', "}"]
+    return "\n".join(lines)
+
+
+def _rss_kb():
+    """Current resident memory of this process, or the peak where that's not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (IOError, OSError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(num_rules, options):
+    from dukpy import JSInterpreter
+
+    from pypac.parser import PACFile
+
+    pac_js = generate_pac(num_rules)
+    source = pac_js
+    if options.get("minify"):
+        from pypac.minify import minify
+
+        source = minify(pac_js)
+    # The engine on its own first, before anything else has allocated memory that might be reused.
+    before = _rss_kb()
+    start = time.time()
+    context = JSInterpreter()
+    context.evaljs(source)
+    parse_seconds = time.time() - start
+    engine_kb = _rss_kb() - before
+    del context
+
+    start = time.time()
+    pac = PACFile(pac_js, **options)
+    elapsed = time.time() - start
+    retained = len(pac.js) if pac.js is not None else 0
+    print(json.dumps({"seconds": elapsed, "parse": parse_seconds, "engine_kb": engine_kb, "retained": retained}))
+
+
+def run(num_rules, options):
+    output = subprocess.check_output(
+        [sys.executable, __file__, "--child", json.dumps(options), "--rules", str(num_rules)]
+    )
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rules", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.rules, json.loads(args.child))
+        return
+
+    from pypac.minify import minify
+
+    pac_js = generate_pac(args.rules)
+    print(
+        "{} rules, {:.0f} KB PAC file, {:.0f} KB minified".format(
+            args.rules, len(pac_js) / 1024.0, len(minify(pac_js)) / 1024.0
+        )
+    )
+    for name, options in CONFIGURATIONS:
+        results = [run(args.rules, options) for _ in range(args.repeat)]
+        best = min(results, key=lambda result: result["seconds"])
+        print(
+            "  {:<27} load {:6.1f} ms  JavaScript parse {:5.1f} ms, {:5.0f} KB  source kept {:4.0f} KB".format(
+                name,
+                best["seconds"] * 1000,
+                min(result["parse"] for result in results) * 1000,
+                sorted(result["engine_kb"] for result in results)[len(results) // 2],
+                best["retained"] / 1024.0,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
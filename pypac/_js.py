@@ -0,0 +1,706 @@
+"""
+Tokenizer and parser for the subset of JavaScript that PAC files are usually written in.
+
+This lets PyPAC reason about a PAC file without running it, such as to tell whether it's equivalent
+to a static proxy configuration. It isn't a complete JavaScript implementation:
+anything outside the subset raises :class:`UnsupportedSyntax`, and callers fall back to the JavaScript engine.
+"""
+
+import re
+
+# fmt: off
+#: Words that can't be identifiers. Those that the parser doesn't understand are reported as unsupported.
+KEYWORDS = frozenset([
+    "break", "case", "catch", "class", "const", "continue", "debugger", "default", "delete", "do", "else", "false",
+    "finally", "for", "function", "if", "in", "instanceof", "let", "new", "null", "return", "switch", "this",
+    "throw", "true", "try", "typeof", "var", "void", "while", "with",
+])
+
+# Longest first, so that e.g. '===' isn't read as '==' and '='.
+_PUNCTUATORS = sorted([
+    "{", "}", "(", ")", "[", "]", ";", ",", "<", ">", "<=", ">=", "==", "!=", "===", "!==", "+", "-", "*", "/", "%",
+    "++", "--", "<<", ">>", ">>>", "&", "|", "^", "!", "~", "&&", "||", "?", ":",
+    "=", "+=", "-=", "*=", "/=", "%=", "<<=", ">>=", ">>>=", "&=", "|=", "^=", ".",
+], key=len, reverse=True)
+# fmt: on
+
+# A '/' after one of these is division. Otherwise, it starts a regular expression literal.
+_DIVISION_AFTER_PUNCTUATORS = frozenset([")", "]", "}"])
+_REGEX_AFTER_KEYWORDS = frozenset(
+    ["return", "typeof", "case", "do", "else", "in", "instanceof", "new", "delete", "void"]
+)
+
+_PUNCTUATOR_RE = re.compile("|".join(re.escape(punctuator) for punctuator in _PUNCTUATORS))
+_NAME_START_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz_$")
+_NAME_RE = re.compile(r"[A-Za-z_$][\w$]*")
+# Strings without escapes, which are most of them.
+_SIMPLE_STRING_RE = re.compile(r"\"[^\"\\\n]*\"|'[^'\\\n]*'")
+_NUMBER_RE = re.compile(r"0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_WHITESPACE_CHARS = frozenset(" \t\f\v\r\n\u00a0\ufeff\u2028\u2029")
+_WHITESPACE_RE = re.compile("[ \t\f\v\r\n\u00a0\ufeff\u2028\u2029]+")
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v", "0": "\0"}
+
+
+class UnsupportedSyntax(ValueError):
+    """
+    The JavaScript is invalid, or uses something outside the subset that can be parsed.
+    """
+
+    def __init__(self, description, line):
+        """
+        :param str description: What wasn't understood.
+        :param int line: Line number where it was found, starting from 1.
+        """
+        super(UnsupportedSyntax, self).__init__("{} on line {}".format(description, line))
+        self.description = description
+        self.line = line
+
+
+class Token(object):
+    """A token of JavaScript source."""
+
+    __slots__ = ("end", "kind", "line", "newline_before", "start", "value")
+
+    def __init__(self, kind, value, start, end, line, newline_before):
+        #: ``name``, ``keyword``, ``number``, ``string``, ``regex``, ``punct``, or ``eof``.
+        self.kind = kind
+        #: The decoded value: the string's contents, the number, or the text of the token otherwise.
+        self.value = value
+        #: Offsets of the token in the source.
+        self.start = start
+        self.end = end
+        #: Line number, starting from 1.
+        self.line = line
+        #: Whether a line break precedes the token, for automatic semicolon insertion.
+        self.newline_before = newline_before
+
+    def __repr__(self):
+        return "<Token {} {!r}>".format(self.kind, self.value)
+
+
+def tokenize(source):
+    """
+    Split JavaScript source into tokens, dropping comments and whitespace.
+
+    :param str source: JavaScript source.
+    :returns: The tokens, ending with an ``eof`` token.
+    :rtype: list[Token]
+    :raises UnsupportedSyntax: If a string, comment, or regular expression isn't terminated,
+        or an unexpected character is found.
+    """
+    return list(iter_tokens(source))
+
+
+def iter_tokens(source):
+    """
+    Like :func:`tokenize`, but yield the tokens as they're read, so that callers can stop early.
+
+    :param str source: JavaScript source.
+    :rtype: collections.Iterator[Token]
+    :raises UnsupportedSyntax: As :func:`tokenize` does, once the tokenizer gets there.
+    """
+    previous = None
+    pos, line, newline_before = 0, 1, False
+    length = len(source)
+    while pos < length:
+        char = source[pos]
+        match = _WHITESPACE_RE.match(source, pos) if char in _WHITESPACE_CHARS else None
+        if match:
+            text = match.group()
+            if "\n" in text or "\u2028" in text or "\u2029" in text:
+                newline_before = True
+            line += text.count("\n")
+            pos = match.end()
+            continue
+        if char == "/" and source.startswith("//", pos):
+            end = source.find("\n", pos)
+            pos = length if end == -1 else end
+            continue
+        if char == "/" and source.startswith("/*", pos):
+            end = source.find("*/", pos + 2)
+            if end == -1:
+                raise UnsupportedSyntax("Unterminated comment", line)
+            comment = source[pos : end + 2]
+            if "\n" in comment:
+                newline_before = True
+            line += comment.count("\n")
+            pos = end + 2
+            continue
+
+        start = pos
+        if char in "\"'":
+            match = _SIMPLE_STRING_RE.match(source, pos)
+            if match:
+                value, pos, line_breaks = match.group()[1:-1], match.end(), 0
+            else:
+                value, pos, line_breaks = _read_string(source, pos, line)
+            token = Token("string", value, start, pos, line, newline_before)
+            line += line_breaks
+        elif char.isdigit() or (char == "." and pos + 1 < length and source[pos + 1].isdigit()):
+            match = _NUMBER_RE.match(source, pos)
+            text = match.group()
+            value = int(text, 16) if text[:2].lower() == "0x" else float(text)
+            # Integers as int only where a double holds them exactly, as JavaScript numbers are doubles.
+            if isinstance(value, float):
+                if value.is_integer() and abs(value) < 2**53:
+                    value = int(value)
+            elif value >= 2**53:
+                value = float(value)
+            pos = match.end()
+            token = Token("number", value, start, pos, line, newline_before)
+        elif char in _NAME_START_CHARS:
+            match = _NAME_RE.match(source, pos)
+            value = match.group()
+            pos = match.end()
+            token = Token("keyword" if value in KEYWORDS else "name", value, start, pos, line, newline_before)
+        elif char == "/" and _regex_allowed(previous):
+            value, pos = _read_regex(source, pos, line)
+            token = Token("regex", value, start, pos, line, newline_before)
+        else:
+            match = _PUNCTUATOR_RE.match(source, pos)
+            if not match:
+                raise UnsupportedSyntax("Unexpected character {!r}".format(char), line)
+            punctuator = match.group()
+            pos = match.end()
+            token = Token("punct", punctuator, start, pos, line, newline_before)
+        yield token
+        previous = token
+        newline_before = False
+    yield Token("eof", None, length, length, line, newline_before)
+
+
+def _regex_allowed(previous):
+    if previous is None:
+        return True
+    if previous.kind == "punct":
+        return previous.value not in _DIVISION_AFTER_PUNCTUATORS
+    if previous.kind == "keyword":
+        return previous.value in _REGEX_AFTER_KEYWORDS
+    return False
+
+
+def _read_string(source, pos, line):
+    """
+    :returns: The decoded string, the offset after it, and the number of line continuations in it.
+    """
+    quote = source[pos]
+    pos += 1
+    chars = []
+    line_breaks = 0
+    while True:
+        if pos >= len(source) or source[pos] == "\n":
+            raise UnsupportedSyntax("Unterminated string", line)
+        char = source[pos]
+        if char == quote:
+            return "".join(chars), pos + 1, line_breaks
+        if char != "\\":
+            chars.append(char)
+            pos += 1
+            continue
+        escaped = source[pos + 1 : pos + 2]
+        if escaped in _ESCAPES and not (escaped == "0" and source[pos + 2 : pos + 3].isdigit()):
+            chars.append(_ESCAPES[escaped])
+            pos += 2
+        elif escaped == "x" and re.match(r"[0-9a-fA-F]{2}$", source[pos + 2 : pos + 4]):
+            chars.append(chr(int(source[pos + 2 : pos + 4], 16)))
+            pos += 4
+        elif escaped == "u" and re.match(r"[0-9a-fA-F]{4}$", source[pos + 2 : pos + 6]):
+            chars.append(chr(int(source[pos + 2 : pos + 6], 16)))
+            pos += 6
+        elif escaped == "\n":
+            line_breaks += 1
+            pos += 2
+        elif escaped == "\r":
+            pos += 3 if source[pos + 2 : pos + 3] == "\n" else 2
+            line_breaks += 1
+        elif escaped.isdigit():
+            raise UnsupportedSyntax("Octal escape in string", line)
+        else:
+            chars.append(escaped)
+            pos += 2
+
+
+def _read_regex(source, pos, line):
+    """
+    :returns: ``(pattern, flags)``, and the offset after the literal.
+    """
+    start = pos
+    pos += 1
+    in_class = False
+    while True:
+        if pos >= len(source) or source[pos] == "\n":
+            raise UnsupportedSyntax("Unterminated regular expression", line)
+        char = source[pos]
+        if char == "\\":
+            pos += 2
+            continue
+        if char == "[":
+            in_class = True
+        elif char == "]":
+            in_class = False
+        elif char == "/" and not in_class:
+            break
+        pos += 1
+    pattern = source[start + 1 : pos]
+    flags_match = re.compile(r"[a-z]*").match(source, pos + 1)
+    return (pattern, flags_match.group()), flags_match.end()
+
+
+class Node(object):
+    """
+    A node of the syntax tree. ``kind`` is the name of the construct, and the other attributes depend on it:
+
+    * ``Program``: ``body`` (statements)
+    * ``Function``: ``name`` (``None`` for function expressions), ``params`` (names), ``body`` (statements)
+    * ``Var``: ``declarations`` (``(name, value)`` pairs, where value may be ``None``)
+    * ``If``: ``test``, ``consequent``, ``alternate`` (may be ``None``)
+    * ``Return``: ``value`` (may be ``None``)
+    * ``Block``: ``body`` (statements)
+    * ``Expression``: ``expression``
+    * ``For``: ``init``, ``test``, ``update`` (each may be ``None``), ``body``
+    * ``ForIn``: ``target`` (a ``Var`` or an expression), ``object``, ``body``
+    * ``While``: ``test``, ``body``
+    * ``Break``, ``Continue``, ``Empty``
+    * ``Literal``: ``value`` (string, number, boolean, or ``None`` for ``null``)
+    * ``Regex``: ``pattern``, ``flags``
+    * ``Identifier``: ``name``
+    * ``Array``: ``elements``
+    * ``Object``: ``properties`` (``(key, value)`` pairs)
+    * ``Call``: ``callee``, ``arguments``
+    * ``Member``: ``object``, ``property`` (an expression), ``computed`` (whether written with brackets)
+    * ``Unary``: ``operator``, ``operand``
+    * ``Update``: ``operator`` (``++`` or ``--``), ``prefix``, ``target``
+    * ``Binary``: ``operator``, ``left``, ``right``. Includes ``&&`` and ``||``.
+    * ``Conditional``: ``test``, ``consequent``, ``alternate``
+    * ``Assign``: ``operator``, ``target``, ``value``
+    * ``Sequence``: ``expressions``
+
+    ``start`` and ``end`` are the node's offsets in the source, and ``line`` is where it starts.
+    """
+
+    def __init__(self, kind, start, end, line, **fields):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.line = line
+        self.__dict__.update(fields)
+
+    def children(self):
+        """
+        :returns: The nodes directly within this one, in source order.
+        :rtype: list[Node]
+        """
+        found = []
+        for key, value in self.__dict__.items():
+            if key in ("kind", "start", "end", "line"):
+                continue
+            _collect_nodes(value, found)
+        return sorted(found, key=lambda node: node.start)
+
+    def walk(self):
+        """Yield this node and all the nodes within it, depth-first in source order."""
+        yield self
+        for child in self.children():
+            for node in child.walk():
+                yield node
+
+    def __repr__(self):
+        return "<Node {} line {}>".format(self.kind, self.line)
+
+
+def _collect_nodes(value, found):
+    if isinstance(value, Node):
+        found.append(value)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect_nodes(item, found)
+
+
+_ASSIGNMENT_OPERATORS = frozenset(["=", "+=", "-=", "*=", "/=", "%=", "<<=", ">>=", ">>>=", "&=", "|=", "^="])
+# Binary operators by precedence, loosest first.
+_BINARY_PRECEDENCE = [
+    ["||"],
+    ["&&"],
+    ["|"],
+    ["^"],
+    ["&"],
+    ["==", "!=", "===", "!=="],
+    ["<", ">", "<=", ">=", "in", "instanceof"],
+    ["<<", ">>", ">>>"],
+    ["+", "-"],
+    ["*", "/", "%"],
+]
+_UNARY_OPERATORS = frozenset(["!", "-", "+", "~", "typeof", "void", "delete"])
+
+
+def parse(source):
+    """
+    Parse JavaScript source.
+
+    :param str source: JavaScript source.
+    :returns: A ``Program`` node.
+    :rtype: Node
+    :raises UnsupportedSyntax: If the source is invalid or uses constructs outside the supported subset,
+        such as ``switch``, ``try``, ``new``, or getters.
+    """
+    return _Parser(source).parse_program()
+
+
+class _Parser(object):
+    def __init__(self, source):
+        self.source = source
+        self.tokens = tokenize(source)
+        self.pos = 0
+
+    @property
+    def token(self):
+        return self.tokens[self.pos]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def at(self, value, kind=None):
+        token = self.token
+        if kind is None:
+            return token.kind in ("punct", "keyword") and token.value == value
+        return token.kind == kind and token.value == value
+
+    def eat(self, value):
+        if self.at(value):
+            return self.advance()
+
+    def expect(self, value):
+        if not self.at(value):
+            self.fail("Expected '{}'".format(value))
+        return self.advance()
+
+    def fail(self, description=None):
+        token = self.token
+        if description is None:
+            if token.kind == "eof":
+                description = "Unexpected end of input"
+            else:
+                description = "Unexpected {!r}".format(token.value)
+        else:
+            description += ", found {!r}".format(token.value) if token.kind != "eof" else ", found end of input"
+        raise UnsupportedSyntax(description, token.line)
+
+    def node(self, kind, first_token, **fields):
+        previous = self.tokens[self.pos - 1]
+        return Node(kind, first_token.start, previous.end, first_token.line, **fields)
+
+    def consume_semicolon(self):
+        if self.eat(";"):
+            return
+        token = self.token
+        if token.kind == "eof" or self.at("}") or token.newline_before:
+            return
+        self.fail("Expected ';'")
+
+    # Statements
+
+    def parse_program(self):
+        first = self.token
+        body = []
+        while self.token.kind != "eof":
+            body.append(self.parse_statement())
+        return Node("Program", first.start, len(self.source), first.line, body=body)
+
+    def parse_statement(self):
+        token = self.token
+        if token.kind == "keyword":
+            handler = getattr(self, "parse_" + token.value, None)
+            if handler is not None:
+                return handler()
+            if token.value not in ("true", "false", "null", "this", "typeof", "void", "delete"):
+                raise UnsupportedSyntax("'{}' statement".format(token.value), token.line)
+        if self.at("{"):
+            return self.parse_block()
+        if self.at(";"):
+            self.advance()
+            return self.node("Empty", token)
+        if (
+            token.kind == "name"
+            and self.tokens[self.pos + 1].value == ":"
+            and self.tokens[self.pos + 1].kind == "punct"
+        ):
+            raise UnsupportedSyntax("Labelled statement", token.line)
+        expression = self.parse_expression()
+        self.consume_semicolon()
+        return self.node("Expression", token, expression=expression)
+
+    def parse_block(self):
+        first = self.expect("{")
+        body = []
+        while not self.at("}"):
+            if self.token.kind == "eof":
+                self.fail("Expected '}'")
+            body.append(self.parse_statement())
+        self.advance()
+        return self.node("Block", first, body=body)
+
+    def parse_function(self, expression=False):
+        first = self.expect("function")
+        name = None
+        if self.token.kind == "name":
+            name = self.advance().value
+        elif not expression:
+            self.fail("Expected function name")
+        self.expect("(")
+        params = []
+        while not self.at(")"):
+            if self.token.kind != "name":
+                self.fail("Expected parameter name")
+            params.append(self.advance().value)
+            if not self.at(")"):
+                self.expect(",")
+        self.advance()
+        body = self.parse_block().body
+        return self.node("Function", first, name=name, params=params, body=body)
+
+    def parse_var(self, no_in=False):
+        first = self.advance()  # var, let, or const
+        declarations = []
+        while True:
+            if self.token.kind != "name":
+                self.fail("Expected variable name")
+            name = self.advance().value
+            value = None
+            if self.eat("="):
+                value = self.parse_assignment(no_in)
+            declarations.append((name, value))
+            if not self.eat(","):
+                break
+        node = self.node("Var", first, declarations=declarations)
+        if not no_in:
+            self.consume_semicolon()
+            node.end = self.tokens[self.pos - 1].end
+        return node
+
+    parse_let = parse_var
+    parse_const = parse_var
+
+    def parse_if(self):
+        first = self.advance()
+        self.expect("(")
+        test = self.parse_expression()
+        self.expect(")")
+        consequent = self.parse_statement()
+        alternate = None
+        if self.eat("else"):
+            alternate = self.parse_statement()
+        return self.node("If", first, test=test, consequent=consequent, alternate=alternate)
+
+    def parse_return(self):
+        first = self.advance()
+        value = None
+        if not (self.at(";") or self.at("}") or self.token.kind == "eof" or self.token.newline_before):
+            value = self.parse_expression()
+        self.consume_semicolon()
+        return self.node("Return", first, value=value)
+
+    def parse_for(self):
+        first = self.advance()
+        self.expect("(")
+        init = None
+        if self.at("var") or self.at("let") or self.at("const"):
+            init = self.parse_var(no_in=True)
+        elif not self.at(";"):
+            init = self.parse_expression(no_in=True)
+        if self.eat("in"):
+            if init.kind == "Var" and (len(init.declarations) != 1 or init.declarations[0][1] is not None):
+                raise UnsupportedSyntax("Initializer in for-in loop", first.line)
+            if init.kind not in ("Var", "Identifier", "Member"):
+                raise UnsupportedSyntax("Invalid for-in loop target", first.line)
+            obj = self.parse_expression()
+            self.expect(")")
+            body = self.parse_statement()
+            return self.node("ForIn", first, target=init, object=obj, body=body)
+        self.expect(";")
+        test = None if self.at(";") else self.parse_expression()
+        self.expect(";")
+        update = None if self.at(")") else self.parse_expression()
+        self.expect(")")
+        body = self.parse_statement()
+        return self.node("For", first, init=init, test=test, update=update, body=body)
+
+    def parse_while(self):
+        first = self.advance()
+        self.expect("(")
+        test = self.parse_expression()
+        self.expect(")")
+        body = self.parse_statement()
+        return self.node("While", first, test=test, body=body)
+
+    def parse_break(self):
+        first = self.advance()
+        if self.token.kind == "name" and not self.token.newline_before:
+            raise UnsupportedSyntax("Labelled break", first.line)
+        self.consume_semicolon()
+        return self.node("Break", first)
+
+    def parse_continue(self):
+        first = self.advance()
+        if self.token.kind == "name" and not self.token.newline_before:
+            raise UnsupportedSyntax("Labelled continue", first.line)
+        self.consume_semicolon()
+        return self.node("Continue", first)
+
+    # Expressions
+
+    def parse_expression(self, no_in=False):
+        first = self.token
+        expression = self.parse_assignment(no_in)
+        if not self.at(","):
+            return expression
+        expressions = [expression]
+        while self.eat(","):
+            expressions.append(self.parse_assignment(no_in))
+        return self.node("Sequence", first, expressions=expressions)
+
+    def parse_assignment(self, no_in=False):
+        first = self.token
+        target = self.parse_conditional(no_in)
+        if self.token.kind == "punct" and self.token.value in _ASSIGNMENT_OPERATORS:
+            if target.kind not in ("Identifier", "Member"):
+                self.fail("Invalid assignment target")
+            operator = self.advance().value
+            value = self.parse_assignment(no_in)
+            return self.node("Assign", first, operator=operator, target=target, value=value)
+        return target
+
+    def parse_conditional(self, no_in=False):
+        first = self.token
+        test = self.parse_binary(0, no_in)
+        if not self.eat("?"):
+            return test
+        consequent = self.parse_assignment()
+        self.expect(":")
+        alternate = self.parse_assignment(no_in)
+        return self.node("Conditional", first, test=test, consequent=consequent, alternate=alternate)
+
+    def parse_binary(self, level, no_in=False):
+        if level == len(_BINARY_PRECEDENCE):
+            return self.parse_unary()
+        first = self.token
+        left = self.parse_binary(level + 1, no_in)
+        operators = _BINARY_PRECEDENCE[level]
+        while self.token.kind in ("punct", "keyword") and self.token.value in operators:
+            if no_in and self.token.value == "in":
+                break
+            operator = self.advance().value
+            right = self.parse_binary(level + 1, no_in)
+            left = self.node("Binary", first, operator=operator, left=left, right=right)
+        return left
+
+    def parse_unary(self):
+        first = self.token
+        if first.kind in ("punct", "keyword") and first.value in _UNARY_OPERATORS:
+            operator = self.advance().value
+            operand = self.parse_unary()
+            return self.node("Unary", first, operator=operator, operand=operand)
+        if self.at("++") or self.at("--"):
+            operator = self.advance().value
+            target = self.parse_unary()
+            if target.kind not in ("Identifier", "Member"):
+                self.fail("Invalid update target")
+            return self.node("Update", first, operator=operator, prefix=True, target=target)
+        expression = self.parse_call()
+        if (self.at("++") or self.at("--")) and not self.token.newline_before:
+            if expression.kind not in ("Identifier", "Member"):
+                self.fail("Invalid update target")
+            operator = self.advance().value
+            return self.node("Update", first, operator=operator, prefix=False, target=expression)
+        return expression
+
+    def parse_call(self):
+        first = self.token
+        expression = self.parse_primary()
+        while True:
+            if self.eat("."):
+                token = self.token
+                if token.kind not in ("name", "keyword"):
+                    self.fail("Expected property name")
+                self.advance()
+                prop = Node("Literal", token.start, token.end, token.line, value=token.value)
+                expression = self.node("Member", first, object=expression, property=prop, computed=False)
+            elif self.eat("["):
+                prop = self.parse_expression()
+                self.expect("]")
+                expression = self.node("Member", first, object=expression, property=prop, computed=True)
+            elif self.eat("("):
+                arguments = []
+                while not self.at(")"):
+                    arguments.append(self.parse_assignment())
+                    if not self.at(")"):
+                        self.expect(",")
+                self.advance()
+                expression = self.node("Call", first, callee=expression, arguments=arguments)
+            else:
+                return expression
+
+    def parse_primary(self):
+        token = self.token
+        if token.kind in ("number", "string"):
+            self.advance()
+            return self.node("Literal", token, value=token.value)
+        if token.kind == "regex":
+            self.advance()
+            return self.node("Regex", token, pattern=token.value[0], flags=token.value[1])
+        if token.kind == "name":
+            self.advance()
+            return self.node("Identifier", token, name=token.value)
+        if token.kind == "keyword":
+            if token.value in ("true", "false"):
+                self.advance()
+                return self.node("Literal", token, value=token.value == "true")
+            if token.value == "null":
+                self.advance()
+                return self.node("Literal", token, value=None)
+            if token.value == "function":
+                return self.parse_function(expression=True)
+            raise UnsupportedSyntax("'{}' expression".format(token.value), token.line)
+        if self.eat("("):
+            expression = self.parse_expression()
+            self.expect(")")
+            return expression
+        if self.eat("["):
+            elements = []
+            while not self.at("]"):
+                if self.at(","):
+                    raise UnsupportedSyntax("Array with holes", self.token.line)
+                elements.append(self.parse_assignment())
+                if not self.at("]"):
+                    self.expect(",")
+            self.advance()
+            return self.node("Array", token, elements=elements)
+        if self.eat("{"):
+            properties = []
+            while not self.at("}"):
+                key = self.token
+                if key.kind not in ("name", "keyword", "string", "number"):
+                    self.fail("Expected property name")
+                self.advance()
+                self.expect(":")
+                properties.append((str(key.value), self.parse_assignment()))
+                if not self.at("}"):
+                    self.expect(",")
+            self.advance()
+            return self.node("Object", token, properties=properties)
+        self.fail()
+
+
+def find_function(program, name):
+    """
+    :param Node program: Parsed source.
+    :param str name: Function name.
+    :returns: The last top-level declaration of the function, as JavaScript would use, or ``None``.
+    :rtype: Node|None
+    """
+    found = None
+    for statement in program.body:
+        if statement.kind == "Function" and statement.name == name:
+            found = statement
+    return found
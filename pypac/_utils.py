@@ -1,11 +1,15 @@
 """Internal helpers."""
 
 import sys
+import time
 
 ON_WINDOWS = sys.platform.startswith("win")
 ON_DARWIN = sys.platform == "darwin"
 ON_PY3 = sys.version_info[0] >= 3
 
+#: Clock for measuring durations. Python 2 lacks a monotonic clock.
+monotonic = getattr(time, "monotonic", time.time)
+
 
 def is_ipv4_address(string_ip):
     """
@@ -0,0 +1,174 @@
+"""
+A Requests transport adapter that tunes and pre-warms connection pools for each proxy.
+"""
+
+from requests.adapters import HTTPAdapter
+
+from pypac._utils import ON_PY3
+
+
+def _proxy_key(proxy_url):
+    """
+    :param str proxy_url: Proxy URL, possibly including credentials.
+    :returns: Lowercase ``scheme://host:port`` for the proxy, without credentials.
+    :rtype: str
+    """
+    if ON_PY3:
+        from urllib.parse import urlparse
+    else:
+        from urlparse import urlparse  # type: ignore
+
+    parsed = urlparse(proxy_url if "://" in proxy_url else "http://" + proxy_url)
+    netloc = parsed.hostname or ""
+    if parsed.port:
+        netloc += ":{}".format(parsed.port)
+    return "{}://{}".format(parsed.scheme, netloc).lower()
+
+
+class PACProxyAdapter(HTTPAdapter):
+    """
+    Transport adapter that keeps a separately sized connection pool manager for each proxy,
+    and can open connections to proxies ahead of the first request through them.
+
+    Pass it to :class:`pypac.PACSession` using the ``proxy_adapter`` keyword,
+    or mount it on any :ref:`Requests Session <requests:session-objects>`.
+    """
+
+    __attrs__ = HTTPAdapter.__attrs__ + [
+        "proxy_pool_config",
+        "prewarm_urls",
+        "prewarm_connections",
+        "prewarm_timeout",
+    ]
+
+    def __init__(
+        self,
+        proxy_pool_config=None,
+        prewarm_urls=None,
+        prewarm_connections=1,
+        prewarm_timeout=2,
+        **kwargs,
+    ):
+        """
+        :param dict proxy_pool_config: Pool settings for specific proxies, keyed by proxy URL such as
+            ``http://proxy.corp.local:8080``. Credentials in proxy URLs are ignored for matching.
+            Each value is a dict that may contain ``num_pools``, ``maxsize``, and ``block``,
+            with the same meaning as ``pool_connections``, ``pool_maxsize``, and ``pool_block``.
+            Proxies not listed use the adapter-wide settings.
+        :param list[str] prewarm_urls: URLs whose proxies should have connections opened when
+            :meth:`prewarm` is called. For HTTPS URLs, this includes the ``CONNECT`` tunnel and TLS handshake.
+        :param int prewarm_connections: Number of connections to open to each proxy for each URL.
+            Capped by the pool size for that proxy.
+        :param float prewarm_timeout: Connect timeout for each pre-warmed connection.
+        :param kwargs: Passed to :class:`requests.adapters.HTTPAdapter`.
+        """
+        self.proxy_pool_config = {_proxy_key(k): v for k, v in (proxy_pool_config or {}).items()}
+        self.prewarm_urls = list(prewarm_urls or [])
+        self.prewarm_connections = prewarm_connections
+        self.prewarm_timeout = prewarm_timeout
+        super(PACProxyAdapter, self).__init__(**kwargs)
+
+    def pool_config_for(self, proxy):
+        """
+        :param str proxy: Proxy URL.
+        :returns: Keyword arguments ``num_pools``, ``maxsize``, and ``block`` for the proxy's pool manager.
+        :rtype: dict
+        """
+        config = {"num_pools": self._pool_connections, "maxsize": self._pool_maxsize, "block": self._pool_block}
+        config.update(self.proxy_pool_config.get(_proxy_key(proxy), {}))
+        return config
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        """
+        Like :meth:`requests.adapters.HTTPAdapter.proxy_manager_for`, but sizes the pool manager
+        according to :meth:`pool_config_for`.
+        """
+        if proxy in self.proxy_manager:
+            return self.proxy_manager[proxy]
+
+        from requests.adapters import SOCKSProxyManager
+        from requests.utils import get_auth_from_url
+        from urllib3.poolmanager import proxy_from_url
+
+        pool_kwargs = dict(self.pool_config_for(proxy), **proxy_kwargs)
+        if proxy.lower().startswith("socks"):
+            username, password = get_auth_from_url(proxy)
+            manager = SOCKSProxyManager(proxy, username=username, password=password, **pool_kwargs)
+        else:
+            manager = proxy_from_url(proxy, proxy_headers=self.proxy_headers(proxy), **pool_kwargs)
+        self.proxy_manager[proxy] = manager
+        return manager
+
+    def prewarm(self, resolver):
+        """
+        Open connections to the proxies that the PAC file returns for each of :attr:`prewarm_urls`.
+        Connections are returned to the pools that Requests will draw from when sending requests to those URLs.
+        Failures are logged and otherwise ignored. This can be called again to replace connections that have closed.
+
+        :param pypac.resolver.ProxyResolver resolver: Resolver for the current PAC file.
+        :returns: Number of connections opened.
+        :rtype: int
+        """
+        opened = 0
+        for url in self.prewarm_urls:
+            for proxy in resolver.get_proxies(url):
+                if proxy == "DIRECT" or not resolver.get_proxy(url, [proxy]):
+                    continue
+                try:
+                    opened += self.warm(proxy, url, self.prewarm_connections)
+                except Exception as e:  # noqa: BLE001
+                    # Pre-warming only saves time on the first requests, so it must not get in the way of anything.
+                    import logging
+
+                    logging.getLogger(__name__).warning(
+                        "Could not pre-warm connections to {} for {}: {}".format(proxy, url, e)
+                    )
+        return opened
+
+    def warm(self, proxy, url, connections=1):
+        """
+        Open connections through a proxy for a URL, and keep them in the pool for later requests.
+        Connections that the pool already has open are kept as they are.
+
+        :param str proxy: Proxy URL.
+        :param str url: URL that requests will be made to. For HTTP URLs, connections go to the proxy itself.
+            For HTTPS URLs, a ``CONNECT`` tunnel to the URL's host is also established.
+        :param int connections: Number of connections to have open. Capped by the pool size.
+        :returns: Number of connections opened.
+        :rtype: int
+        :raises urllib3.exceptions.EmptyPoolError: If the pool blocks, and no connection is free
+            within :attr:`prewarm_timeout`.
+        """
+        from requests import Request
+
+        prepared = Request("GET", url).prepare()
+        proxies = {"http": proxy, "https": proxy}
+        if hasattr(self, "get_connection_with_tls_context"):  # Requests >= 2.32.2
+            pool = self.get_connection_with_tls_context(prepared, True, proxies)
+        else:
+            pool = self.get_connection(url, proxies)
+
+        tunnel = pool.proxy is not None and pool.scheme == "https"
+        opened = 0
+        conns = []
+        try:
+            for _ in range(min(connections, pool.pool.maxsize)):
+                conn = pool._get_conn(timeout=self.prewarm_timeout)
+                conns.append(conn)
+                if conn.sock is not None:
+                    # Still open from an earlier call. A tunnel can't be set up again on it.
+                    continue
+                conn.timeout = self.prewarm_timeout
+                try:
+                    if tunnel:
+                        pool._prepare_proxy(conn)
+                    else:
+                        conn.connect()
+                except Exception:
+                    conn.close()
+                    raise
+                opened += 1
+        finally:
+            for conn in conns:
+                pool._put_conn(conn)
+        return opened
@@ -0,0 +1,118 @@
+"""
+Proxy resolution for asyncio applications.
+
+PAC evaluation runs on a bounded thread pool, so that the event loop isn't blocked by the JavaScript engine.
+The host being looked up is resolved on the event loop beforehand,
+and the answer is handed to the PAC's DNS functions, such as ``dnsResolve()`` and ``isInNet()``.
+Concurrent resolutions that would give the same result are coalesced into one evaluation.
+"""
+
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from pypac import dns
+from pypac._utils import is_ipv4_address
+from pypac.resolver import ProxyResolver
+
+
+class AsyncProxyResolver(object):
+    """
+    Asyncio counterpart to :class:`pypac.resolver.ProxyResolver`.
+    Proxy banning and authentication are shared with an underlying :class:`pypac.resolver.ProxyResolver`.
+    """
+
+    def __init__(self, pac, proxy_auth=None, socks_scheme="socks5", max_workers=4, executor=None, dns_resolver=None):
+        """
+        :param pypac.parser.PACFile pac: Parsed PAC file.
+        :param requests.auth.HTTPProxyAuth proxy_auth: Username and password proxy authentication.
+            If provided, then all proxy URLs returned will include these credentials.
+        :param str socks_scheme: Scheme to assume for SOCKS proxies. `socks5` by default.
+        :param int max_workers: Number of threads for evaluating the PAC file. Ignored if `executor` is given.
+        :param concurrent.futures.Executor executor: Executor to evaluate the PAC file on.
+        :param dns_resolver: Coroutine function that takes a host name and returns a list of its IP addresses,
+            or an empty list if it could not be resolved.
+            By default, the event loop's ``getaddrinfo()`` is used.
+        """
+        self.resolver = ProxyResolver(pac, proxy_auth=proxy_auth, socks_scheme=socks_scheme)
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self._owns_executor = executor is None
+        self._dns_resolver = dns_resolver or _getaddrinfo_addresses
+        self._in_flight = {}
+
+    @property
+    def pac(self):
+        """The PAC file being consulted."""
+        return self.resolver.pac
+
+    def close(self):
+        """Shut down the thread pool, if it was created by this resolver."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+    async def get_proxies(self, url):
+        """
+        Get the proxies that are applicable to a given URL, according to the PAC file.
+
+        :param str url: The URL for which to find appropriate proxies.
+        :return: All the proxies that apply to the given URL.
+            Can be empty, which means to abort the request.
+        :rtype: list[str]
+        """
+        if self.resolver.constant_proxies is not None:
+            # Nothing to evaluate or resolve.
+            return list(self.resolver.get_proxies(url))
+        host = urlparse(url).hostname or ""
+        key = self.resolver.resolution_key(url, host)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._get_proxies(url, host))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Cancelling one caller shouldn't cancel the resolution for others waiting on it.
+        return list(await asyncio.shield(task))
+
+    async def get_proxy(self, url):
+        """
+        Get a proxy to use for a given URL, excluding any banned ones.
+
+        :param str url: The URL for which to find an appropriate proxy.
+        :return: A proxy to use for the URL,
+            or the string 'DIRECT', which means a proxy is not to be used.
+            Can be ``None``, which means to not attempt the request.
+        :rtype: str|None
+        """
+        return self.resolver.get_proxy(url, await self.get_proxies(url))
+
+    def ban_proxy(self, proxy_url):
+        """See :meth:`pypac.resolver.ProxyResolver.ban_proxy`."""
+        self.resolver.ban_proxy(proxy_url)
+
+    def unban_all(self):
+        """Unban any banned proxies."""
+        self.resolver.unban_all()
+
+    async def _get_proxies(self, url, host):
+        answers = {}
+        if host and not is_ipv4_address(host) and ":" not in host:
+            answers[host] = await self._dns_resolver(host)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._evaluate, url, answers)
+
+    def _evaluate(self, url, answers):
+        with dns.preresolved(answers):
+            return self.resolver.get_proxies(url)
+
+
+async def _getaddrinfo_addresses(host):
+    """
+    :returns: Addresses of the host, or an empty list if it could not be resolved.
+    :rtype: list[str]
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, 0)
+    except socket.gaierror:
+        return []
+    return [str(info[4][0]) for info in infos]
@@ -3,11 +3,13 @@ These are the most commonly used components of PyPAC.
 """
 
 import os
+import threading
 from contextlib import contextmanager
 
 from requests import Session
 from requests.exceptions import ConnectionError, ConnectTimeout, ProxyError, Timeout
 
+from pypac._utils import ON_PY3, monotonic
 from pypac.os_settings import (
     ON_DARWIN,
     ON_WINDOWS,
@@ -15,9 +17,11 @@ from pypac.os_settings import (
     autoconfig_url_from_registry,
     file_url_to_local_path,
 )
-from pypac.parser import PACFile
-from pypac.resolver import ProxyConfigExhaustedError, ProxyResolver
-from pypac.wpad import proxy_urls_from_dns
+from pypac.parser import MalformedPacError, PACFile
+from pypac.refresh import PACSource, fetch_if_changed
+from pypac.resolver import ProxyConfigExhaustedError, ProxyResolver, proxy_parameter_for_requests
+from pypac.timing import Deadline, DeadlineExceededError, DiscoveryTimings, RequestTimings
+from pypac.wpad import local_hostname, proxy_urls_from_dns
 
 
 def get_pac(
@@ -28,6 +32,11 @@ def get_pac(
     timeout=2,
     allowed_content_types=None,
     session=None,
+    deadline=None,
+    parallel=False,
+    discovery_cache=None,
+    reverse_dns=True,
+    timings=None,
     **kwargs,
 ):
     """
@@ -47,19 +56,79 @@ def get_pac(
         ``application/x-ns-proxy-autoconfig`` and ``application/x-javascript-config``.
     :param requests.Session session: Used for getting potential PAC files.
         If not specified, a generic session is used.
+    :param Deadline deadline: Overall time limit for finding and downloading a PAC file.
+        Each URL is given at most `timeout`, or the time that remains, whichever is shorter.
+    :param bool parallel: Request all PAC URL candidates at once, with `timeout` as the time limit
+        for all of them together. See :func:`download_pac`.
+    :param pypac.cache.DiscoveryCache discovery_cache: Remembers the outcome of searching for a PAC file,
+        so that later calls, including from other processes, can skip the search.
+        A PAC file from the cache is revalidated in the background.
+        The cached result is only used while the OS settings' PAC URL and this host's name stay the same.
+        Not used if `url` or `js` is given, or if the OS settings point to a PAC file on the filesystem.
+    :param bool reverse_dns: Find this host's fully-qualified name for WPAD using a reverse DNS lookup,
+        which can be slow. See :func:`pypac.wpad.local_hostname`.
+    :param pypac.timing.DiscoveryTimings timings: Filled in with the time spent in each stage of the search.
+        The same breakdown is logged at debug level.
     :return: The first valid parsed PAC file according to the criteria, or `None` if nothing was found.
     :rtype: PACFile|None
     :raises MalformedPacError: If something that claims to be a PAC file was obtained but could not be parsed.
+    :raises DeadlineExceededError: If the deadline passed before all PAC URL candidates could be tried.
     """
-    if url:
-        downloaded_pac = download_pac(
-            [url], timeout=timeout, allowed_content_types=allowed_content_types, session=session
+    if timings is None:
+        timings = DiscoveryTimings()
+    try:
+        return _discover_pac(
+            url,
+            js,
+            from_os_settings,
+            from_dns,
+            timeout,
+            allowed_content_types,
+            session,
+            deadline,
+            parallel,
+            discovery_cache,
+            reverse_dns,
+            timings,
+            **kwargs,
         )
+    finally:
+        import logging
+
+        logger = logging.getLogger(__name__)
+        logger.debug("PAC discovery took {:.3f}s: {!r}".format(timings.total, timings))
+
+
+def _discover_pac(
+    url,
+    js,
+    from_os_settings,
+    from_dns,
+    timeout,
+    allowed_content_types,
+    session,
+    deadline,
+    parallel,
+    discovery_cache,
+    reverse_dns,
+    timings,
+    **kwargs,
+):
+    """
+    Body of :func:`get_pac`, with each stage timed. Every stage runs at most once.
+    """
+    if url:
+        with timings.measure(timings.DOWNLOAD):
+            downloaded_pac = download_pac(
+                [url], timeout=timeout, allowed_content_types=allowed_content_types, session=session, deadline=deadline
+            )
         if not downloaded_pac:
             return
-        return PACFile(downloaded_pac, **kwargs)
+        with timings.measure(timings.PARSE):
+            return _with_source(PACFile(downloaded_pac, **kwargs), PACSource(candidate_urls=[url]))
     if js:
-        return PACFile(js, **kwargs)
+        with timings.measure(timings.PARSE):
+            return PACFile(js, **kwargs)
 
     # Deprecated in 0.8.2
     from_registry = kwargs.get("from_registry")
@@ -69,31 +138,89 @@ def get_pac(
         warnings.warn("from_registry is deprecated, use from_os_settings instead.")
         from_os_settings = from_registry
 
+    url_or_path = None
     if from_os_settings:
-        if ON_WINDOWS:
-            path = autoconfig_url_from_registry()
-        elif ON_DARWIN:
-            path = autoconfig_url_from_preferences()
-        else:
-            path = None
+        with timings.measure(timings.OS_SETTINGS):
+            url_or_path = _autoconfig_url_from_os_settings()
 
+        path = url_or_path
         if path and path.lower().startswith("file://"):
             path = file_url_to_local_path(path)
 
+        # Read afresh rather than from the cache, as it's as quick.
         if path and os.path.isfile(path):
-            with open(path) as f:
-                return PACFile(f.read(), **kwargs)
+            with timings.measure(timings.LOCAL_FILE):
+                mtime = os.path.getmtime(path)
+                with open(path) as f:
+                    pac_js = f.read()
+            with timings.measure(timings.PARSE):
+                return _with_source(PACFile(pac_js, **kwargs), PACSource(path=path, mtime=mtime))
 
-    pac_candidate_urls = collect_pac_urls(from_os_settings=True, from_dns=from_dns)
-    downloaded_pac = download_pac(
-        pac_candidate_urls, timeout=timeout, allowed_content_types=allowed_content_types, session=session
-    )
+    hostname = None
+    if from_dns:
+        with timings.measure(timings.HOSTNAME):
+            hostname = local_hostname(reverse_dns)
+    # Everything the search depends on, so that the cached result isn't used once the network changes.
+    cache_key = [bool(from_os_settings), bool(from_dns), url_or_path, hostname]
+    if discovery_cache:
+        with timings.measure(timings.CACHE):
+            entry = discovery_cache.load(cache_key)
+        if entry is not None and not entry["pac_url"]:
+            return
+        if entry is not None:
+            try:
+                with timings.measure(timings.PARSE):
+                    pac = PACFile(entry["pac_js"], **kwargs)
+                pac.source = PACSource(url=entry["pac_url"], etag=entry["etag"], last_modified=entry["last_modified"])
+            except MalformedPacError:
+                discovery_cache.clear()
+            else:
+                thread = threading.Thread(
+                    target=_revalidate_cached_pac, args=(discovery_cache, entry, timeout, allowed_content_types)
+                )
+                thread.daemon = True
+                thread.start()
+                return pac
+
+    with timings.measure(timings.WPAD_CANDIDATES):
+        pac_candidate_urls = collect_pac_urls(
+            from_os_settings=bool(url_or_path), from_dns=from_dns, local_hostname=hostname, autoconfig_url=url_or_path
+        )
+    if discovery_cache:
+        with timings.measure(timings.DOWNLOAD):
+            pac_url, resp = _download_pac_response(
+                pac_candidate_urls, timeout, allowed_content_types, session, deadline, parallel
+            )
+        if resp is None:
+            discovery_cache.store_not_found(cache_key)
+            return
+        etag, last_modified = resp.headers.get("etag"), resp.headers.get("last-modified")
+        with timings.measure(timings.PARSE):
+            pac = PACFile(resp.text, **kwargs)
+        discovery_cache.store_found(cache_key, pac_url, resp.text, etag, last_modified)
+        return _with_source(pac, PACSource(url=pac_url, etag=etag, last_modified=last_modified))
+
+    with timings.measure(timings.DOWNLOAD):
+        downloaded_pac = download_pac(
+            pac_candidate_urls,
+            timeout=timeout,
+            allowed_content_types=allowed_content_types,
+            session=session,
+            deadline=deadline,
+            parallel=parallel,
+        )
     if not downloaded_pac:
         return
-    return PACFile(downloaded_pac, **kwargs)
+    with timings.measure(timings.PARSE):
+        return _with_source(PACFile(downloaded_pac, **kwargs), PACSource(candidate_urls=pac_candidate_urls))
+
+
+def _with_source(pac, source):
+    pac.source = source
+    return pac
 
 
-def collect_pac_urls(from_os_settings=True, from_dns=True, **kwargs):
+def collect_pac_urls(from_os_settings=True, from_dns=True, local_hostname=None, autoconfig_url=None, **kwargs):
     """
     Get all the URLs that potentially yield a PAC file.
 
@@ -101,6 +228,8 @@ def collect_pac_urls(from_os_settings=True, from_dns=True, **kwargs):
         If a value is found and is a URL, it comes first in the returned list.
         Doesn't do anything on non-Windows or non-macOS/OSX platforms.
     :param bool from_dns: Assemble a list of PAC URL candidates using the WPAD protocol.
+    :param str local_hostname: Hostname to use for WPAD. If not provided, the local hostname is used.
+    :param str autoconfig_url: PAC URL or path already read from the OS settings, so that they aren't read again.
     :return: A list of URLs that should be tried in order.
     :rtype: list[str]
     """
@@ -114,36 +243,59 @@ def collect_pac_urls(from_os_settings=True, from_dns=True, **kwargs):
 
     pac_urls = []
     if from_os_settings:
-        if ON_WINDOWS:
-            url_or_path = autoconfig_url_from_registry()
-        elif ON_DARWIN:
-            url_or_path = autoconfig_url_from_preferences()
-        else:
-            url_or_path = None
-
+        url_or_path = autoconfig_url or _autoconfig_url_from_os_settings()
         if url_or_path and (url_or_path.lower().startswith("http://") or url_or_path.lower().startswith("https://")):
             pac_urls.append(url_or_path)
     if from_dns:
-        pac_urls.extend(proxy_urls_from_dns())
+        pac_urls.extend(proxy_urls_from_dns(local_hostname))
     return pac_urls
 
 
-def download_pac(candidate_urls, timeout=1.0, allowed_content_types=None, session=None):
+def _autoconfig_url_from_os_settings():
+    """
+    :returns: The PAC URL or path from the OS settings, if any.
+    :rtype: str|None
+    """
+    if ON_WINDOWS:
+        return autoconfig_url_from_registry()
+    if ON_DARWIN:
+        return autoconfig_url_from_preferences()
+
+
+def download_pac(candidate_urls, timeout=1.0, allowed_content_types=None, session=None, deadline=None, parallel=False):
     """
     Try to download a PAC file from one of the given candidate URLs.
 
     :param list[str] candidate_urls: URLs that are expected to return a PAC file.
-        Requests are made in order, one by one.
+        Requests are made in order, one by one, unless `parallel` is set.
     :param float timeout: Time to wait for host resolution and response for each URL.
         When a timeout or DNS failure occurs, the next candidate URL is tried.
+        If `parallel` is set, this is the time to wait for all of the URLs together.
     :param allowed_content_types: If the response has a ``Content-Type`` header,
         then consider the response to be a PAC file only if the header is one of these values.
         If not specified, the allowed types are
         ``application/x-ns-proxy-autoconfig`` and ``application/x-javascript-config``.
     :param requests.Session session: Used for getting potential PAC files.
         If not specified, a generic session is used.
+    :param Deadline deadline: Overall time limit. Each URL is given at most `timeout`,
+        or the time that remains, whichever is shorter.
+    :param bool parallel: Request all the URLs at once. The PAC file from the earliest URL in `candidate_urls`
+        that has one is still the one returned, without waiting for later URLs once it's known.
     :return: Contents of the PAC file, or `None` if no URL was successful.
     :rtype: str|None
+    :raises DeadlineExceededError: If the deadline passed before all candidate URLs could be tried.
+    """
+    _, resp = _download_pac_response(candidate_urls, timeout, allowed_content_types, session, deadline, parallel)
+    if resp is not None:
+        return resp.text
+
+
+def _download_pac_response(candidate_urls, timeout, allowed_content_types, session, deadline, parallel):
+    """
+    Like :func:`download_pac`.
+
+    :returns: The URL a PAC file was downloaded from and its response, or ``None`` for both.
+    :rtype: tuple[str, requests.Response]|tuple[None, None]
     """
     if not allowed_content_types:
         allowed_content_types = {"application/x-ns-proxy-autoconfig", "application/x-javascript-config"}
@@ -153,25 +305,120 @@ def download_pac(candidate_urls, timeout=1.0, allowed_content_types=None, sessio
     else:
         sess = session
     sess.trust_env = False  # Don't inherit proxy config from environment variables.
+    if parallel:
+        return _download_pac_parallel(candidate_urls, timeout, allowed_content_types, sess, deadline)
     for pac_url in candidate_urls:
-        try:
-            resp = sess.get(pac_url, timeout=timeout)
-            content_type = resp.headers.get("content-type", "").lower()
-            if content_type and True not in [allowed_type in content_type for allowed_type in allowed_content_types]:
-                import logging
+        url_timeout = timeout
+        if deadline:
+            deadline.check("downloading PAC from {}".format(pac_url))
+            url_timeout = deadline.clamp(timeout)
+        resp = _fetch_pac(sess, pac_url, url_timeout, allowed_content_types)
+        if resp is not None:
+            return pac_url, resp
+    if deadline:
+        deadline.check("downloading PAC")
+    return None, None
 
-                logger = logging.getLogger(__name__)
-                logger.warning(
-                    "{} available but content-type {} is not allowed. Only {} are allowed.".format(
-                        pac_url, content_type, ",".join(allowed_content_types)
-                    )
+
+def _fetch_pac(sess, pac_url, timeout, allowed_content_types, headers=None):
+    """
+    :param dict headers: Extra request headers.
+    :returns: The response, if it's a PAC file. Otherwise ``None``.
+    :rtype: requests.Response|None
+    """
+    if not allowed_content_types:
+        allowed_content_types = {"application/x-ns-proxy-autoconfig", "application/x-javascript-config"}
+    try:
+        resp = sess.get(pac_url, timeout=timeout, headers=headers)
+        content_type = resp.headers.get("content-type", "").lower()
+        if content_type and True not in [allowed_type in content_type for allowed_type in allowed_content_types]:
+            import logging
+
+            logger = logging.getLogger(__name__)
+            logger.warning(
+                "{} available but content-type {} is not allowed. Only {} are allowed.".format(
+                    pac_url, content_type, ",".join(allowed_content_types)
                 )
-                continue
-            if resp.ok:
-                return resp.text
-        except (ConnectionError, Timeout):
-            continue
-    return
+            )
+            return
+        if resp.ok:
+            return resp
+    except (ConnectionError, Timeout):
+        return
+
+
+def _download_pac_parallel(candidate_urls, timeout, allowed_content_types, sess, deadline):
+    """
+    Request all candidate URLs at once, with `timeout` as the time limit for all of them together.
+    Results are considered in order of priority: a URL's result is only waited for once every earlier URL has failed.
+    Requests still in progress when the result is known are abandoned.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+    if not candidate_urls:
+        return None, None
+    if deadline:
+        deadline.check("downloading PAC")
+        timeout = deadline.clamp(timeout)
+    budget = Deadline(timeout)
+
+    executor = ThreadPoolExecutor(max_workers=len(candidate_urls))
+    futures = [executor.submit(_fetch_pac, sess, url, timeout, allowed_content_types) for url in candidate_urls]
+    try:
+        for pac_url, future in zip(candidate_urls, futures):
+            try:
+                resp = future.result(timeout=budget.remaining())
+            except FuturesTimeoutError:
+                break
+            if resp is not None:
+                return pac_url, resp
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+    if deadline:
+        deadline.check("downloading PAC")
+    return None, None
+
+
+def _conditional_headers(etag, last_modified):
+    """
+    :returns: Headers for requesting a PAC file only if it has changed.
+    :rtype: dict
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def _revalidate_cached_pac(discovery_cache, entry, timeout, allowed_content_types=None):
+    """
+    Check whether a cached PAC file is still current using a conditional request, and update the cache.
+    If the request fails, the cache is left as-is.
+
+    :param pypac.cache.DiscoveryCache discovery_cache: The cache.
+    :param dict entry: Cached entry for a found PAC file.
+    """
+    sess = Session()
+    sess.trust_env = False
+    headers = _conditional_headers(entry.get("etag"), entry.get("last_modified"))
+    resp = _fetch_pac(sess, entry["pac_url"], timeout, allowed_content_types, headers=headers)
+    if resp is None:
+        return
+    if resp.status_code == 304:
+        discovery_cache.touch(entry)
+        return
+    try:
+        PACFile(resp.text)
+    except MalformedPacError:
+        return
+    discovery_cache.store_found(
+        entry["key"], entry["pac_url"], resp.text, resp.headers.get("etag"), resp.headers.get("last-modified")
+    )
 
 
 class PACSession(Session):
@@ -189,6 +436,21 @@ class PACSession(Session):
         response_proxy_fail_filter=None,
         exception_proxy_fail_filter=None,
         socks_scheme="socks5",
+        reresolve_on_failover=False,
+        proxy_connect_timeout=None,
+        proxy_race_delay=None,
+        deadline=None,
+        proxy_adapter=None,
+        pending_pac_policy="wait",
+        prefetch=False,
+        discovery_cache=None,
+        refresh_interval=None,
+        resolution_cache_size=0,
+        resolution_cache_ttl=None,
+        warm_swap_hosts=0,
+        pac_error_policy="raise",
+        pac_error_threshold=0,
+        pac_error_cooldown=30,
         **kwargs,
     ):
         """
@@ -205,11 +467,65 @@ class PACSession(Session):
             By default, :class:`requests.exceptions.ConnectTimeout` and
             :class:`requests.exceptions.ProxyError` are matched.
         :param str socks_scheme: Scheme to use when PAC file returns a SOCKS proxy. `socks5` by default.
+        :param bool reresolve_on_failover: Consult the PAC file again when failing over to the next proxy.
+            By default, the proxies returned by the PAC file for the first attempt of a request are reused,
+            which avoids repeating the JavaScript evaluation and any DNS lookups it performs.
+        :param float proxy_connect_timeout: Seconds to wait for a connection to a proxy from the PAC file
+            before failing over to the next one. Only applies to the connect phase of requests
+            that go through a PAC proxy; the read timeout given to a request is unaffected.
+            By default, the request's own ``timeout`` is used.
+        :param float proxy_race_delay: If set, and the PAC file returns several proxies in a row,
+            connections to them are raced before the request is sent: the next proxy is tried
+            after this many seconds, or immediately if the previous one fails, without cancelling earlier attempts.
+            The request is then sent through the first proxy to accept a connection.
+        :param float deadline: Default for the ``deadline`` argument of :meth:`request`.
+            Seconds allowed for each request overall, including PAC discovery and proxy failover.
+        :param requests.adapters.HTTPAdapter proxy_adapter: Transport adapter to mount for HTTP and HTTPS URLs,
+            such as a :class:`PACProxyAdapter <pypac.adapter.PACProxyAdapter>` to size connection pools per proxy.
+            If it's a :class:`PACProxyAdapter <pypac.adapter.PACProxyAdapter>`,
+            connections are pre-warmed whenever a PAC file is loaded.
+        :param str pending_pac_policy: What requests do while another thread is searching for the PAC file.
+            ``wait`` (the default) waits for the search to finish and then uses its result.
+            ``direct`` sends the request without a proxy.
+            ``env`` sends the request using proxy settings from the environment, as Requests normally would.
+        :param bool prefetch: Start searching for a PAC file on a background thread right away,
+            instead of upon the first request. Requests made before the search finishes
+            are handled according to `pending_pac_policy`. Ignored if `pac` is given.
+        :param pypac.cache.DiscoveryCache discovery_cache: Cache of PAC discovery results to use when searching
+            for a PAC file. See :func:`get_pac`.
+        :param float refresh_interval: If set, check the PAC file in use for changes at its source
+            this often, in seconds, on a background thread. See :meth:`refresh_pac`.
+        :param int resolution_cache_size: Number of hosts for which to remember the PAC file's result.
+            Disabled by default. See :class:`ProxyResolver <pypac.resolver.ProxyResolver>`.
+        :param float resolution_cache_ttl: Seconds for which to remember each result. Forever by default.
+        :param int warm_swap_hosts: When a new version of the PAC file is loaded, first evaluate it for
+            this many of the most used hosts in the resolution cache, so that requests to them don't all
+            have to wait for the PAC file at once. Hosts whose proxies changed are recorded in :attr:`route_changes`.
+        :param str pac_error_policy: What requests do when the PAC file fails to give a result,
+            such as when it goes over the `timeout` or `memory_limit` it was loaded with.
+            ``raise`` (the default) raises the error. ``direct`` sends the request without a proxy.
+            ``last_known_good`` uses the proxies from the last successful evaluation for the same host,
+            or raises the error if there wasn't one. See :class:`ProxyResolver <pypac.resolver.ProxyResolver>`.
+            Results from previous versions of the PAC file count as last known good too.
+        :param int pac_error_threshold: If set, stop evaluating the PAC file for `pac_error_cooldown` seconds
+            after it fails this many times in a row, and handle requests according to `pac_error_policy` meanwhile.
+        :param float pac_error_cooldown: Seconds for which to stop evaluating the PAC file.
+            See `pac_error_threshold`.
         """
+        if pending_pac_policy not in ("wait", "direct", "env"):
+            raise ValueError("Unknown pending_pac_policy: {}".format(pending_pac_policy))
+        if pac_error_policy not in ("raise", "direct", "last_known_good"):
+            raise ValueError("Unknown pac_error_policy: {}".format(pac_error_policy))
         super(PACSession, self).__init__()
         self._tried_get_pac = False
+        self._pac_lock = threading.RLock()
+        if proxy_adapter:
+            self.mount("http://", proxy_adapter)
+            self.mount("https://", proxy_adapter)
 
         self._proxy_resolver = None
+        self._refresh_thread = None
+        self._refresh_stop = threading.Event()
         self._proxy_auth = proxy_auth
         self._socks_scheme = socks_scheme
 
@@ -220,10 +536,36 @@ class PACSession(Session):
 
         #: Set to ``False`` to disable all PAC functionality, including PAC auto-discovery.
         self.pac_enabled = pac_enabled
+        #: Set to ``True`` to consult the PAC file again when failing over to the next proxy.
+        self.reresolve_on_failover = reresolve_on_failover
+        #: Connect timeout, in seconds, for requests that go through a PAC proxy.
+        self.proxy_connect_timeout = proxy_connect_timeout
+        #: Delay, in seconds, before racing a connection to the next proxy in the PAC's list.
+        self.proxy_race_delay = proxy_race_delay
+        #: Seconds allowed for each request overall, including PAC discovery and proxy failover.
+        self.deadline = deadline
+        #: What requests do while another thread is searching for the PAC file: ``wait``, ``direct``, or ``env``.
+        self.pending_pac_policy = pending_pac_policy
+        #: Seconds taken by the search for the PAC file, once it has happened.
+        self.pac_discovery_time = None
+        #: Cache of PAC discovery results, used when searching for a PAC file.
+        self.discovery_cache = discovery_cache
+        #: Seconds between checks for changes to the PAC file. Takes effect when a PAC file is first loaded.
+        self.refresh_interval = refresh_interval
+        self._resolution_cache_size = resolution_cache_size
+        self._resolution_cache_ttl = resolution_cache_ttl
+        #: Number of most used hosts to evaluate a new version of the PAC file for before it's put to use.
+        self.warm_swap_hosts = warm_swap_hosts
+        #: Hosts whose proxies changed when the PAC file was last replaced,
+        #: as a list of :class:`RouteChange <pypac.resolver.RouteChange>`. ``None`` until then.
+        self.route_changes = None
+        self._pac_error_policy = pac_error_policy
+        self._pac_error_threshold = pac_error_threshold
+        self._pac_error_cooldown = pac_error_cooldown
 
         if pac:
             self._tried_get_pac = True
-            self._proxy_resolver = self._get_proxy_resolver(pac)
+            self._use_pac(pac)
 
         self._response_proxy_failure_filter = default_proxy_fail_response_filter
         if response_proxy_fail_filter:
@@ -233,8 +575,119 @@ class PACSession(Session):
         if exception_proxy_fail_filter:
             self._exc_proxy_failure_filter = exception_proxy_fail_filter
 
+        self._prefetch_thread = None
+        if prefetch and pac_enabled and not self._tried_get_pac:
+            self._start_prefetch()
+
+    def _start_prefetch(self):
+        """Search for the PAC file on a background thread. Returns once the search holds the discovery lock."""
+        locked = threading.Event()
+
+        def prefetch():
+            with self._pac_lock:
+                locked.set()
+                try:
+                    self.get_pac()
+                except Exception as e:
+                    # Left for the first request to try again.
+                    import logging
+
+                    logger = logging.getLogger(__name__)
+                    logger.warning("Background PAC discovery failed: {}".format(e), exc_info=True)
+
+        self._prefetch_thread = threading.Thread(target=prefetch, name="pypac-prefetch")
+        self._prefetch_thread.daemon = True
+        self._prefetch_thread.start()
+        locked.wait()
+
     def _get_proxy_resolver(self, pac):
-        return ProxyResolver(pac, proxy_auth=self._proxy_auth, socks_scheme=self._socks_scheme)
+        return ProxyResolver(
+            pac,
+            proxy_auth=self._proxy_auth,
+            socks_scheme=self._socks_scheme,
+            cache_size=self._resolution_cache_size,
+            cache_ttl=self._resolution_cache_ttl,
+            error_policy=self._pac_error_policy,
+            error_threshold=self._pac_error_threshold,
+            error_cooldown=self._pac_error_cooldown,
+        )
+
+    def _use_pac(self, pac):
+        """Start consulting the given PAC file, and pre-warm connections to its proxies if configured to."""
+        from pypac.adapter import PACProxyAdapter
+
+        resolver = self._get_proxy_resolver(pac)
+        if self._proxy_resolver:
+            # In case the new version fails where the old one didn't.
+            resolver.adopt_last_known_good(self._proxy_resolver)
+        if self._proxy_resolver and self.warm_swap_hosts:
+            self.route_changes = resolver.warm_from(self._proxy_resolver, self.warm_swap_hosts)
+            if self.route_changes:
+                import logging
+
+                logger = logging.getLogger(__name__)
+                changed = [c.host for c in self.route_changes if c.error is None]
+                failed = [c.host for c in self.route_changes if c.error is not None]
+                if changed:
+                    logger.info("New PAC file changes proxies for: {}".format(", ".join(changed)))
+                if failed:
+                    logger.warning("New PAC file fails for: {}".format(", ".join(failed)))
+        for adapter in set(self.adapters.values()):
+            if isinstance(adapter, PACProxyAdapter):
+                adapter.prewarm(resolver)
+        # Swapped in with one assignment, so each request sees either the old PAC file or the new one.
+        self._proxy_resolver = resolver
+        if self.refresh_interval and self._refresh_thread is None:
+            self._start_refresh()
+
+    def _start_refresh(self):
+        """Call :meth:`refresh_pac` periodically on a background thread, until the session is closed."""
+        import weakref
+
+        session_ref = weakref.ref(self)  # Don't keep an abandoned session alive.
+        stop, interval = self._refresh_stop, self.refresh_interval
+
+        def refresh():
+            while not stop.wait(interval):
+                session = session_ref()
+                if session is None:
+                    return
+                try:
+                    session.refresh_pac()
+                except Exception as e:
+                    import logging
+
+                    logger = logging.getLogger(__name__)
+                    logger.warning("PAC refresh failed: {}".format(e), exc_info=True)
+                del session
+
+        self._refresh_thread = threading.Thread(target=refresh, name="pypac-refresh")
+        self._refresh_thread.daemon = True
+        self._refresh_thread.start()
+
+    def refresh_pac(self):
+        """
+        Check whether the PAC file in use has changed at its source, and start using the new version if so.
+        Requests already in progress carry on with the version they started with.
+        This is called periodically if :attr:`refresh_interval` is set.
+
+        :returns: Whether a new version of the PAC file was loaded.
+        :rtype: bool
+        :raises MalformedPacError: If the new version could not be parsed. The current version stays in use.
+        """
+        resolver = self._proxy_resolver
+        if not resolver:
+            return False
+        new_pac = fetch_if_changed(resolver.pac)
+        if new_pac is None:
+            return False
+        self._use_pac(new_pac)
+        return True
+
+    def close(self):
+        """Stop refreshing the PAC file, and close all adapters."""
+        self._refresh_stop.set()
+        super(PACSession, self).close()
 
     @property
     def proxy_auth(self):
@@ -247,61 +700,233 @@ class PACSession(Session):
         if self._proxy_resolver:
             self._proxy_resolver.proxy_auth = value
 
-    def request(self, method, url, proxies=None, **kwargs):
+    def request(self, method, url, proxies=None, deadline=None, **kwargs):
         """
+        :param float deadline: Seconds allowed for the whole request, including PAC discovery,
+            PAC evaluation, and all proxy failover attempts. Each stage is given the time that remains.
+            Overrides :attr:`deadline`.
         :raises ProxyConfigExhaustedError: If the PAC file provided no usable proxy configuration.
         :raises MalformedPacError: If something that claims to be a PAC file was downloaded but could not be parsed.
+        :raises DeadlineExceededError: If the deadline passed before the request could be sent.
         """
+        if deadline is None:
+            deadline = self.deadline
+        if deadline is not None:
+            deadline = Deadline(deadline)
+        return self._timed_request(method, url, proxies, deadline, kwargs)
+
+    def _timed_request(self, method, url, proxies, deadline, kwargs, chain=None):
+        timings = RequestTimings()
+        try:
+            response = self._pac_request(method, url, proxies, deadline, timings, kwargs, chain)
+        except DeadlineExceededError as e:
+            e.timings = timings
+            raise
+        if response is not None:
+            response.pac_timings = timings
+        return response
+
+    def _pac_request(self, method, url, proxies, deadline, timings, kwargs, chain=None):
         # If proxies are provided as a parameter, or if PAC is disabled, then don't use PAC for this request.
         if not self.pac_enabled or proxies is not None:
-            return super(PACSession, self).request(method, url, proxies=proxies, **kwargs)
+            return self._request_without_pac(method, url, proxies, deadline, timings, kwargs)
 
         # At this point, PAC is enabled. Try to find a PAC, if we haven't already.
-        if not self._tried_get_pac:
-            self.get_pac()
-        if self._proxy_resolver:  # PAC found and in use.
-            proxies = self._proxy_resolver.get_proxy_for_requests(url)
+        if not self._tried_get_pac and not self._get_pac_single_flight(deadline, timings):
+            # Another thread is searching for the PAC file, and this request isn't waiting for it.
+            proxies = proxy_parameter_for_requests("DIRECT") if self.pending_pac_policy == "direct" else None
+            return self._request_without_pac(method, url, proxies, deadline, timings, kwargs)
+        # Read once, so that the whole request uses one version of the PAC file even if it's refreshed meanwhile.
+        resolver = self._proxy_resolver
+        if resolver:  # PAC found and in use.
+            started = monotonic()
+            if chain is None:
+                chain = resolver.get_proxies(url)
+            proxies = resolver.get_proxy_for_requests(url, chain)
+            timings.resolve = monotonic() - started
 
         while True:
+            started = monotonic()
+            timeout = kwargs.get("timeout")
+            if deadline:
+                deadline.check("sending the request")
+                timeout = deadline.clamp(timeout)
+            if chain and self.proxy_race_delay is not None:
+                proxies = self._race_proxies(url, chain, proxies, timeout, resolver)
             proxy_url = list(proxies.values())[0] if proxies else None
+            if proxy_url and self.proxy_connect_timeout is not None:
+                timeout = _with_connect_timeout(timeout, self.proxy_connect_timeout)
+            request_kwargs = kwargs if timeout == kwargs.get("timeout") else dict(kwargs, timeout=timeout)
             try:
-                response = super(PACSession, self).request(method, url, proxies=proxies, **kwargs)
+                response = super(PACSession, self).request(method, url, proxies=proxies, **request_kwargs)
             except Exception as request_exc:
+                timings.attempts.append((proxy_url, monotonic() - started))
                 # Use PAC's proxy failover rules if the proxy used for the request is from the PAC,
                 # and this exception represents a proxy failure.
-                if self._proxy_resolver and proxy_url and self._exc_proxy_failure_filter(request_exc):
+                if resolver and proxy_url and self._exc_proxy_failure_filter(request_exc):
                     try:
-                        proxies = self.do_proxy_failover(proxy_url, url)
+                        proxies = self.do_proxy_failover(proxy_url, url, chain, resolver)
                         continue
                     except ProxyConfigExhaustedError:
                         # No failover option, not even DIRECT. Bubble up original exception.
-                        self._proxy_resolver.unban_all()
+                        resolver.unban_all()
                 raise request_exc  # In PY2, just saying 'raise' may re-raise ProxyConfigExhaustedError.
+            timings.attempts.append((proxy_url, monotonic() - started))
 
             # Use PAC's proxy failover rules if the proxy used for the request is from the PAC,
             # and this response represents a proxy failure.
-            if self._proxy_resolver and proxy_url and self._response_proxy_failure_filter(response):
+            if resolver and proxy_url and self._response_proxy_failure_filter(response):
                 try:
-                    proxies = self.do_proxy_failover(proxy_url, url)
+                    proxies = self.do_proxy_failover(proxy_url, url, chain, resolver)
                     continue
                 except ProxyConfigExhaustedError:
                     # No failover option, not even DIRECT. Return response as-is.
-                    self._proxy_resolver.unban_all()
+                    resolver.unban_all()
                     return response
 
             return response
 
-    def do_proxy_failover(self, proxy_url, for_url):
+    def _request_without_pac(self, method, url, proxies, deadline, timings, kwargs):
+        if deadline:
+            kwargs = dict(kwargs, timeout=deadline.clamp(kwargs.get("timeout")))
+        started = monotonic()
+        try:
+            return super(PACSession, self).request(method, url, proxies=proxies, **kwargs)
+        finally:
+            timings.attempts.append((None, monotonic() - started))
+
+    def _get_pac_single_flight(self, deadline, timings):
+        """
+        Search for the PAC file, unless another thread is already doing so,
+        in which case either wait for it or give up, according to :attr:`pending_pac_policy`.
+
+        :returns: ``False`` if the search was left to another thread and not waited for.
+        :rtype: bool
+        :raises DeadlineExceededError: If the deadline passed before or while waiting for the search.
+        """
+        started = monotonic()
+        if deadline:
+            deadline.check("PAC discovery")
+        if not self._pac_lock.acquire(False):
+            if self.pending_pac_policy != "wait":
+                return False
+            if deadline and ON_PY3:
+                acquired = self._pac_lock.acquire(timeout=deadline.remaining())
+            else:
+                acquired = self._pac_lock.acquire()
+            timings.discovery_wait = monotonic() - started
+            if not acquired:
+                raise DeadlineExceededError(deadline.seconds, "PAC discovery")
+        try:
+            if deadline:
+                deadline.check("PAC discovery")
+                self.get_pac(deadline=deadline)
+            else:
+                self.get_pac()
+        finally:
+            self._pac_lock.release()
+            timings.discovery = monotonic() - started
+        return True
+
+    def map(self, requests, max_workers=10, max_per_proxy=None, rate_per_proxy=None):
+        """
+        Send many requests concurrently, with limits on how many go to each proxy at once.
+        Each request's proxy is looked up in the PAC file on the thread pool, and requests are queued per proxy,
+        so that a slow or overloaded proxy doesn't hold up requests that go elsewhere.
+        Proxy failover still applies to each request.
+        If the proxy for a request can't be looked up, such as when the PAC file throws an error,
+        only that request fails: its result has the exception.
+
+        :param requests: Requests to send. Each is either a URL to ``GET``,
+            or a dict of keyword arguments for :meth:`request`, including ``url`` and optionally ``method``.
+        :param int max_workers: Number of requests to send at once overall.
+        :param int max_per_proxy: Number of requests to send at once through any one proxy, or ``DIRECT``.
+            Unlimited by default.
+        :param float rate_per_proxy: Maximum number of requests to start per second through any one proxy.
+            Unlimited by default.
+        :returns: Results in the order they complete.
+        :rtype: collections.Iterable[pypac.scheduler.MapResult]
+        """
+        from pypac.scheduler import EXHAUSTED, ProxyScheduler
+
+        if self.pac_enabled and not self._tried_get_pac:
+            self.get_pac()
+        resolver = self._proxy_resolver if self.pac_enabled else None
+
+        def route(routed):
+            kwargs = {"url": routed["spec"]} if isinstance(routed["spec"], str) else dict(routed["spec"])
+            method, url = kwargs.pop("method", "GET"), kwargs.pop("url")
+            chain = None
+            if kwargs.get("proxies") is not None:
+                proxy = (list(kwargs["proxies"].values())[0] if kwargs["proxies"] else None) or "DIRECT"
+            elif resolver:
+                chain = resolver.get_proxies(url)
+                proxy = resolver.get_proxy(url, chain) or EXHAUSTED
+            else:
+                proxy = "DIRECT"
+            routed.update(method=method, url=url, kwargs=kwargs, chain=chain)
+            return proxy
+
+        def send(routed):
+            kwargs = routed["kwargs"]
+            proxies, deadline = kwargs.pop("proxies", None), kwargs.pop("deadline", self.deadline)
+            if deadline is not None:
+                deadline = Deadline(deadline)
+            return self._timed_request(routed["method"], routed["url"], proxies, deadline, kwargs, routed["chain"])
+
+        scheduler = ProxyScheduler(max_workers, max_per_proxy, rate_per_proxy)
+        results = scheduler.run([{"spec": spec} for spec in requests], route, send)
+        return (result._replace(request=result.request["spec"]) for result in results)
+
+    def _race_proxies(self, for_url, chain, proxies, timeout, resolver):
+        """
+        Race connections to the usable proxies in the chain, from the one about to be used until the next DIRECT.
+        Proxies that refuse or time out are banned, except the last one, which is left for the request to fail on.
+
+        :returns: Proxy configuration to use for the next request attempt.
+        :rtype: dict
+        """
+        proxy_url = list(proxies.values())[0] if proxies else None
+        if not proxy_url or proxy_url not in chain:
+            return proxies
+        candidates = []
+        for candidate in chain[chain.index(proxy_url) :]:
+            if candidate == "DIRECT":
+                break
+            if resolver.get_proxy(for_url, [candidate]):
+                candidates.append(candidate)
+        if len(candidates) < 2:
+            return proxies
+
+        connect_timeout = _with_connect_timeout(timeout, self.proxy_connect_timeout)[0]
+        winner, failed = _race_proxy_connect(candidates, self.proxy_race_delay, connect_timeout)
+        for candidate in failed:
+            if candidate != candidates[-1]:
+                resolver.ban_proxy(candidate)
+        if winner:
+            return proxy_parameter_for_requests(winner)
+        return resolver.get_proxy_for_requests(for_url, chain)
+
+    def do_proxy_failover(self, proxy_url, for_url, chain=None, resolver=None):
         """
         :param str proxy_url: Proxy to ban.
         :param str for_url: The URL being requested.
+        :param list[str] chain: Proxies obtained from the PAC file for the first attempt of the request.
+            The next proxy is chosen from these, unless :attr:`reresolve_on_failover` is set.
+        :param ProxyResolver resolver: Resolver that the request started with,
+            so that it carries on with the same version of the PAC file if that's refreshed meanwhile.
+            By default, the current one.
         :returns: The next proxy config to try, or 'DIRECT'.
         :raises ProxyConfigExhaustedError: If the PAC file provided no usable proxy configuration.
         """
-        if not self._proxy_resolver:
+        if resolver is None:
+            resolver = self._proxy_resolver
+        if not resolver:
             raise ProxyConfigExhaustedError(for_url)
-        self._proxy_resolver.ban_proxy(proxy_url)
-        return self._proxy_resolver.get_proxy_for_requests(for_url)
+        resolver.ban_proxy(proxy_url)
+        if self.reresolve_on_failover:
+            chain = None
+        return resolver.get_proxy_for_requests(for_url, chain)
 
     def get_pac(self, **kwargs):
         """
@@ -309,6 +934,7 @@ class PACSession(Session):
         This method is called upon the first use of :meth:`request`,
         but can also be called manually beforehand if desired.
         Subsequent calls to this method will only return the obtained PAC file, if any.
+        If another thread is already searching, this waits for its result instead of searching again.
 
         :returns: The obtained PAC file, if any.
         :rtype: PACFile|None
@@ -320,15 +946,99 @@ class PACSession(Session):
         if not self.pac_enabled:
             return
 
-        pac = get_pac(**kwargs)
-        self._tried_get_pac = True
-        if pac:
-            self._proxy_resolver = self._get_proxy_resolver(pac)
-        return pac
+        with self._pac_lock:
+            if self._tried_get_pac:
+                return self._proxy_resolver.pac if self._proxy_resolver else None
+            if self.discovery_cache is not None:
+                kwargs.setdefault("discovery_cache", self.discovery_cache)
+            started = monotonic()
+            pac = get_pac(**kwargs)
+            self.pac_discovery_time = monotonic() - started
+            self._tried_get_pac = True
+            if pac:
+                self._use_pac(pac)
+            return pac
+
+
+def _with_connect_timeout(timeout, connect_timeout):
+    """
+    Apply a connect timeout to a Requests ``timeout`` value, keeping its read timeout.
+    The shorter of the two connect timeouts is used.
+
+    :param timeout: ``timeout`` as given to Requests: a number, a (connect, read) tuple, or ``None``.
+    :param float connect_timeout: Connect timeout to apply. Can be ``None``.
+    :rtype: tuple
+    """
+    if isinstance(timeout, tuple):
+        request_connect_timeout, read_timeout = timeout
+    else:
+        request_connect_timeout = read_timeout = timeout
+    if connect_timeout is None:
+        connect_timeout = request_connect_timeout
+    elif request_connect_timeout is not None:
+        connect_timeout = min(connect_timeout, request_connect_timeout)
+    return connect_timeout, read_timeout
+
+
+def _race_proxy_connect(proxy_urls, delay, timeout):
+    """
+    Open TCP connections to proxies in a staggered fashion, similar to Happy Eyeballs (RFC 8305).
+    A connection attempt starts `delay` seconds after the previous one, or as soon as the previous one fails.
+    Earlier attempts keep going while later ones start.
+
+    :param list[str] proxy_urls: Proxy URLs, in order of preference.
+    :param float delay: Seconds to wait before trying the next proxy.
+    :param float timeout: Connect timeout for each proxy.
+    :returns: The first proxy to accept a connection (or ``None``), and the proxies that failed to connect.
+    :rtype: tuple[str|None, list[str]]
+    """
+    import socket
+
+    if ON_PY3:
+        from queue import Empty, Queue
+        from urllib.parse import urlparse
+    else:
+        from Queue import Empty, Queue  # type: ignore
+        from urlparse import urlparse  # type: ignore
+
+    default_ports = {"http": 80, "https": 443}
+    results = Queue()
+
+    def attempt(proxy_url):
+        parsed = urlparse(proxy_url)
+        try:
+            sock = socket.create_connection(
+                (parsed.hostname, parsed.port or default_ports.get(parsed.scheme, 1080)), timeout
+            )
+            sock.close()
+            results.put((proxy_url, True))
+        except (socket.error, ValueError):
+            results.put((proxy_url, False))
+
+    failed = []
+    pending = 0
+    for i, proxy_url in enumerate(proxy_urls):
+        thread = threading.Thread(target=attempt, args=(proxy_url,))
+        thread.daemon = True
+        thread.start()
+        pending += 1
+        is_last = i == len(proxy_urls) - 1
+        while pending:
+            try:
+                result_url, connected = results.get(timeout=None if is_last else delay)
+            except Empty:
+                break  # Give up waiting, and start on the next proxy.
+            pending -= 1
+            if connected:
+                return result_url, failed
+            failed.append(result_url)
+            if not is_last:
+                break  # Start on the next proxy right away.
+    return None, failed
 
 
 @contextmanager
-def pac_context_for_url(url, proxy_auth=None, pac=None):
+def pac_context_for_url(url, proxy_auth=None, pac=None, max_age=60 * 60):
     """
     This context manager provides a simple way to add rudimentary PAC functionality
     to code that cannot be modified to use :class:`PACSession`,
@@ -338,30 +1048,146 @@ def pac_context_for_url(url, proxy_auth=None, pac=None):
     If a PAC is found, then it's asked for the proxy to use for the given URL.
     The proxy environment variables are then set accordingly.
 
+    The outcome of PAC discovery, and the results of the PAC file, are reused by later calls in the same process.
+    Once the PAC file is older than `max_age`, it's checked for changes in the background,
+    or discovery is repeated if none was found, while the current one continues to be used.
+    See :func:`clear_pac_context_cache`.
+
+    Contexts may be entered from several threads at once. The environment variables then reflect
+    the most recently entered context that's still active, and are restored once all of them have exited.
+
     Note that this provides a very simplified PAC experience that's insufficient for some scenarios.
 
     :param url: Consult the PAC for the proxy to use for this URL.
     :param requests.auth.HTTPProxyAuth proxy_auth: Username and password proxy authentication.
     :param PACFile pac: The PAC to use to resolve the proxy. If not provided, :func:`get_pac` is
         called with default arguments in order to find a PAC file.
+    :param float max_age: Seconds after which a discovered PAC file is refreshed. ``None`` to never refresh.
     """
-    prev_http_proxy, prev_https_proxy = os.environ.get("HTTP_PROXY"), os.environ.get("HTTPS_PROXY")
-    pac = pac or get_pac()
     if pac:
         resolver = ProxyResolver(pac, proxy_auth=proxy_auth)
-        proxies = resolver.get_proxy_for_requests(url)
-        # Cannot set None for environ. (#27)
-        os.environ["HTTP_PROXY"] = proxies.get("http") or ""
-        os.environ["HTTPS_PROXY"] = proxies.get("https") or ""
-    yield
-    if prev_http_proxy:
-        os.environ["HTTP_PROXY"] = prev_http_proxy
-    elif "HTTP_PROXY" in os.environ:
-        del os.environ["HTTP_PROXY"]
-    if prev_https_proxy:
-        os.environ["HTTPS_PROXY"] = prev_https_proxy
-    elif "HTTPS_PROXY" in os.environ:
-        del os.environ["HTTPS_PROXY"]
+    else:
+        resolver = _shared_context_resolver(proxy_auth, max_age)
+    if not resolver:
+        yield
+        return
+
+    proxies = resolver.get_proxy_for_requests(url)
+    # Cannot set None for environ. (#27)
+    entry = (proxies.get("http") or "", proxies.get("https") or "")
+    with _context_env_lock:
+        if not _context_env_entries:
+            _context_env_saved[:] = [os.environ.get("HTTP_PROXY"), os.environ.get("HTTPS_PROXY")]
+        _context_env_entries.append(entry)
+        _set_proxy_env(*entry)
+    try:
+        yield
+    finally:
+        with _context_env_lock:
+            _context_env_entries.remove(entry)
+            if _context_env_entries:
+                _set_proxy_env(*_context_env_entries[-1])
+            else:
+                _set_proxy_env(*_context_env_saved)
+
+
+#: Guards the state below, which is shared by all :func:`pac_context_for_url` calls.
+_context_env_lock = threading.Lock()
+#: Environment variable values of the active contexts, in the order they were entered.
+_context_env_entries = []
+#: ``HTTP_PROXY`` and ``HTTPS_PROXY`` from before the first active context was entered.
+_context_env_saved = [None, None]
+#: PAC file found by discovery for :func:`pac_context_for_url`, and when. ``pac`` is ``None`` if none was found.
+_context_pac = {"pac": None, "found_at": None, "refreshing": False}
+#: Resolvers for the shared PAC file, by proxy credentials.
+_context_resolvers = {}
+#: Serializes discovery for :func:`pac_context_for_url`, without holding up contexts that don't need it.
+_context_discovery_lock = threading.Lock()
+#: Number of hosts, and seconds, for which the shared resolvers remember results of the PAC file.
+#: Results are forgotten so that PAC files that depend on the time of day or on DNS are still respected.
+_CONTEXT_CACHE_SIZE = 1000
+_CONTEXT_CACHE_TTL = 60
+
+
+def _set_proxy_env(http_proxy, https_proxy):
+    """Set the proxy environment variables, skipping those that already have the value. ``None`` unsets."""
+    for name, value in (("HTTP_PROXY", http_proxy), ("HTTPS_PROXY", https_proxy)):
+        if os.environ.get(name) == value:
+            continue
+        if value is None:
+            del os.environ[name]
+        else:
+            os.environ[name] = value
+
+
+def _shared_context_resolver(proxy_auth, max_age):
+    """
+    :returns: A resolver for the PAC file shared by :func:`pac_context_for_url` calls,
+        discovering it first if needed. ``None`` if no PAC file was found.
+    :rtype: ProxyResolver|None
+    """
+    with _context_env_lock:
+        found_at = _context_pac["found_at"]
+    if found_at is None:
+        with _context_discovery_lock:
+            if _context_pac["found_at"] is None:
+                _replace_context_pac(get_pac())
+    elif max_age is not None and monotonic() - found_at >= max_age:
+        with _context_env_lock:
+            start_refresh = not _context_pac["refreshing"]
+            _context_pac["refreshing"] = True
+        if start_refresh:
+            thread = threading.Thread(target=_refresh_context_pac)
+            thread.daemon = True
+            thread.start()
+
+    key = (proxy_auth.username, proxy_auth.password) if proxy_auth else None
+    with _context_env_lock:
+        pac = _context_pac["pac"]
+        if not pac:
+            return
+        resolver = _context_resolvers.get(key)
+        if resolver is None:
+            resolver = ProxyResolver(
+                pac, proxy_auth=proxy_auth, cache_size=_CONTEXT_CACHE_SIZE, cache_ttl=_CONTEXT_CACHE_TTL
+            )
+            _context_resolvers[key] = resolver
+        return resolver
+
+
+def _replace_context_pac(pac):
+    with _context_env_lock:
+        _context_pac.update(pac=pac, found_at=monotonic(), refreshing=False)
+        _context_resolvers.clear()
+
+
+def _refresh_context_pac():
+    """Check the shared PAC file for changes, or search again if none was found."""
+    pac = _context_pac["pac"]
+    try:
+        new_pac = fetch_if_changed(pac) if pac else get_pac()
+    except Exception as e:
+        import logging
+
+        logger = logging.getLogger(__name__)
+        logger.warning("Could not refresh PAC file for pac_context_for_url: {}".format(e), exc_info=True)
+        new_pac = None
+    if new_pac or not pac:
+        _replace_context_pac(new_pac)
+    else:
+        # Unchanged. Check again after another max_age.
+        with _context_env_lock:
+            _context_pac.update(found_at=monotonic(), refreshing=False)
+
+
+def clear_pac_context_cache():
+    """
+    Forget the PAC file and results shared by :func:`pac_context_for_url` calls,
+    so that the next call searches for a PAC file again.
+    """
+    with _context_env_lock:
+        _context_pac.update(pac=None, found_at=None, refreshing=False)
+        _context_resolvers.clear()
 
 
 def default_proxy_fail_response_filter(response):
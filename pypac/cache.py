@@ -0,0 +1,121 @@
+"""
+On-disk cache of PAC discovery results, so that new processes can skip or shorten PAC discovery.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+
+class DiscoveryCache(object):
+    """
+    Remembers which URL a PAC file was found at, along with the PAC file and its validators,
+    or that no PAC file was found. Pass it to :func:`pypac.get_pac` or :class:`pypac.PACSession`
+    using the ``discovery_cache`` keyword.
+
+    The cache is a JSON file. It's written atomically, so processes can share it.
+    """
+
+    def __init__(self, path, ttl=24 * 60 * 60, negative_ttl=5 * 60):
+        """
+        :param str path: Path of the cache file. Its directory must exist.
+        :param float ttl: Seconds for which a found PAC file is used without searching again.
+            It's still revalidated in the background whenever it's used.
+        :param float negative_ttl: Seconds for which a search that found no PAC file is remembered,
+            during which no search happens.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    def load(self, key):
+        """
+        :param list key: Discovery settings that the entry must have been stored with.
+        :returns: The cached entry, or ``None`` if there's no usable entry.
+            The entry has the keys ``pac_url``, which is ``None`` if no PAC file was found,
+            ``pac_js``, ``etag``, ``last_modified``, and ``stored_at``.
+        :rtype: dict|None
+        """
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+            if entry["key"] != key:
+                return
+            age = time.time() - entry["stored_at"]
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return
+        if not 0 <= age < (self.ttl if entry.get("pac_url") else self.negative_ttl):
+            return
+        return entry
+
+    def store_found(self, key, pac_url, pac_js, etag=None, last_modified=None):
+        """
+        Remember that a PAC file was found.
+
+        :param list key: Discovery settings used.
+        :param str pac_url: URL the PAC file was downloaded from.
+        :param str pac_js: Contents of the PAC file.
+        :param str etag: ``ETag`` header of the response, if any.
+        :param str last_modified: ``Last-Modified`` header of the response, if any.
+        """
+        self._write(
+            {
+                "key": key,
+                "stored_at": time.time(),
+                "pac_url": pac_url,
+                "pac_js": pac_js,
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+        )
+
+    def store_not_found(self, key):
+        """
+        Remember that no PAC file was found.
+
+        :param list key: Discovery settings used.
+        """
+        self._write({"key": key, "stored_at": time.time(), "pac_url": None})
+
+    def touch(self, entry):
+        """
+        Mark an entry as fresh again, such as after the server confirmed that the PAC file hasn't changed.
+
+        :param dict entry: Entry from :meth:`load`.
+        """
+        self._write(dict(entry, stored_at=time.time()))
+
+    def clear(self):
+        """Forget the cached result."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _write(self, entry):
+        tmp_path = None
+        try:
+            # Unique, so that threads and processes writing at the same time don't share it.
+            with tempfile.NamedTemporaryFile(
+                "w",
+                dir=os.path.dirname(os.path.abspath(self.path)),
+                prefix=os.path.basename(self.path) + ".",
+                suffix=".tmp",
+                delete=False,
+            ) as f:
+                tmp_path = f.name
+                json.dump(entry, f)
+            if hasattr(os, "replace"):
+                os.replace(tmp_path, self.path)
+            else:  # PY2
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            import logging
+
+            logger = logging.getLogger(__name__)
+            logger.warning("Could not write PAC discovery cache {}: {}".format(self.path, e))
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
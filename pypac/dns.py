@@ -0,0 +1,194 @@
+"""
+Host name lookups made by the PAC JavaScript functions.
+
+By default, lookups use the blocking functions of the :mod:`socket` module.
+Answers obtained elsewhere, such as by an asyncio event loop, can be supplied ahead of a PAC evaluation
+using :func:`preresolved`, so that the evaluation doesn't look them up again.
+In green-thread applications, :func:`set_resolver` hands all other lookups to a cooperative resolver.
+"""
+
+import functools
+import socket
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+#: Callable that takes a host name and returns a list of its addresses, set by :func:`set_resolver`.
+_resolver = None
+
+
+def _preresolved_addresses(host):
+    """
+    :returns: Addresses supplied for the host on this thread, or ``None`` if nothing was supplied.
+    :rtype: list[str]|None
+    """
+    answers = getattr(_local, "answers", None)
+    if answers is None:
+        return None
+    return answers.get(host)
+
+
+def _lookup(host):
+    """
+    :returns: Addresses supplied for the host by :func:`preresolved` or the resolver set by :func:`set_resolver`,
+        or ``None`` if neither applies.
+    :rtype: list[str]|None
+    """
+    addrs = _preresolved_addresses(host)
+    if addrs is not None or _resolver is None:
+        return addrs
+    try:
+        return list(_resolver(host) or [])
+    except socket.error:
+        return []
+
+
+def _not_found(host):
+    return socket.gaierror(socket.EAI_NONAME, "Name or service not known: {}".format(host))
+
+
+class LookupDeferred(Exception):
+    """
+    Raised by a lookup made within :func:`_deferring`, once the lookup has been recorded as pending.
+    Not a :class:`socket.error`, so that the PAC JavaScript functions don't take it for a failed lookup.
+    """
+
+
+@contextmanager
+def _deferring(lookups):
+    """
+    Within this context, lookups on the current thread are answered from `lookups`,
+    a dict of outcomes by ``(function name, host)``. Other lookups aren't made:
+    they're added to `lookups` as pending, with an outcome of ``None``, and raise :class:`LookupDeferred`.
+    :func:`_resolve_pending` makes them later.
+
+    This lets a PAC file be evaluated without blocking on the network while its interpreter is locked.
+    Lookups answered by :func:`preresolved` are never deferred.
+    """
+    previous = getattr(_local, "deferred", None)
+    _local.deferred = lookups
+    try:
+        yield
+    finally:
+        _local.deferred = previous
+
+
+def _resolve_pending(lookups):
+    """
+    Make the lookups recorded as pending by :func:`_deferring`, and record their outcomes.
+
+    :returns: Whether there were any.
+    :rtype: bool
+    """
+    pending = [key for key, outcome in lookups.items() if outcome is None]
+    for func, host in pending:
+        try:
+            lookups[func, host] = _lookups[func](host)
+        except socket.error as e:
+            lookups[func, host] = e
+    return bool(pending)
+
+
+def _deferrable(func):
+    """Decorate a lookup function so that it's deferred within :func:`_deferring`."""
+
+    @functools.wraps(func)
+    def lookup(host):
+        lookups = getattr(_local, "deferred", None)
+        if lookups is None or _preresolved_addresses(host) is not None:
+            return func(host)
+        outcome = lookups.get((func.__name__, host))
+        if outcome is None:
+            lookups[func.__name__, host] = None
+            raise LookupDeferred(host)
+        if isinstance(outcome, socket.error):
+            raise outcome
+        return outcome
+
+    return lookup
+
+
+@_deferrable
+def gethostbyname(host):
+    """
+    Like :func:`socket.gethostbyname`.
+
+    :param str host: Host name to resolve.
+    :returns: An IPv4 address.
+    :rtype: str
+    :raises socket.gaierror: If the host could not be resolved.
+    """
+    addrs = _lookup(host)
+    if addrs is None:
+        return socket.gethostbyname(host)
+    for addr in addrs:
+        if ":" not in addr:
+            return addr
+    raise _not_found(host)
+
+
+@_deferrable
+def getaddrinfo_addresses(host):
+    """
+    Like :func:`socket.getaddrinfo`, but returns only the addresses.
+
+    :param str host: Host name to resolve.
+    :returns: IPv4 and IPv6 addresses, in the order returned by the resolver. May contain duplicates.
+    :rtype: list[str]
+    :raises socket.gaierror: If the host could not be resolved.
+    """
+    addrs = _lookup(host)
+    if addrs is None:
+        return [str(addr[4][0]) for addr in socket.getaddrinfo(host, 0)]
+    if not addrs:
+        raise _not_found(host)
+    return list(addrs)
+
+
+# The functions that make each deferrable lookup, by name.
+_lookups = {
+    "gethostbyname": gethostbyname.__wrapped__,
+    "getaddrinfo_addresses": getaddrinfo_addresses.__wrapped__,
+}
+
+
+@contextmanager
+def preresolved(answers):
+    """
+    Within this context, lookups on the current thread are answered from `answers` where possible.
+    Hosts not in `answers` are looked up as usual.
+
+    :param dict[str, list[str]] answers: Addresses for each host name.
+        An empty list means that the host could not be resolved.
+    """
+    previous = getattr(_local, "answers", None)
+    _local.answers = answers
+    try:
+        yield
+    finally:
+        _local.answers = previous
+
+
+def set_resolver(resolver):
+    """
+    Send lookups made by PAC files to a resolver that cooperates with green threads,
+    such as the one in gevent or eventlet, instead of the blocking functions of the :mod:`socket` module.
+    This is only needed if :mod:`socket` isn't monkey-patched.
+    Applies to the whole process.
+
+    For example, with gevent::
+
+        import gevent.socket
+
+        def resolve(host):
+            return [info[4][0] for info in gevent.socket.getaddrinfo(host, 0)]
+
+        pypac.dns.set_resolver(resolve)
+
+    :param resolver: Callable that takes a host name and returns a list of its IPv4 and IPv6 addresses.
+        An empty list or a :class:`socket.error` means that the host could not be resolved.
+        Pass ``None`` to go back to using the :mod:`socket` module.
+    """
+    global _resolver
+    _resolver = resolver
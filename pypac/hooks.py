@@ -0,0 +1,158 @@
+"""
+Hooks that make libraries which take proxies from the environment consult a PAC file for each request instead.
+
+Unlike :func:`pypac.pac_context_for_url`, which sets one proxy for everything in its scope,
+these pick the proxy for each request's own URL at the time it's made.
+All requests share one resolver, so the PAC file is evaluated once per host for the whole process.
+"""
+
+import threading
+
+from pypac._utils import ON_PY3
+
+if ON_PY3:
+    import urllib.request as urllib_request
+else:  # PY2
+    import urllib2 as urllib_request  # type: ignore
+
+_StandardProxyHandler = urllib_request.ProxyHandler
+_lock = threading.Lock()
+#: What :func:`install` replaced, for :func:`uninstall` to put back. Empty when not installed.
+_originals = {}
+#: The PAC file and credentials given to :func:`install`.
+_config = {"resolver": None, "proxy_auth": None, "max_age": None}
+
+
+def install(pac=None, proxy_auth=None, max_age=60 * 60):
+    """
+    Route requests made with ``urllib.request`` (``urllib2`` on Python 2),
+    and with Requests sessions that trust the environment, according to a PAC file.
+
+    For ``urllib.request``, ``ProxyHandler`` is replaced with :class:`PACProxyHandler`, which is used by
+    ``urlopen()`` and ``build_opener()``. For Requests, ``get_environ_proxies()`` is replaced.
+    Explicitly configured proxies still take precedence. If no PAC file is found,
+    proxies are taken from the environment as usual.
+    Calling this again replaces the configuration.
+
+    :param PACFile pac: The PAC file to consult. If not provided, the one discovered and
+        refreshed for :func:`pypac.pac_context_for_url` is used.
+    :param requests.auth.HTTPProxyAuth proxy_auth: Username and password proxy authentication.
+    :param float max_age: See :func:`pypac.pac_context_for_url`. Not used if `pac` is given.
+    """
+    import requests.sessions
+    import requests.utils
+
+    from pypac.api import _CONTEXT_CACHE_SIZE, _CONTEXT_CACHE_TTL
+    from pypac.resolver import ProxyResolver
+
+    with _lock:
+        resolver = None
+        if pac:
+            resolver = ProxyResolver(
+                pac, proxy_auth=proxy_auth, cache_size=_CONTEXT_CACHE_SIZE, cache_ttl=_CONTEXT_CACHE_TTL
+            )
+        _config.update(resolver=resolver, proxy_auth=proxy_auth, max_age=max_age)
+        if _originals:
+            return
+        _originals.update(
+            utils_get_environ_proxies=requests.utils.get_environ_proxies,
+            sessions_get_environ_proxies=requests.sessions.get_environ_proxies,
+        )
+        urllib_request.ProxyHandler = PACProxyHandler
+        requests.utils.get_environ_proxies = get_environ_proxies
+        requests.sessions.get_environ_proxies = get_environ_proxies
+        # urlopen() keeps the opener it first built, which may have the original handler.
+        urllib_request.install_opener(None)
+
+
+def uninstall():
+    """Undo :func:`install`. Does nothing if it isn't installed."""
+    import requests.sessions
+    import requests.utils
+
+    with _lock:
+        if not _originals:
+            return
+        urllib_request.ProxyHandler = _StandardProxyHandler
+        requests.utils.get_environ_proxies = _originals["utils_get_environ_proxies"]
+        requests.sessions.get_environ_proxies = _originals["sessions_get_environ_proxies"]
+        urllib_request.install_opener(None)
+        _originals.clear()
+        _config.update(resolver=None, proxy_auth=None, max_age=None)
+
+
+def is_installed():
+    """Whether :func:`install` is in effect."""
+    return bool(_originals)
+
+
+def proxy_for_url(url):
+    """
+    :param str url: URL a request is about to be made to.
+    :returns: The proxy URL to use for it according to the PAC file, or ``DIRECT``.
+        ``None`` if there's no PAC file, in which case proxies from the environment apply.
+    :rtype: str|None
+    :raises ProxyConfigExhaustedError: If the PAC file provided no usable proxy.
+    """
+    from pypac.api import _shared_context_resolver
+    from pypac.resolver import ProxyConfigExhaustedError
+
+    resolver = _config["resolver"] or _shared_context_resolver(_config["proxy_auth"], _config["max_age"])
+    if not resolver:
+        return
+    proxy = resolver.get_proxy(url)
+    if not proxy:
+        raise ProxyConfigExhaustedError(url)
+    return proxy
+
+
+def get_environ_proxies(url, no_proxy=None):
+    """
+    Stands in for ``requests.utils.get_environ_proxies()`` while installed.
+
+    :returns: Proxies for the URL in the form Requests expects.
+        Empty for ``DIRECT``. From the environment if there's no PAC file.
+    :rtype: dict
+    """
+    proxy = proxy_for_url(url)
+    if proxy is None:
+        return _originals["utils_get_environ_proxies"](url, no_proxy=no_proxy)
+    if proxy == "DIRECT":
+        return {}
+    return {"http": proxy, "https": proxy}
+
+
+class PACProxyHandler(_StandardProxyHandler):
+    """
+    ``ProxyHandler`` that asks the PAC file for the proxy to use for each request.
+    Given explicit `proxies`, it behaves like the standard ``ProxyHandler``.
+    """
+
+    def __init__(self, proxies=None):
+        self._use_pac = proxies is None
+        _StandardProxyHandler.__init__(self, {} if proxies is None else proxies)
+
+    def _pac_open(self, req):
+        if not self._use_pac:
+            return
+        url = req.get_full_url()
+        proxy = proxy_for_url(url)
+        if proxy is None:
+            environ_proxies = urllib_request.getproxies()
+            proxy = environ_proxies.get(url.split(":", 1)[0].lower())
+            if not proxy or urllib_request.proxy_bypass(_host_of(url)):
+                return
+        elif proxy == "DIRECT":
+            return
+        return self.proxy_open(req, proxy, url.split(":", 1)[0].lower())
+
+    http_open = _pac_open
+    https_open = _pac_open
+
+
+def _host_of(url):
+    if ON_PY3:
+        from urllib.parse import urlparse
+    else:  # PY2
+        from urlparse import urlparse  # type: ignore
+    return urlparse(url).hostname or ""
@@ -0,0 +1,114 @@
+"""
+Shrinking PAC files before they're loaded.
+
+Large PAC files are often mostly comments and indentation, all of which the JavaScript engine has to parse
+and keep in memory. :func:`minify` removes them, and joins concatenated string literals.
+"""
+
+import json
+
+from pypac._js import _PUNCTUATOR_RE, tokenize
+
+#: Punctuators after which a line break can change the meaning, by ending a statement.
+_STATEMENT_END_PUNCTUATORS = frozenset([")", "]", "}", "++", "--"])
+# fmt: off
+#: Tokens after which ``"a" + "b"`` is an operand of its own, so that it can be replaced with ``"ab"``.
+_STRING_CONCAT_AFTER = frozenset([
+    "(", "[", ",", ";", "{", "}", ":", "?", "=", "+=", "==", "!=", "===", "!==", "<", ">", "<=", ">=", "&&", "||",
+    "&", "|", "^", "return", "case",
+])
+#: Tokens before which it's also an operand of its own.
+_STRING_CONCAT_BEFORE = frozenset([
+    ")", "]", ",", ";", "}", ":", "?", "+", "==", "!=", "===", "!==", "<", ">", "<=", ">=", "&&", "||", "&", "|", "^",
+])
+# fmt: on
+
+
+def minify(pac_js):
+    """
+    Remove comments and whitespace from a PAC file, and join string literals that are concatenated
+    with ``+`` such as ``"PROXY " + "proxy.example:8080"``. What the PAC file does isn't changed.
+    Line breaks are kept only where they may end a statement.
+
+    :param str pac_js: JavaScript of the PAC file.
+    :returns: The minified JavaScript.
+    :rtype: str
+    :raises UnsupportedSyntax: If the JavaScript can't be tokenized.
+    """
+    tokens = tokenize(pac_js)
+    parts = []
+    previous = None  # Kind, value, and text of the last token written.
+    index = 0
+    while tokens[index].kind != "eof":
+        token = tokens[index]
+        text = pac_js[token.start : token.end]
+        if token.kind == "string" and (previous is None or _is_concat_boundary(previous, _STRING_CONCAT_AFTER)):
+            value, last = _fold_strings(tokens, index)
+            if last != index:
+                text = json.dumps(value)
+                index = last
+        current = (token.kind, token.value, text)
+        if previous is not None:
+            if token.newline_before and _may_end_statement(previous):
+                parts.append("\n")
+            elif _needs_space(previous, current):
+                parts.append(" ")
+        parts.append(text)
+        previous = current
+        index += 1
+    return "".join(parts)
+
+
+def _fold_strings(tokens, index):
+    """
+    :returns: The value of the string at `index` joined with the strings added to it,
+        and the index of the last of those.
+    """
+    value = tokens[index].value
+    while (
+        tokens[index + 1].kind == "punct"
+        and tokens[index + 1].value == "+"
+        and tokens[index + 2].kind == "string"
+        and (tokens[index + 3].kind == "eof" or _is_concat_boundary(tokens[index + 3], _STRING_CONCAT_BEFORE))
+    ):
+        value += tokens[index + 2].value
+        index += 2
+    return value, index
+
+
+def _is_concat_boundary(token, allowed):
+    if isinstance(token, tuple):
+        kind, value = token[:2]
+    else:
+        kind, value = token.kind, token.value
+    return kind in ("punct", "keyword") and value in allowed
+
+
+def _may_end_statement(token):
+    kind, value, _ = token
+    if kind == "punct":
+        return value in _STATEMENT_END_PUNCTUATORS
+    # Names, literals, and keywords such as return, which can't be followed by a line break.
+    return True
+
+
+def _is_word(kind):
+    return kind in ("name", "keyword", "number")
+
+
+def _needs_space(previous, token):
+    previous_kind, _, previous_text = previous
+    kind, _, text = token
+    if _is_word(kind) and (_is_word(previous_kind) or previous_kind == "regex"):
+        return True
+    if previous_kind == "number" and text.startswith("."):
+        return True
+    if previous_text.endswith("/") and text[:1] in ("/", "*"):
+        return True
+    if (previous_text, text) in (("<", "!"), ("--", ">")):
+        # <!-- and --> start comments in some engines.
+        return True
+    if previous_kind == "punct" and kind == "punct":
+        # Such as + followed by ++, which would be read as ++ followed by +.
+        return _PUNCTUATOR_RE.match(previous_text + text).group() != previous_text
+    return False
@@ -0,0 +1,1307 @@
+"""
+Evaluation of PAC files in Python, without a JavaScript engine.
+
+:func:`compile_pac` translates a PAC file into Python when everything it uses is within a supported subset of
+JavaScript: the usual statements and operators, string and array methods, regular expressions, and the PAC functions.
+Runs of ``if`` statements that match the host by domain, pattern, or network, and return a fixed value,
+are merged into lookup tables, so that they take about the same time however many rules there are.
+So are loops that call ``dnsDomainIs()`` for each domain in an array. :func:`rewrite_domain_loops` replaces
+those loops with a single lookup for the JavaScript engine too.
+
+Use it through ``PACFile(pac_js, native=True)``, which falls back to the JavaScript engine if the PAC file
+can't be compiled, or if anything out of the ordinary comes up while evaluating it.
+"""
+
+import math
+import re
+import socket
+import struct
+from collections import namedtuple
+
+from pypac import parser_functions
+from pypac._js import UnsupportedSyntax, find_function, parse
+from pypac._utils import ON_PY3, is_ipv4_address
+from pypac.parser_functions import function_injections
+from pypac.parser_functions_ex import function_injections as ipv6_functions
+
+if ON_PY3:
+    basestring = str
+
+
+class _Undefined(object):
+    def __repr__(self):
+        return "undefined"
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+_UNDEFINED = _Undefined()
+
+
+class FallbackToJavaScript(Exception):
+    """
+    Raised during evaluation when something comes up that the compiled PAC file doesn't handle,
+    such as a value of an unexpected type. The JavaScript engine should be used instead.
+    """
+
+
+class NativePAC(object):
+    """
+    A PAC file compiled to Python by :func:`compile_pac`.
+    """
+
+    def __init__(self, entry, entry_name):
+        self._entry = entry
+        #: Name of the function that's called: ``FindProxyForURL`` or ``FindProxyForURLEx``.
+        self.entry_name = entry_name
+
+    def find_proxy_for_url(self, url, host):
+        """
+        Equivalent to :meth:`PACFile.find_proxy_for_url <pypac.parser.PACFile.find_proxy_for_url>`.
+
+        :raises FallbackToJavaScript: If the JavaScript engine must be used for this evaluation.
+        """
+        try:
+            value = self._entry.call([url, host])
+        except FallbackToJavaScript:
+            raise
+        except Exception as e:  # noqa: BLE001
+            # Whatever went wrong, the JavaScript engine is the authority on what should happen.
+            raise FallbackToJavaScript(repr(e))
+        if value is _UNDEFINED:
+            return None
+        if value is None or isinstance(value, (basestring, bool, int, float)):
+            return value
+        raise FallbackToJavaScript("Returned {!r}".format(value))
+
+
+def compile_pac(pac_js):
+    """
+    Compile a PAC file to Python.
+
+    :param str pac_js: JavaScript that defines ``FindProxyForURL()`` or ``FindProxyForURLEx()``.
+    :rtype: NativePAC
+    :raises UnsupportedSyntax: If the PAC file uses something that can't be compiled.
+    """
+    program = parse(pac_js)
+    return _Compiler(program).compile()
+
+
+# Conversions and operators, following the ECMAScript specification for the types used here.
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _normalize(number):
+    """
+    :returns: The number as an ``int`` if it's an integer that a double holds exactly, and as a ``float`` otherwise,
+        as JavaScript numbers are doubles.
+    """
+    if isinstance(number, float):
+        if number.is_integer() and abs(number) < 2**53:
+            return int(number)
+    elif abs(number) >= 2**53:
+        return float(number)
+    return number
+
+
+def _to_boolean(value):
+    if value is True or value is False:
+        return value
+    if isinstance(value, basestring):
+        return value != ""
+    if _is_number(value):
+        return not math.isnan(value) and value != 0
+    return value is not None and value is not _UNDEFINED
+
+
+def _to_number(value):
+    if _is_number(value):
+        return value
+    if value is True or value is False:
+        return int(value)
+    if isinstance(value, basestring):
+        text = value.strip()
+        if not text:
+            return 0
+        if re.match(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$", text):
+            return _normalize(float(text))
+        if re.match(r"^0[xX][0-9a-fA-F]+$", text):
+            return int(text, 16)
+        if text in ("Infinity", "+Infinity"):
+            return float("inf")
+        if text == "-Infinity":
+            return float("-inf")
+        return float("nan")
+    if value is None:
+        return 0
+    if value is _UNDEFINED:
+        return float("nan")
+    if isinstance(value, list):
+        return _to_number(_to_string(value))
+    raise FallbackToJavaScript("Number conversion of {!r}".format(value))
+
+
+def _to_string(value):
+    if isinstance(value, basestring):
+        return value
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if _is_number(value):
+        return _number_to_string(value)
+    if value is None:
+        return "null"
+    if value is _UNDEFINED:
+        return "undefined"
+    if isinstance(value, list):
+        return ",".join("" if item is None or item is _UNDEFINED else _to_string(item) for item in value)
+    if isinstance(value, dict):
+        return "[object Object]"
+    raise FallbackToJavaScript("String conversion of {!r}".format(value))
+
+
+def _number_to_string(number):
+    """Format a number like JavaScript's ``Number.prototype.toString()``."""
+    if isinstance(number, int) and abs(number) < 2**53:
+        return str(number)
+    number = float(number)
+    if math.isnan(number):
+        return "NaN"
+    if math.isinf(number):
+        return "Infinity" if number > 0 else "-Infinity"
+    if number == 0:
+        return "0"
+    sign = "-" if number < 0 else ""
+    # repr() gives the shortest digits that round-trip, as JavaScript does, but places the decimal point differently.
+    mantissa, _, exponent = repr(abs(number)).partition("e")
+    whole, _, fraction = mantissa.partition(".")
+    digits = whole + fraction
+    leading_zeros = len(digits) - len(digits.lstrip("0"))
+    # The number is 0.digits * 10**point.
+    point = len(whole) - leading_zeros + int(exponent or 0)
+    digits = digits.strip("0")
+    if len(digits) <= point <= 21:
+        return sign + digits + "0" * (point - len(digits))
+    if 0 < point <= 21:
+        return sign + digits[:point] + "." + digits[point:]
+    if -6 < point <= 0:
+        return sign + "0." + "0" * -point + digits
+    exponent = point - 1
+    mantissa = digits[0] + ("." + digits[1:] if len(digits) > 1 else "")
+    return "{}{}e{}{}".format(sign, mantissa, "+" if exponent > 0 else "-", abs(exponent))
+
+
+def _to_integer(value):
+    number = _to_number(value)
+    if math.isnan(number):
+        return 0
+    if math.isinf(number):
+        return number
+    return int(number)
+
+
+def _to_int32(value):
+    number = _to_number(value)
+    if math.isnan(number) or math.isinf(number):
+        return 0
+    number = int(number) & 0xFFFFFFFF
+    return number - 0x100000000 if number & 0x80000000 else number
+
+
+def _to_uint32(value):
+    return _to_int32(value) & 0xFFFFFFFF
+
+
+def _to_primitive(value):
+    if isinstance(value, (list, dict)):
+        return _to_string(value)
+    if isinstance(value, (_Function, _Builtin, _RegExp)):
+        raise FallbackToJavaScript("Conversion of {!r}".format(value))
+    return value
+
+
+def _typeof(value):
+    if value is True or value is False:
+        return "boolean"
+    if isinstance(value, basestring):
+        return "string"
+    if _is_number(value):
+        return "number"
+    if value is _UNDEFINED:
+        return "undefined"
+    if isinstance(value, (_Function, _Builtin)):
+        return "function"
+    return "object"
+
+
+def _strict_equals(a, b):
+    if _is_number(a) and _is_number(b):
+        return a == b
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (basestring, bool)):
+        return a == b
+    return a is b
+
+
+def _loose_equals(a, b):
+    if (a is None or a is _UNDEFINED) and (b is None or b is _UNDEFINED):
+        return True
+    if a is None or a is _UNDEFINED or b is None or b is _UNDEFINED:
+        return False
+    if (_is_number(a) and _is_number(b)) or type(a) is type(b):
+        return _strict_equals(a, b)
+    if a is True or a is False:
+        return _loose_equals(int(a), b)
+    if b is True or b is False:
+        return _loose_equals(a, int(b))
+    if _is_number(a) and isinstance(b, basestring):
+        return a == _to_number(b)
+    if isinstance(a, basestring) and _is_number(b):
+        return _to_number(a) == b
+    if isinstance(a, (list, dict)) and not isinstance(b, (list, dict)):
+        return _loose_equals(_to_primitive(a), b)
+    if isinstance(b, (list, dict)) and not isinstance(a, (list, dict)):
+        return _loose_equals(a, _to_primitive(b))
+    return False
+
+
+def _add(a, b):
+    a, b = _to_primitive(a), _to_primitive(b)
+    if isinstance(a, basestring) or isinstance(b, basestring):
+        return _to_string(a) + _to_string(b)
+    return _normalize(_to_number(a) + _to_number(b))
+
+
+def _divide(a, b):
+    a, b = _to_number(a), _to_number(b)
+    if b == 0:
+        if math.isnan(a) or a == 0:
+            return float("nan")
+        negative = (a < 0) != (math.copysign(1, b) < 0)
+        return float("-inf") if negative else float("inf")
+    return _normalize(a / float(b))
+
+
+def _remainder(a, b):
+    a, b = _to_number(a), _to_number(b)
+    if b == 0 or math.isnan(a) or math.isnan(b) or math.isinf(a):
+        return float("nan")
+    return _normalize(math.fmod(a, b))
+
+
+def _compare(a, b, operator):
+    a, b = _to_primitive(a), _to_primitive(b)
+    if not (isinstance(a, basestring) and isinstance(b, basestring)):
+        a, b = _to_number(a), _to_number(b)
+        if math.isnan(a) or math.isnan(b):
+            return False
+    if operator == "<":
+        return a < b
+    if operator == ">":
+        return a > b
+    if operator == "<=":
+        return a <= b
+    return a >= b
+
+
+_COMPARISON_OPERATORS = frozenset(["==", "!=", "===", "!==", "<", ">", "<=", ">="])
+_BINARY_OPERATORS = {
+    "+": _add,
+    "-": lambda a, b: _normalize(_to_number(a) - _to_number(b)),
+    "*": lambda a, b: _normalize(_to_number(a) * _to_number(b)),
+    "/": _divide,
+    "%": _remainder,
+    "==": _loose_equals,
+    "!=": lambda a, b: not _loose_equals(a, b),
+    "===": _strict_equals,
+    "!==": lambda a, b: not _strict_equals(a, b),
+    "<": lambda a, b: _compare(a, b, "<"),
+    ">": lambda a, b: _compare(a, b, ">"),
+    "<=": lambda a, b: _compare(a, b, "<="),
+    ">=": lambda a, b: _compare(a, b, ">="),
+    "&": lambda a, b: _to_int32(_to_int32(a) & _to_int32(b)),
+    "|": lambda a, b: _to_int32(_to_int32(a) | _to_int32(b)),
+    "^": lambda a, b: _to_int32(_to_int32(a) ^ _to_int32(b)),
+    "<<": lambda a, b: _to_int32(_to_int32(a) << (_to_uint32(b) & 31)),
+    ">>": lambda a, b: _to_int32(a) >> (_to_uint32(b) & 31),
+    ">>>": lambda a, b: _to_uint32(a) >> (_to_uint32(b) & 31),
+}
+
+
+def _get_property(obj, prop):
+    if isinstance(obj, basestring):
+        if prop == "length":
+            return len(obj)
+        index = _array_index(prop)
+        if index is not None and index < len(obj):
+            return obj[index]
+        return _UNDEFINED
+    if isinstance(obj, list):
+        if prop == "length":
+            return len(obj)
+        index = _array_index(prop)
+        if index is not None and index < len(obj):
+            return obj[index]
+        return _UNDEFINED
+    if isinstance(obj, dict):
+        return obj.get(_to_string(prop), _UNDEFINED)
+    if obj is None or obj is _UNDEFINED or isinstance(obj, (_Function, _Builtin, _RegExp)):
+        raise FallbackToJavaScript("Property {!r} of {!r}".format(prop, obj))
+    return _UNDEFINED
+
+
+def _array_index(prop):
+    if _is_number(prop) and prop >= 0 and prop == int(prop):
+        return int(prop)
+    if isinstance(prop, basestring) and prop.isdigit() and (prop == "0" or not prop.startswith("0")):
+        return int(prop)
+
+
+# String, array, and regular expression methods.
+
+
+def _substring(s, start=_UNDEFINED, end=_UNDEFINED):
+    length = len(s)
+    start = min(max(_to_integer(start), 0), length)
+    end = length if end is _UNDEFINED else min(max(_to_integer(end), 0), length)
+    if start > end:
+        start, end = end, start
+    return s[int(start) : int(end)]
+
+
+def _relative_index(value, length, default):
+    if value is _UNDEFINED:
+        return default
+    index = _to_integer(value)
+    if index < 0:
+        return int(max(length + index, 0))
+    return int(min(index, length))
+
+
+def _slice(s, start=_UNDEFINED, end=_UNDEFINED):
+    length = len(s)
+    start = _relative_index(start, length, 0)
+    end = _relative_index(end, length, length)
+    return s[start:end] if start < end else s[:0]
+
+
+def _substr(s, start=_UNDEFINED, length=_UNDEFINED):
+    start = _relative_index(start, len(s), 0)
+    count = len(s) - start if length is _UNDEFINED else min(max(_to_integer(length), 0), len(s) - start)
+    return s[start : start + int(count)] if count > 0 else ""
+
+
+def _index_of(s, search=_UNDEFINED, position=_UNDEFINED):
+    if isinstance(s, list):
+        start = _relative_index(position, len(s), 0)
+        for index in range(start, len(s)):
+            if _strict_equals(s[index], search):
+                return index
+        return -1
+    start = min(max(_to_integer(position), 0), len(s))
+    return s.find(_to_string(search), int(start))
+
+
+def _last_index_of(s, search=_UNDEFINED, position=_UNDEFINED):
+    if isinstance(s, list):
+        for index in range(len(s) - 1, -1, -1):
+            if _strict_equals(s[index], search):
+                return index
+        return -1
+    search = _to_string(search)
+    number = _to_number(position)
+    end = len(s) if math.isnan(number) else min(max(int(number), 0), len(s))
+    return s.rfind(search, 0, end + len(search))
+
+
+def _char_at(s, position=_UNDEFINED):
+    index = _to_integer(position)
+    return s[int(index)] if 0 <= index < len(s) else ""
+
+
+def _char_code_at(s, position=_UNDEFINED):
+    index = _to_integer(position)
+    if 0 <= index < len(s) and ord(s[int(index)]) < 0x10000:
+        return ord(s[int(index)])
+    if 0 <= index < len(s):
+        raise FallbackToJavaScript("Character outside the Basic Multilingual Plane")
+    return float("nan")
+
+
+def _split(s, separator=_UNDEFINED, limit=_UNDEFINED):
+    if limit is not _UNDEFINED:
+        raise FallbackToJavaScript("split() with a limit")
+    if separator is _UNDEFINED:
+        return [s]
+    if isinstance(separator, _RegExp):
+        raise FallbackToJavaScript("split() with a regular expression")
+    separator = _to_string(separator)
+    if separator == "":
+        return list(s)
+    return s.split(separator)
+
+
+def _replace(s, pattern=_UNDEFINED, replacement=_UNDEFINED):
+    if not isinstance(replacement, basestring) or "$" in replacement:
+        raise FallbackToJavaScript("replace() with a function or special replacement")
+    if isinstance(pattern, _RegExp):
+        return pattern.regex.sub(lambda _: replacement, s, count=1)
+    return s.replace(_to_string(pattern), replacement, 1)
+
+
+def _match(s, pattern=_UNDEFINED):
+    if not isinstance(pattern, _RegExp):
+        raise FallbackToJavaScript("match() with a string")
+    found = pattern.regex.search(s)
+    if not found:
+        return None
+    return [found.group()] + [_UNDEFINED if group is None else group for group in found.groups()]
+
+
+def _search(s, pattern=_UNDEFINED):
+    if not isinstance(pattern, _RegExp):
+        raise FallbackToJavaScript("search() with a string")
+    found = pattern.regex.search(s)
+    return found.start() if found else -1
+
+
+def _join(items, separator=_UNDEFINED):
+    separator = "," if separator is _UNDEFINED else _to_string(separator)
+    return separator.join("" if item is None or item is _UNDEFINED else _to_string(item) for item in items)
+
+
+_STRING_METHODS = {
+    "toLowerCase": lambda s: s.lower(),
+    "toUpperCase": lambda s: s.upper(),
+    "trim": lambda s: s.strip(" \t\n\r\v\f ﻿"),
+    "substring": _substring,
+    "substr": _substr,
+    "slice": _slice,
+    "indexOf": _index_of,
+    "lastIndexOf": _last_index_of,
+    "charAt": _char_at,
+    "charCodeAt": _char_code_at,
+    "split": _split,
+    "replace": _replace,
+    "match": _match,
+    "search": _search,
+    "toString": lambda s: s,
+}
+_ARRAY_METHODS = {
+    "indexOf": _index_of,
+    "lastIndexOf": _last_index_of,
+    "join": _join,
+    "toString": _join,
+}
+_REGEXP_METHODS = {
+    "test": lambda regexp, s=_UNDEFINED: regexp.regex.search(_to_string(s)) is not None,
+}
+_METHOD_NAMES = frozenset(_STRING_METHODS) | frozenset(_ARRAY_METHODS) | frozenset(_REGEXP_METHODS)
+
+
+def _call_method(obj, name, args):
+    if isinstance(obj, basestring):
+        methods = _STRING_METHODS
+    elif isinstance(obj, list):
+        methods = _ARRAY_METHODS
+    elif isinstance(obj, _RegExp):
+        methods = _REGEXP_METHODS
+    else:
+        raise FallbackToJavaScript("Method {} of {!r}".format(name, obj))
+    method = methods.get(name)
+    if method is None:
+        raise FallbackToJavaScript("Method {} of {!r}".format(name, obj))
+    return method(obj, *args)
+
+
+class _RegExp(object):
+    def __init__(self, pattern, flags, line):
+        if set(flags) - set("im"):
+            raise UnsupportedSyntax("Regular expression flags {!r}".format(flags), line)
+        # Python's syntax differs in places. Only allow what means the same in both.
+        if re.search(r"\(\?[^:=!]|\\[^\\/.\-+*?()\[\]{}|^$dDwWsSbBtnrfv0]|\[\^?\]|\$[^|)]", pattern):
+            raise UnsupportedSyntax("Regular expression /{}/".format(pattern), line)
+        python_flags = getattr(re, "ASCII", 0)
+        if "i" in flags:
+            python_flags |= re.IGNORECASE
+        if "m" in flags:
+            python_flags |= re.MULTILINE
+        try:
+            self.regex = re.compile(pattern, python_flags)
+        except re.error:
+            raise UnsupportedSyntax("Regular expression /{}/".format(pattern), line)
+
+    def __repr__(self):
+        return "<RegExp {!r}>".format(self.regex.pattern)
+
+
+class _Builtin(object):
+    """A PAC function implemented in Python."""
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def call(self, args):
+        # Arguments arrive in the Python implementation as dukpy passes them: undefined becomes null.
+        value = self.func(*[None if arg is _UNDEFINED else arg for arg in args])
+        if value is None or isinstance(value, (basestring, bool, int, float)):
+            return value
+        raise FallbackToJavaScript("{}() returned {!r}".format(self.name, value))
+
+    def __repr__(self):
+        return "<builtin {}>".format(self.name)
+
+
+class _Function(object):
+    """A function defined in the PAC file."""
+
+    def __init__(self, name):
+        self.name = name
+        self.param_count = 0
+        self.local_count = 0
+        self.body = None
+
+    def call(self, args):
+        frame = [_UNDEFINED] * self.local_count
+        frame[: min(len(args), self.param_count)] = args[: self.param_count]
+        completion = self.body(frame)
+        if isinstance(completion, _Return):
+            return completion.value
+        return _UNDEFINED
+
+    def __repr__(self):
+        return "<function {}>".format(self.name)
+
+
+class _Return(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+_BREAK = object()
+_CONTINUE = object()
+
+
+def _run_statements(statements):
+    if len(statements) == 1:
+        return statements[0]
+
+    def run(frame):
+        for statement in statements:
+            completion = statement(frame)
+            if completion is not None:
+                return completion
+
+    return run
+
+
+class _Compiler(object):
+    def __init__(self, program):
+        self.program = program
+        self.globals = {}
+        self.functions = {}
+        self.locals = None  # Names of the function being compiled, by frame index.
+        self.domain_loops = {loop.node: loop for loop in find_domain_loops(program)}
+
+    def compile(self):
+        program = self.program
+        for statement in program.body:
+            if statement.kind == "Function":
+                self.functions[statement.name] = _Function(statement.name)
+            elif statement.kind == "Var":
+                for name, _ in statement.declarations:
+                    self.globals[name] = _UNDEFINED
+            elif statement.kind != "Empty":
+                raise UnsupportedSyntax("Top-level code other than functions and variables", statement.line)
+        for name in ("FindProxyForURL", "FindProxyForURLEx"):
+            if name in self.functions:
+                entry_name = name
+                break
+        else:
+            raise UnsupportedSyntax("No FindProxyForURL() function", 1)
+        for node in program.walk():
+            if node.kind == "Function" and node.name is None:
+                raise UnsupportedSyntax("Function expression", node.line)
+
+        for name in self.functions:
+            self.compile_function(find_function(program, name))
+        self.locals = []
+        frame = []
+        for statement in program.body:
+            if statement.kind == "Var":
+                for name, value in statement.declarations:
+                    if name in self.functions:
+                        raise UnsupportedSyntax("Variable with the name of a function", statement.line)
+                    if value is None:
+                        continue
+                    try:
+                        self.globals[name] = self.expression(value)(frame)
+                    except FallbackToJavaScript:
+                        raise UnsupportedSyntax("Initial value of {}".format(name), statement.line)
+        return NativePAC(self.functions[entry_name], entry_name)
+
+    def compile_function(self, node):
+        function = self.functions[node.name]
+        self.locals = list(node.params)
+        for child in node.walk():
+            if child is not node and child.kind == "Function":
+                raise UnsupportedSyntax("Nested function", child.line)
+            if child.kind == "Var":
+                for name, _ in child.declarations:
+                    if name not in self.locals:
+                        self.locals.append(name)
+        body = self.statements(node.body)
+        function.param_count = len(node.params)
+        function.local_count = len(self.locals)
+        function.body = body
+
+    # Statements
+
+    def statements(self, nodes):
+        compiled = []
+        index = 0
+        while index < len(nodes):
+            rules, index = self.rule_table(nodes, index)
+            if rules is not None:
+                compiled.append(rules)
+                continue
+            statement = self.statement(nodes[index])
+            if statement is not None:
+                compiled.append(statement)
+            index += 1
+        if not compiled:
+            return lambda frame: None
+        return _run_statements(compiled)
+
+    def statement(self, node):
+        kind = node.kind
+        if kind == "Empty":
+            return
+        if kind == "Expression":
+            expression = self.expression(node.expression)
+
+            def run_expression(frame):
+                expression(frame)
+
+            return run_expression
+        if kind == "Var":
+            assignments = [
+                (self.locals.index(name), self.expression(value))
+                for name, value in node.declarations
+                if value is not None
+            ]
+
+            def run_var(frame):
+                for index, value in assignments:
+                    frame[index] = value(frame)
+
+            return run_var
+        if kind == "Return":
+            if node.value is None:
+                return lambda frame: _Return(_UNDEFINED)
+            value = self.expression(node.value)
+            return lambda frame: _Return(value(frame))
+        if kind == "If":
+            test = self.condition(node.test)
+            consequent = self.statement(node.consequent) or (lambda frame: None)
+            alternate = self.statement(node.alternate) if node.alternate is not None else None
+
+            def run_if(frame):
+                if test(frame):
+                    return consequent(frame)
+                if alternate is not None:
+                    return alternate(frame)
+
+            return run_if
+        if kind == "Block":
+            return self.statements(node.body)
+        if kind == "Break":
+            return lambda frame: _BREAK
+        if kind == "Continue":
+            return lambda frame: _CONTINUE
+        if kind in ("For", "While"):
+            return self.loop(node)
+        if kind == "ForIn":
+            return self.for_in(node)
+        raise UnsupportedSyntax("{} statement".format(kind), node.line)
+
+    def loop(self, node):
+        init = update = None
+        if node.kind == "For":
+            if node.init is not None:
+                init = self.statement(node.init) if node.init.kind == "Var" else self.expression(node.init)
+            if node.update is not None:
+                update = self.expression(node.update)
+        test = self.condition(node.test) if node.test is not None else (lambda frame: True)
+        body = self.statement(node.body) or (lambda frame: None)
+
+        def run_loop(frame):
+            if init is not None:
+                init(frame)
+            while test(frame):
+                completion = body(frame)
+                if completion is not None:
+                    if completion is _BREAK:
+                        break
+                    if completion is not _CONTINUE:
+                        return completion
+                if update is not None:
+                    update(frame)
+
+        return run_loop
+
+    def for_in(self, node):
+        target = node.target
+        if target.kind == "Var":
+            name = target.declarations[0][0]
+        elif target.kind == "Identifier":
+            name = target.name
+        else:
+            raise UnsupportedSyntax("for-in loop target", node.line)
+        if name not in self.locals:
+            raise UnsupportedSyntax("Assignment to a global variable", node.line)
+        index = self.locals.index(name)
+        obj = self.expression(node.object)
+        body = self.statement(node.body) or (lambda frame: None)
+
+        def run_for_in(frame):
+            value = obj(frame)
+            if isinstance(value, (list, basestring)):
+                keys = [str(i) for i in range(len(value))]
+            elif isinstance(value, dict):
+                keys = list(value)
+            elif value is None or value is _UNDEFINED:
+                keys = []
+            else:
+                raise FallbackToJavaScript("for-in over {!r}".format(value))
+            for key in keys:
+                frame[index] = key
+                completion = body(frame)
+                if completion is not None:
+                    if completion is _BREAK:
+                        break
+                    if completion is not _CONTINUE:
+                        return completion
+
+        return run_for_in
+
+    def rule_table(self, nodes, index):
+        """
+        Merge a run of ``if (<host match>) return <literal>;`` statements into one lookup.
+
+        :returns: The compiled run and the index of the statement after it, or ``None`` and `index`.
+        """
+        table = None
+        end = index
+        while end < len(nodes):
+            node = nodes[end]
+            loop = self.domain_loops.get(node)
+            if loop is not None and self.is_builtin("dnsDomainIs"):
+                terms = [(loop.host, "suffix", domain.lower()) for domain in loop.domains]
+                if table is not None and loop.host != table.host_name:
+                    break
+                if table is None:
+                    table = _RuleTable(loop.host)
+                table.add(terms, loop.value.value)
+                end += 1
+                continue
+            if node.kind != "If" or node.alternate is not None:
+                break
+            consequent = node.consequent
+            if consequent.kind == "Block" and len(consequent.body) == 1:
+                consequent = consequent.body[0]
+            if consequent.kind != "Return" or consequent.value is None or consequent.value.kind != "Literal":
+                break
+            terms = self.host_match_terms(node.test)
+            if terms is None:
+                break
+            host_names = {name for name, _, _ in terms}
+            if len(host_names) > 1 or (table is not None and host_names - {table.host_name}):
+                break
+            if table is None:
+                table = _RuleTable(terms[0][0] if terms else None)
+            table.add(terms, consequent.value.value)
+            end += 1
+        if table is None or table.host_name is None:
+            return None, index
+        host = self.identifier(table.host_name, nodes[index].line)
+        return table.compile(host), end
+
+    def host_match_terms(self, test):
+        """
+        :returns: ``(host variable name, kind, key)`` for each alternative of a condition that only matches
+            the host in ways that can be looked up in a table, or ``None``.
+        """
+        if test.kind == "Binary" and test.operator == "||":
+            left, right = self.host_match_terms(test.left), self.host_match_terms(test.right)
+            if left is None or right is None:
+                return
+            return left + right
+        if test.kind == "Binary" and test.operator in ("==", "==="):
+            for host, other in ((test.left, test.right), (test.right, test.left)):
+                if host.kind == "Identifier" and other.kind == "Literal" and isinstance(other.value, basestring):
+                    return [(host.name, "exact", other.value)]
+            return
+        if test.kind != "Call" or test.callee.kind != "Identifier" or not self.is_builtin(test.callee.name):
+            return
+        name, args = test.callee.name, test.arguments
+        if not args or args[0].kind != "Identifier":
+            if name == "isInNet" and args and _is_call(args[0], "dnsResolve") and self.is_builtin("dnsResolve"):
+                host_arg = args[0].arguments[0] if len(args[0].arguments) == 1 else None
+            else:
+                return
+        else:
+            host_arg = args[0]
+        if host_arg is None or host_arg.kind != "Identifier":
+            return
+        literals = [arg.value for arg in args[1:] if arg.kind == "Literal" and isinstance(arg.value, basestring)]
+        if len(literals) != len(args) - 1:
+            return
+        host = host_arg.name
+        if name == "dnsDomainIs" and len(literals) == 1:
+            return [(host, "suffix", literals[0].lower())]
+        if name == "shExpMatch" and len(literals) == 1:
+            pattern = literals[0].lower()
+            if not any(char in pattern for char in "*?["):
+                return [(host, "exact_ci", pattern)]
+            if pattern.startswith("*") and not any(char in pattern[1:] for char in "*?["):
+                return [(host, "suffix", pattern[1:])]
+            return
+        if name == "isInNet" and len(literals) == 2:
+            network, mask = literals
+            if not is_ipv4_address(network) or not is_ipv4_address(mask):
+                return [(host, "never", None)]
+            mask_int = _ipv4_int(mask)
+            return [(host, "network", (mask_int, _ipv4_int(network) & mask_int))]
+        if name == "isPlainHostName" and not literals:
+            return [(host, "plain", None)]
+
+    def is_builtin(self, name):
+        """Whether `name` refers to the PAC function of that name."""
+        return name not in self.locals and name not in self.globals and name not in self.functions
+
+    # Expressions
+
+    def condition(self, node):
+        """Compile an expression whose value is only used as a boolean."""
+        kind = node.kind
+        if kind == "Binary" and node.operator in ("&&", "||"):
+            left, right = self.condition(node.left), self.condition(node.right)
+            if node.operator == "&&":
+                return lambda frame: left(frame) and right(frame)
+            return lambda frame: left(frame) or right(frame)
+        if kind == "Unary" and node.operator == "!":
+            operand = self.condition(node.operand)
+            return lambda frame: not operand(frame)
+        if kind == "Binary" and node.operator in _COMPARISON_OPERATORS:
+            # Comparisons already produce booleans.
+            return self.expression(node)
+        expression = self.expression(node)
+        return lambda frame: _to_boolean(expression(frame))
+
+    def expression(self, node):
+        handler = getattr(self, "expression_" + node.kind.lower(), None)
+        if handler is None:
+            raise UnsupportedSyntax("{} expression".format(node.kind), node.line)
+        return handler(node)
+
+    def expression_literal(self, node):
+        value = node.value
+        return lambda frame: value
+
+    def expression_regex(self, node):
+        regexp = _RegExp(node.pattern, node.flags, node.line)
+        return lambda frame: regexp
+
+    def expression_identifier(self, node):
+        return self.identifier(node.name, node.line)
+
+    def identifier(self, name, line):
+        if name in self.locals:
+            index = self.locals.index(name)
+            return lambda frame: frame[index]
+        if name in self.functions:
+            function = self.functions[name]
+            return lambda frame: function
+        if name in self.globals:
+            global_values = self.globals
+            return lambda frame: global_values[name]
+        builtin = _builtin(name)
+        if builtin is not None:
+            return lambda frame: builtin
+        constants = {"undefined": _UNDEFINED, "NaN": float("nan"), "Infinity": float("inf")}
+        if name in constants:
+            value = constants[name]
+            return lambda frame: value
+        raise UnsupportedSyntax("Reference to {}".format(name), line)
+
+    def expression_array(self, node):
+        elements = [self.expression(element) for element in node.elements]
+        return lambda frame: [element(frame) for element in elements]
+
+    def expression_object(self, node):
+        properties = [(key, self.expression(value)) for key, value in node.properties]
+        return lambda frame: {key: value(frame) for key, value in properties}
+
+    def expression_member(self, node):
+        obj = self.expression(node.object)
+        if not node.computed:
+            name = node.property.value
+            return lambda frame: _get_property(obj(frame), name)
+        prop = self.expression(node.property)
+        return lambda frame: _get_property(obj(frame), prop(frame))
+
+    def expression_call(self, node):
+        args = [self.expression(arg) for arg in node.arguments]
+        callee = node.callee
+        if callee.kind == "Member" and not callee.computed:
+            name = callee.property.value
+            if name not in _METHOD_NAMES:
+                raise UnsupportedSyntax("Method {}()".format(name), node.line)
+            obj = self.expression(callee.object)
+            return lambda frame: _call_method(obj(frame), name, [arg(frame) for arg in args])
+        if callee.kind != "Identifier":
+            raise UnsupportedSyntax("Call of an expression", node.line)
+        function = None
+        if callee.name not in self.locals and callee.name not in self.globals:
+            function = self.identifier(callee.name, node.line)(None)
+        if not isinstance(function, (_Function, _Builtin)):
+            raise UnsupportedSyntax("Call of {}".format(callee.name), node.line)
+        call = function.call
+        return lambda frame: call([arg(frame) for arg in args])
+
+    def expression_unary(self, node):
+        operand = self.expression(node.operand)
+        operator = node.operator
+        if operator == "!":
+            return lambda frame: not _to_boolean(operand(frame))
+        if operator == "-":
+            return lambda frame: _normalize(-_to_number(operand(frame)))
+        if operator == "+":
+            return lambda frame: _to_number(operand(frame))
+        if operator == "~":
+            return lambda frame: _to_int32(~_to_int32(operand(frame)))
+        if operator == "typeof":
+            if node.operand.kind == "Identifier":
+                try:
+                    operand = self.expression(node.operand)
+                except UnsupportedSyntax:
+                    return lambda frame: "undefined"
+            return lambda frame: _typeof(operand(frame))
+        if operator == "void":
+            return lambda frame: (operand(frame), _UNDEFINED)[1]
+        raise UnsupportedSyntax("'{}' operator".format(operator), node.line)
+
+    def expression_binary(self, node):
+        left, right = self.expression(node.left), self.expression(node.right)
+        operator = node.operator
+        if operator == "&&":
+            return lambda frame: right(frame) if _to_boolean(left(frame)) else left(frame)
+        if operator == "||":
+
+            def run_or(frame):
+                value = left(frame)
+                return value if _to_boolean(value) else right(frame)
+
+            return run_or
+        function = _BINARY_OPERATORS.get(operator)
+        if function is None:
+            raise UnsupportedSyntax("'{}' operator".format(operator), node.line)
+        return lambda frame: function(left(frame), right(frame))
+
+    def expression_conditional(self, node):
+        test = self.condition(node.test)
+        consequent, alternate = self.expression(node.consequent), self.expression(node.alternate)
+        return lambda frame: consequent(frame) if test(frame) else alternate(frame)
+
+    def expression_sequence(self, node):
+        expressions = [self.expression(expression) for expression in node.expressions]
+
+        def run_sequence(frame):
+            value = _UNDEFINED
+            for expression in expressions:
+                value = expression(frame)
+            return value
+
+        return run_sequence
+
+    def local_index(self, target, line):
+        if target.kind != "Identifier":
+            raise UnsupportedSyntax("Assignment to a property", line)
+        if target.name not in self.locals:
+            raise UnsupportedSyntax("Assignment to a global variable", line)
+        return self.locals.index(target.name)
+
+    def expression_assign(self, node):
+        index = self.local_index(node.target, node.line)
+        value = self.expression(node.value)
+        if node.operator == "=":
+
+            def run_assign(frame):
+                frame[index] = result = value(frame)
+                return result
+
+            return run_assign
+        function = _BINARY_OPERATORS.get(node.operator[:-1])
+        if function is None:
+            raise UnsupportedSyntax("'{}' operator".format(node.operator), node.line)
+
+        def run_compound_assign(frame):
+            frame[index] = result = function(frame[index], value(frame))
+            return result
+
+        return run_compound_assign
+
+    def expression_update(self, node):
+        index = self.local_index(node.target, node.line)
+        delta = 1 if node.operator == "++" else -1
+        prefix = node.prefix
+
+        def run_update(frame):
+            old = _to_number(frame[index])
+            frame[index] = new = _normalize(old + delta)
+            return new if prefix else old
+
+        return run_update
+
+
+def _builtin(name):
+    func = function_injections.get(name) or ipv6_functions.get(name)
+    if func is not None:
+        return _Builtin(name, func)
+
+
+def _is_call(node, name):
+    return node.kind == "Call" and node.callee.kind == "Identifier" and node.callee.name == name
+
+
+def _ipv4_int(address):
+    return struct.unpack("!L", socket.inet_aton(address))[0]
+
+
+class _RuleTable(object):
+    """
+    A run of rules that each return a fixed value if the host matches, merged into lookups.
+    The first rule that matches wins, as it would when evaluating them in order.
+    """
+
+    def __init__(self, host_name):
+        self.host_name = host_name
+        self.values = []
+        self.exact = {}
+        self.exact_ci = {}
+        self.suffixes = {}  # By length.
+        self.networks = {}  # By mask.
+        self.plain = None
+
+    def add(self, terms, value):
+        rule = len(self.values)
+        self.values.append(value)
+        for _, kind, key in terms:
+            if kind == "exact":
+                self.exact.setdefault(key, rule)
+            elif kind == "exact_ci":
+                self.exact_ci.setdefault(key, rule)
+            elif kind == "suffix":
+                self.suffixes.setdefault(len(key), {}).setdefault(key, rule)
+            elif kind == "network":
+                mask, network = key
+                self.networks.setdefault(mask, {}).setdefault(network, rule)
+            elif kind == "plain" and self.plain is None:
+                self.plain = rule
+
+    def compile(self, host):
+        values = self.values
+        exact, exact_ci, plain = self.exact, self.exact_ci, self.plain
+        suffixes = sorted(self.suffixes.items())
+        networks = list(self.networks.items())
+        first_network_rule = min([min(table.values()) for table in self.networks.values()] or [len(values)])
+        never = len(values)
+
+        def run_rules(frame):
+            name = host(frame)
+            if not isinstance(name, basestring):
+                raise FallbackToJavaScript("Host {!r}".format(name))
+            best = exact.get(name, never)
+            if exact_ci or suffixes:
+                lowered = name.lower()
+                best = min(best, exact_ci.get(lowered, never))
+                length = len(lowered)
+                for suffix_length, table in suffixes:
+                    if suffix_length > length:
+                        break
+                    best = min(best, table.get(lowered[length - suffix_length :], never))
+            if plain is not None and plain < best and "." not in name:
+                best = plain
+            if first_network_rule < best and name:
+                address = name if is_ipv4_address(name) else parser_functions.dnsResolve(name)
+                if address and is_ipv4_address(address):
+                    address = _ipv4_int(address)
+                    for mask, table in networks:
+                        best = min(best, table.get(address & mask, never))
+            if best < never:
+                return _Return(values[best])
+
+        return run_rules
+
+
+# Loops over literal arrays of domains.
+
+#: A loop recognized by :func:`pypac.static.domain_loop` that can be replaced with a :class:`DomainSet` lookup.
+#: ``node`` is the ``For`` statement, ``host`` the name of the host variable, ``array`` the name of the array,
+#: and ``value`` the ``Literal`` node returned when a domain matches.
+DomainLoop = namedtuple("DomainLoop", ["node", "host", "array", "domains", "value"])
+
+
+class DomainSet(object):
+    """
+    Tells whether a host is in any of a set of domains, the same as calling ``dnsDomainIs()`` with each of them,
+    but with one lookup per distinct domain length instead of one call per domain.
+    """
+
+    def __init__(self, domains):
+        self._by_length = {}
+        for domain in domains:
+            self._by_length.setdefault(len(domain), set()).add(domain.lower())
+        self._lengths = sorted(self._by_length)
+
+    def __call__(self, host):
+        host = host.lower()
+        length = len(host)
+        for domain_length in self._lengths:
+            if domain_length > length:
+                break
+            if host[length - domain_length :] in self._by_length[domain_length]:
+                return True
+        return False
+
+    def __len__(self):
+        return sum(len(domains) for domains in self._by_length.values())
+
+
+def find_domain_loops(program):
+    """
+    Find loops that check a host against each domain in a top-level array literal, which can be replaced
+    with a :class:`DomainSet` lookup without changing what the PAC file does.
+    That's the case if ``dnsDomainIs()`` is the PAC function, the array isn't used anywhere else,
+    and the loop variable isn't used after the loop.
+
+    :param Node program: Parsed PAC file.
+    :rtype: list[DomainLoop]
+    """
+    from pypac.static import domain_loop
+
+    if _redefines(program, "dnsDomainIs"):
+        return []
+    arrays = {}
+    declared = set()
+    for statement in program.body:
+        if statement.kind == "Var":
+            for name, value in statement.declarations:
+                if name in declared or name in arrays:
+                    arrays.pop(name, None)
+                elif value is not None and value.kind == "Array":
+                    arrays[name] = value
+                declared.add(name)
+
+    loops = []
+    for function in program.body:
+        if function.kind != "Function":
+            continue
+        function_locals = set(function.params)
+        references = {}
+        for node in function.walk():
+            if node.kind == "Var":
+                function_locals.update(name for name, _ in node.declarations)
+            elif node.kind == "Identifier":
+                references[node.name] = references.get(node.name, 0) + 1
+        for node in function.walk():
+            host = _loop_host(node)
+            found = domain_loop(node, host, arrays) if host else None
+            if not found or not found[0]:
+                continue
+            array, index = node.test.right.object.name, node.test.left.name
+            in_loop = sum(1 for child in node.walk() if child.kind == "Identifier" and child.name == index)
+            if array in function_locals or index not in function_locals or references[index] != in_loop:
+                continue
+            loops.append(DomainLoop(node, host, array, found[0], found[1]))
+
+    # Only arrays that are used by nothing but these loops are certain not to change.
+    references = {}
+    for node in program.walk():
+        if node.kind == "Identifier":
+            references[node.name] = references.get(node.name, 0) + 1
+    in_loops = {}
+    for loop in loops:
+        count = sum(1 for node in loop.node.walk() if node.kind == "Identifier" and node.name == loop.array)
+        in_loops[loop.array] = in_loops.get(loop.array, 0) + count
+    return [loop for loop in loops if references[loop.array] == in_loops[loop.array]]
+
+
+def _redefines(program, name):
+    """Whether the PAC file declares or assigns `name` anywhere, rather than only calling the PAC function."""
+    references = calls = 0
+    for node in program.walk():
+        if node.kind == "Function" and (node.name == name or name in node.params):
+            return True
+        if node.kind == "Var" and any(declared == name for declared, _ in node.declarations):
+            return True
+        if node.kind == "Identifier" and node.name == name:
+            references += 1
+        elif _is_call(node, name):
+            calls += 1
+    return references != calls
+
+
+def _loop_host(node):
+    """The name of the host variable, if `node` looks like a loop of ``if (dnsDomainIs(host, ...))``."""
+    if node.kind != "For":
+        return
+    body = node.body
+    if body.kind == "Block" and len(body.body) == 1:
+        body = body.body[0]
+    if body.kind == "If" and _is_call(body.test, "dnsDomainIs") and body.test.arguments:
+        host = body.test.arguments[0]
+        return host.name if host.kind == "Identifier" else None
+
+
+def rewrite_domain_loops(pac_js):
+    """
+    Replace the loops found by :func:`find_domain_loops` in a PAC file with calls to a function
+    that does a :class:`DomainSet` lookup. The functions must be defined before the PAC file is loaded.
+    Line numbers stay the same.
+
+    :param str pac_js: JavaScript of the PAC file.
+    :returns: The JavaScript, and the functions it calls by name.
+    :rtype: tuple[str, dict[str, DomainSet]]
+    :raises UnsupportedSyntax: If the PAC file can't be parsed.
+    """
+    loops = find_domain_loops(parse(pac_js))
+    functions = {}
+    names = {}
+    parts = []
+    position = 0
+    for loop in sorted(loops, key=lambda loop: loop.node.start):
+        if loop.array not in names:
+            names[loop.array] = "_pypacDomainSet{}".format(len(names))
+            functions[names[loop.array]] = DomainSet(loop.domains)
+        replaced = pac_js[loop.node.start : loop.node.end]
+        parts.append(pac_js[position : loop.node.start])
+        parts.append(
+            "if ({}({})) return {};".format(names[loop.array], loop.host, pac_js[loop.value.start : loop.value.end])
+        )
+        parts.append("\n" * replaced.count("\n"))
+        position = loop.node.end
+    parts.append(pac_js[position:])
+    return "".join(parts), functions
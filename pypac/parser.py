@@ -2,12 +2,18 @@
 Functions and classes for parsing and executing PAC files.
 """
 
+import hashlib
 import itertools
+import threading
 import warnings
 
+from pypac._utils import ON_PY3
 from pypac.parser_functions import function_injections
 from pypac.parser_functions_ex import function_injections as ipv6_functions
 
+if ON_PY3:
+    basestring = str
+
 
 def _inject_function_into_js(context, name, func):
     """
@@ -31,6 +37,10 @@ def _inject_function_into_js(context, name, func):
     )
 
 
+#: Times that a PAC file is evaluated again with the answers to the host name lookups it deferred.
+_MAX_LOOKUP_ROUNDS = 16
+
+
 class PACFile(object):
     """
     Represents a PAC file.
@@ -40,22 +50,78 @@ class PACFile(object):
     .. _dukpy: https://github.com/amol-/dukpy
     """
 
-    def __init__(self, pac_js, **kwargs):
+    def __init__(
+        self,
+        pac_js,
+        native=False,
+        domain_sets=False,
+        minify=False,
+        keep_source=True,
+        timeout=None,
+        memory_limit=None,
+        **kwargs,
+    ):
         """
         Load a PAC file from a given string of JavaScript.
         Errors during parsing and validation may raise a specialized exception.
 
         :param str pac_js: JavaScript that defines the ``FindProxyForURL()``
             or ``FindProxyForURLEx()`` function.
+        :param bool native: Evaluate the PAC file as Python compiled by :func:`pypac.native.compile_pac`
+            if possible, using JavaScript only for what the compiled code doesn't handle.
+        :param bool domain_sets: Replace loops that call ``dnsDomainIs()`` for each domain in an array
+            with one lookup in a set of the domains. See :func:`pypac.native.rewrite_domain_loops`.
+            Loops aren't replaced if the PAC file defines a ``dnsDomainIs()`` of its own.
+        :param bool minify: Remove comments and whitespace before loading. See :func:`pypac.minify.minify`.
+        :param bool keep_source: Keep the JavaScript in :attr:`js`. If ``False``, only :attr:`sha256` is kept,
+            which saves memory for large PAC files.
+        :param float timeout: Seconds allowed for loading the PAC file, and for each call to ``FindProxyForURL()``.
+            If set, the PAC file is evaluated in a separate process, which is stopped when it runs out of time.
+            See :class:`pypac.sandbox.Sandbox`.
+        :param int memory_limit: Bytes of memory that the PAC file may use. If set, the PAC file is evaluated
+            in a separate process that can't grow any further. Only enforced on Linux.
+            With either `timeout` or `memory_limit`, that process evaluates one call at a time,
+            including its host name lookups, so concurrent calls are serialized.
+            Time spent waiting for other calls doesn't count towards `timeout`.
         :raises MalformedPacError: If the JavaScript could not be parsed,
             does not define the expected function, or is otherwise invalid.
+        :raises PacTimeoutError: If loading the PAC file takes longer than `timeout`.
+        :raises PacMemoryError: If loading the PAC file takes more than `memory_limit`.
         """
         self._entry_func = "FindProxyForURL"
+        self._reads_url = None
+        self._native = None
+        #: What ``FindProxyForURL()`` returns for every URL, if it's certain to always return the same string,
+        #: in which case it isn't evaluated, and no JavaScript interpreter is kept. ``None`` otherwise.
+        self.constant_result = None
+        # For loading a new version of the PAC file the same way.
+        self._options = {
+            "native": native,
+            "domain_sets": domain_sets,
+            "minify": minify,
+            "keep_source": keep_source,
+            "timeout": timeout,
+            "memory_limit": memory_limit,
+        }
+        self._sandbox = None
+        #: Where the PAC file came from, as a :class:`pypac.refresh.PACSource`. Set by :func:`pypac.get_pac`.
+        self.source = None
+        # The interpreter can't be used by several threads at once.
+        # Host name lookups are made without holding it: see _evaluate().
+        self._lock = threading.Lock()
         if kwargs.get("recursion_limit"):
             import warnings
 
             warnings.warn("recursion_limit is deprecated and has no effect. It will be removed in a future release.")
 
+        #: The JavaScript of the PAC file, as given. ``None`` if loaded with ``keep_source=False``.
+        self.js = pac_js if keep_source else None
+        #: Hex SHA-256 digest of the JavaScript of the PAC file, as given.
+        self.sha256 = hashlib.sha256(pac_js.encode("utf-8")).hexdigest()
+        if timeout is not None or memory_limit is not None:
+            self._load_in_sandbox(pac_js, native, domain_sets, minify, timeout, memory_limit)
+            return
+
         from dukpy import JSInterpreter, JSRuntimeError
 
         try:
@@ -65,14 +131,53 @@ class PACFile(object):
             # https://issues.chromium.org/issues/40955802
             for name, func in itertools.chain(function_injections.items(), ipv6_functions.items()):
                 _inject_function_into_js(self._context, name, func)
-            self._context.evaljs(pac_js)
+            loaded_js = _minify(pac_js) if minify else pac_js
+            if domain_sets:
+                loaded_js, lookups = _rewrite_domain_loops(loaded_js)
+                for name, lookup in lookups.items():
+                    _inject_function_into_js(self._context, name, lookup)
+            self._context.evaljs(loaded_js)
 
             # A test call to weed out errors like unimplemented functions.
-            self.find_proxy_for_url("/", "0.0.0.0")
+            result = self.find_proxy_for_url("/", "0.0.0.0")
 
         except JSRuntimeError as e:
             raise MalformedPacError(original_exc=e)  # from e
-        self.js = pac_js
+        # Not from the interpreter, as Duktape (dukpy < 0.6.0) doesn't give the source of functions.
+        entry_source = _function_source(pac_js, self._entry_func)
+        self._reads_url = entry_source is None or _function_reads_first_param(entry_source)
+        constant_result = _constant_return(entry_source) if entry_source is not None else None
+        if constant_result is not None and constant_result == result:
+            self.constant_result = constant_result
+            self._reads_url = False
+            self._context = None
+        elif native:
+            self._native = _compile_native(loaded_js if minify else pac_js)
+
+    def _load_in_sandbox(self, pac_js, native, domain_sets, minify, timeout, memory_limit):
+        from pypac.sandbox import Sandbox
+
+        self._context = None
+        # Minified here, so that only the minified JavaScript is kept for restarting the worker process.
+        options = {"native": native, "domain_sets": domain_sets}
+        sandbox = Sandbox(_minify(pac_js) if minify else pac_js, options, timeout, memory_limit)
+        self._reads_url = sandbox.info["reads_url"]
+        if sandbox.info["constant_result"] is not None:
+            self.constant_result = sandbox.info["constant_result"]
+            sandbox.close()
+        else:
+            self._sandbox = sandbox
+
+    @property
+    def native(self):
+        """
+        Whether ``FindProxyForURL()`` is evaluated as compiled Python. See the `native` argument.
+
+        :rtype: bool
+        """
+        if self._sandbox is not None:
+            return self._sandbox.info["native"]
+        return self._native is not None
 
     def find_proxy_for_url(self, url, host):
         """
@@ -84,11 +189,27 @@ class PACFile(object):
         :return: Result of evaluating the ``FindProxyForURL()`` or ``FindProxyForURLEx()``
             JavaScript function in the PAC file.
         :rtype: str
+        :raises PacTimeoutError: If the call takes longer than the `timeout` the PAC file was loaded with.
+        :raises PacMemoryError: If the PAC file goes over the `memory_limit` it was loaded with.
         """
+        if self.constant_result is not None:
+            return self.constant_result
+        if self._sandbox is not None:
+            return self._sandbox.find_proxy_for_url(url, host)
+
         from dukpy import JSRuntimeError
 
+        if self._native is not None:
+            from pypac.native import FallbackToJavaScript
+
+            try:
+                return self._native.find_proxy_for_url(url, host)
+            except FallbackToJavaScript as e:
+                import logging
+
+                logging.getLogger(__name__).debug("Evaluating the PAC file as JavaScript for %s: %s", url, e)
         try:
-            return self._context.evaljs(self._entry_func + "(dukpy['url'], dukpy['host'])", url=url, host=host)
+            return self._evaluate(url, host)
         except JSRuntimeError as e:
             # Duktape and QuickJS (dukpy >= 0.6.0) word an undefined identifier differently.
             if "'FindProxyForURL' undefined" not in str(e) and "FindProxyForURL is not defined" not in str(e):
@@ -97,6 +218,184 @@ class PACFile(object):
             self._entry_func = "FindProxyForURLEx"
             return self.find_proxy_for_url(url, host)
 
+    def _evaluate(self, url, host):
+        """
+        Call the entry function in the interpreter.
+
+        Host name lookups can take a while, and other threads would have to wait for the interpreter meanwhile.
+        So lookups are deferred: the first time the PAC file looks up a host, the evaluation is abandoned,
+        and then run again with the answer once it has been looked up with the lock released.
+        """
+        from dukpy import JSRuntimeError
+
+        from pypac import dns
+
+        lookups = {}
+        for _ in range(_MAX_LOOKUP_ROUNDS):
+            error = result = None
+            with self._lock, dns._deferring(lookups):
+                try:
+                    result = self._context.evaljs(
+                        self._entry_func + "(dukpy['url'], dukpy['host'])", url=url, host=host
+                    )
+                except JSRuntimeError as e:
+                    error = e
+            if not dns._resolve_pending(lookups):
+                if error is not None:
+                    raise error
+                return result
+        # A PAC file that keeps looking up more hosts has the rest looked up as it goes.
+        with self._lock:
+            return self._context.evaljs(self._entry_func + "(dukpy['url'], dukpy['host'])", url=url, host=host)
+
+    @property
+    def reads_url(self):
+        """
+        Whether the result of ``FindProxyForURL()`` may depend on the full URL, rather than only on the host.
+        This is determined conservatively from the PAC file's source code:
+        it's ``False`` only if the function is declared once, nothing else refers to it,
+        and it never refers to its ``url`` parameter.
+
+        :rtype: bool
+        """
+        return self._reads_url
+
+
+def _compile_native(pac_js):
+    """
+    :returns: The PAC file compiled to Python, or ``None`` if it can't be.
+    :rtype: pypac.native.NativePAC|None
+    """
+    import logging
+
+    from pypac._js import UnsupportedSyntax
+    from pypac.native import compile_pac
+
+    try:
+        return compile_pac(pac_js)
+    except (UnsupportedSyntax, RuntimeError) as e:
+        # RuntimeError includes exceeding the recursion limit.
+        logging.getLogger(__name__).debug("Not compiling PAC file to Python: %s", e)
+
+
+def _constant_return(function_source):
+    """
+    :param str function_source: Source code of a JavaScript function.
+    :returns: What the function returns, if all it does is return string literals, joined with ``+`` or not.
+        ``None`` otherwise.
+    :rtype: str|None
+    """
+    from pypac._js import UnsupportedSyntax, parse
+
+    # Anything this simple is short. Don't spend time parsing the rest.
+    if len(function_source) > 4096:
+        return
+    try:
+        program = parse(function_source)
+    except (UnsupportedSyntax, RuntimeError):
+        return
+    if len(program.body) != 1 or program.body[0].kind != "Function":
+        return
+    statements = [statement for statement in program.body[0].body if statement.kind != "Empty"]
+    if len(statements) == 1 and statements[0].kind == "Return" and statements[0].value is not None:
+        return _constant_string(statements[0].value)
+
+
+def _constant_string(node):
+    if node.kind == "Literal" and isinstance(node.value, basestring):
+        return node.value
+    if node.kind == "Binary" and node.operator == "+":
+        left, right = _constant_string(node.left), _constant_string(node.right)
+        if left is not None and right is not None:
+            return left + right
+
+
+def _minify(pac_js):
+    """
+    :returns: The result of :func:`pypac.minify.minify`, or the PAC file unchanged if it can't be minified.
+    :rtype: str
+    """
+    from pypac._js import UnsupportedSyntax
+    from pypac.minify import minify
+
+    try:
+        return minify(pac_js)
+    except UnsupportedSyntax:
+        return pac_js
+
+
+def _rewrite_domain_loops(pac_js):
+    """
+    :returns: The result of :func:`pypac.native.rewrite_domain_loops`, or the PAC file unchanged
+        if it has no loops to rewrite.
+    :rtype: tuple[str, dict]
+    """
+    import re
+
+    from pypac._js import UnsupportedSyntax
+    from pypac.native import rewrite_domain_loops
+
+    # Parsing is only worth it if there may be such a loop.
+    if not re.search(r"dnsDomainIs\s*\(\s*[\w$]+\s*,\s*[\w$]+\s*\[", pac_js):
+        return pac_js, {}
+    try:
+        return rewrite_domain_loops(pac_js)
+    except (UnsupportedSyntax, RuntimeError):
+        return pac_js, {}
+
+
+def _function_source(pac_js, name):
+    """
+    :param str pac_js: JavaScript of a PAC file.
+    :param str name: Name of a function.
+    :returns: Source code of the function's declaration, if that's the only place the name appears,
+        so that it's certainly the function that gets called. ``None`` otherwise.
+    :rtype: str|None
+    """
+    import re
+
+    from pypac._js import UnsupportedSyntax, iter_tokens
+
+    name_pattern = r"(?<![\w$])" + re.escape(name) + r"(?![\w$])"
+    if len(re.findall(name_pattern, pac_js)) != 1:
+        return
+    declaration = re.search(r"(?<![\w$.])function\s+" + name_pattern, pac_js)
+    if not declaration:
+        return
+    start, depth = declaration.start(), 0
+    try:
+        for token in iter_tokens(pac_js[start:]):
+            if token.kind == "eof":
+                return
+            if token.kind == "punct" and token.value == "{":
+                depth += 1
+            elif token.kind == "punct" and token.value == "}":
+                depth -= 1
+                if depth == 0:
+                    return pac_js[start : start + token.end]
+    except UnsupportedSyntax:
+        return
+
+
+def _function_reads_first_param(function_source):
+    """
+    :param str function_source: Source code of a JavaScript function.
+    :returns: ``False`` if the function definitely doesn't use its first parameter.
+    :rtype: bool
+    """
+    import re
+
+    match = re.match(r"\s*function\s*[\w$]*\s*\(([^)]*)\)\s*\{(.*)\}\s*$", function_source, re.DOTALL)
+    if not match:
+        return True
+    params, body = match.groups()
+    first_param = params.split(",")[0].strip()
+    if re.search(r"(?<![\w$.])(arguments|eval)(?![\w$])", body):
+        return True
+    if not first_param:
+        return False
+    return re.search(r"(?<![\w$.])" + re.escape(first_param) + r"(?![\w$])", body) is not None
+
 
 class MalformedPacError(Exception):
     def __init__(self, msg=None, original_exc=None):
@@ -108,6 +407,27 @@ class MalformedPacError(Exception):
         super(MalformedPacError, self).__init__(msg)
 
 
+class PacLimitError(RuntimeError):
+    """The PAC file went over a limit set with the `timeout` or `memory_limit` arguments of :class:`PACFile`."""
+
+
+class PacTimeoutError(PacLimitError):
+    def __init__(self, seconds):
+        super(PacTimeoutError, self).__init__("PAC file took longer than {}s to evaluate".format(seconds))
+        #: The time limit, in seconds.
+        self.seconds = seconds
+
+
+class PacMemoryError(PacLimitError):
+    def __init__(self, limit=None):
+        msg = "PAC file ran out of memory"
+        if limit is not None:
+            msg += " (limit: {} bytes)".format(limit)
+        super(PacMemoryError, self).__init__(msg)
+        #: The memory limit, in bytes.
+        self.limit = limit
+
+
 class PyimportError(MalformedPacError):
     def __init__(self):
         super(PyimportError, self).__init__(
@@ -11,6 +11,7 @@ https://developer.mozilla.org/en-US/docs/Web/HTTP/Guides/Proxy_servers_and_tunne
 # ruff: noqa: N802
 import datetime as dt
 
+from pypac import dns
 from pypac._utils import ON_PY3, is_ipv4_address
 
 if ON_PY3:
@@ -109,7 +110,7 @@ def dnsResolve(host):
     import socket
 
     try:
-        return socket.gethostbyname(host)
+        return dns.gethostbyname(host)
     except socket.gaierror:
         return ""
 
@@ -134,7 +135,7 @@ def isResolvable(host):
     import socket
 
     try:
-        socket.gethostbyname(host)
+        dns.gethostbyname(host)
     except socket.gaierror:
         return False
     return True
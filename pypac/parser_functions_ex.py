@@ -9,6 +9,7 @@ or the IPv6 ``socket`` functions that are not available in Python 2.7.
 
 # ruff: noqa: N802
 
+from pypac import dns
 from pypac._utils import ON_PY3, is_ipv4_address
 
 
@@ -77,7 +78,7 @@ def dnsResolveEx(host):
     import socket
 
     try:
-        return ";".join([str(addr[4][0]) for addr in socket.getaddrinfo(host, 0)])
+        return ";".join(dns.getaddrinfo_addresses(host))
     except socket.gaierror:
         return ""
 
@@ -0,0 +1,90 @@
+"""
+Tools for noticing when a PAC file has changed at its source.
+"""
+
+import hashlib
+import os
+
+
+class PACSource(object):
+    """
+    Where a PAC file was obtained from, and what's needed to tell whether it has changed since.
+    :func:`pypac.get_pac` records this as the ``source`` attribute of the :class:`PACFile <pypac.parser.PACFile>`
+    it returns.
+    """
+
+    def __init__(self, url=None, candidate_urls=None, etag=None, last_modified=None, path=None, mtime=None):
+        """
+        :param str url: URL the PAC file was downloaded from.
+        :param list[str] candidate_urls: URLs the PAC file was downloaded from one of,
+            if it's not known which. Tried again in order to find out.
+        :param str etag: ``ETag`` header of the response.
+        :param str last_modified: ``Last-Modified`` header of the response.
+        :param str path: Path of the PAC file on the filesystem.
+        :param float mtime: Modification time of the file at `path` when it was read.
+        """
+        self.url = url
+        self.candidate_urls = candidate_urls
+        self.etag = etag
+        self.last_modified = last_modified
+        self.path = path
+        self.mtime = mtime
+
+    def __repr__(self):
+        return "<PACSource {}>".format(self.path or self.url or self.candidate_urls)
+
+
+def fetch_if_changed(pac, timeout=2, allowed_content_types=None):
+    """
+    Check whether a PAC file has changed at its source, and get the new version if so.
+    Files are compared by modification time. URLs are requested conditionally using the
+    ``If-None-Match`` and ``If-Modified-Since`` headers, so that an unchanged PAC file costs a 304 response.
+
+    :param PACFile pac: PAC file to check, as returned by :func:`pypac.get_pac`.
+    :param float timeout: Time to wait for a response.
+    :param allowed_content_types: See :func:`pypac.get_pac`.
+    :returns: The new version of the PAC file, with its own ``source``.
+        ``None`` if it's unchanged, if the source couldn't be reached, or if the source isn't known.
+    :rtype: PACFile|None
+    :raises MalformedPacError: If the new version could not be parsed.
+    """
+    from pypac.parser import PACFile
+
+    source = getattr(pac, "source", None)
+    if source is None:
+        return
+    if source.path:
+        try:
+            mtime = os.path.getmtime(source.path)
+            if mtime == source.mtime:
+                return
+            with open(source.path) as f:
+                pac_js = f.read()
+        except (IOError, OSError):
+            return
+        new_source = PACSource(path=source.path, mtime=mtime)
+    else:
+        from requests import Session
+
+        from pypac.api import _conditional_headers, _download_pac_response, _fetch_pac
+
+        if source.url:
+            sess = Session()
+            sess.trust_env = False
+            headers = _conditional_headers(source.etag, source.last_modified)
+            url = source.url
+            resp = _fetch_pac(sess, url, timeout, allowed_content_types, headers=headers)
+        else:
+            url, resp = _download_pac_response(source.candidate_urls, timeout, allowed_content_types, None, None, False)
+        if resp is None or resp.status_code == 304:
+            return
+        pac_js = resp.text
+        new_source = PACSource(url=url, etag=resp.headers.get("etag"), last_modified=resp.headers.get("last-modified"))
+
+    if pac_js == pac.js or (pac.js is None and hashlib.sha256(pac_js.encode("utf-8")).hexdigest() == pac.sha256):
+        # Same content, but remember the new validators so that the next check is cheaper.
+        pac.source = new_source
+        return
+    new_pac = PACFile(pac_js, **pac._options)
+    new_pac.source = new_source
+    return new_pac
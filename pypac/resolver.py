@@ -2,29 +2,81 @@
 Tools for working with a given PAC file and its return values.
 """
 
-from pypac._utils import ON_PY3
-from pypac.parser import parse_pac_value
+import threading
+from collections import OrderedDict, namedtuple
+
+from pypac._utils import ON_PY3, monotonic
+from pypac.parser import PACFile, parse_pac_value
+
+#: A host whose proxies differ between two versions of a PAC file, as found by :meth:`ProxyResolver.warm_from`.
+#: ``url`` is a URL that was requested for the host.
+#: If the new version failed for the host, ``new_proxies`` is ``None``, and ``error`` is the exception it raised.
+RouteChange = namedtuple("RouteChange", ["host", "url", "old_proxies", "new_proxies", "error"])
 
 
 class ProxyResolver(object):
     """
     Handles the lookup of the proxy to use for any given URL, including proxy failover logic.
+    Concurrent lookups from different threads that would give the same result share a single PAC evaluation.
     """
 
-    def __init__(self, pac, proxy_auth=None, socks_scheme="socks5"):
+    #: Number of hosts for which the ``last_known_good`` error policy remembers a result.
+    last_known_good_size = 1000
+
+    def __init__(
+        self,
+        pac,
+        proxy_auth=None,
+        socks_scheme="socks5",
+        cache_size=0,
+        cache_ttl=None,
+        error_policy="raise",
+        error_threshold=0,
+        error_cooldown=30,
+    ):
         """
         :param pypac.parser.PACFile pac: Parsed PAC file.
         :param requests.auth.HTTPProxyAuth proxy_auth: Username and password proxy authentication.
             If provided, then all proxy URLs returned will include these credentials.
         :param str socks_scheme: Scheme to assume for SOCKS proxies. `socks5` by default.
             Case-insensitive.
+        :param int cache_size: Number of hosts for which to remember the PAC file's result,
+            so that it isn't evaluated again. If the PAC file reads the URL, each URL is remembered separately.
+            The least recently used are forgotten first. Disabled by default,
+            as the results of PAC files that depend on the time of day or on DNS can change.
+        :param float cache_ttl: Seconds for which to remember each result. Forever by default.
+        :param str error_policy: What :meth:`get_proxies` does when the PAC file fails to give a result,
+            such as when it throws an error or goes over a limit set with the `timeout` or `memory_limit` arguments
+            of :class:`PACFile <pypac.parser.PACFile>`. ``raise`` (the default) raises the error.
+            ``direct`` returns ``['DIRECT']``. ``last_known_good`` returns the proxies from the last successful
+            evaluation for the same host, or raises the error if there wasn't one.
+        :param int error_threshold: If set, stop evaluating the PAC file after it fails this many times in a row.
+            Until `error_cooldown` has passed, :meth:`get_proxies` handles every URL according to `error_policy`
+            without evaluating the PAC file, raising :class:`PacUnavailableError` under the ``raise`` policy.
+            The PAC file is then tried again, and stopped for another cooldown if it fails once more.
+        :param float error_cooldown: Seconds for which to stop evaluating the PAC file. See `error_threshold`.
         """
+        if error_policy not in ("raise", "direct", "last_known_good"):
+            raise ValueError("Unknown error_policy: {}".format(error_policy))
         self.pac = pac
         self._proxy_auth = proxy_auth
         self.socks_scheme = socks_scheme
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.error_policy = error_policy
+        self.error_threshold = error_threshold
+        self.error_cooldown = error_cooldown
 
         self._offline_proxies = set()
         self._cache = {}  # Cache parsed version of FindProxyForURL() return values.
+        self._in_flight = {}  # PAC evaluations in progress, by resolution key.
+        self._in_flight_lock = threading.Lock()
+        self._decisions = OrderedDict()  # Results by resolution key, least recently used first.
+        self._decisions_lock = threading.Lock()
+        self._last_known_good = OrderedDict()  # Proxies by host, least recently evaluated first.
+        self._consecutive_errors = 0
+        self._last_error = None
+        self._suspended_until = None  # When to try the PAC file again, after failing error_threshold times.
 
     @property
     def proxy_auth(self):
@@ -35,6 +87,9 @@ class ProxyResolver(object):
     def proxy_auth(self, value):
         self._proxy_auth = value
         self._cache.clear()
+        with self._decisions_lock:
+            self._decisions.clear()
+            self._last_known_good.clear()
         self.unban_all()
 
     def get_proxies(self, url):
@@ -46,6 +101,10 @@ class ProxyResolver(object):
             Can be empty, which means to abort the request.
         :rtype: list[str]
         """
+        constant_proxies = self.constant_proxies
+        if constant_proxies is not None and not self.cache_size:
+            return constant_proxies
+
         if ON_PY3:
             from urllib.parse import urlparse
         else:
@@ -56,44 +115,265 @@ class ProxyResolver(object):
             # URL has no hostname, and PAC functions don't expect to receive nulls.
             hostname = ""
 
-        value_from_js_func = self.pac.find_proxy_for_url(url, hostname)
-        if value_from_js_func in self._cache:
-            return self._cache[value_from_js_func]
+        if self.cache_size:
+            key = self.resolution_key(url, hostname)
+            decision = self._cached_decision(key)
+            if decision is not None:
+                return decision.proxies
+
+        if constant_proxies is not None:
+            # Still remembered, so that the hosts in use are known to warm_from().
+            config_values = constant_proxies
+        else:
+            unavailable = self._unavailable_error()
+            if unavailable is not None:
+                fallback = self._fallback(url, hostname, unavailable)
+                if fallback is None:
+                    raise unavailable
+                return fallback
+            try:
+                config_values = self._find_proxy_for_url(url, hostname)
+            except Exception as e:
+                fallback = self._fallback(url, hostname, e)
+                if fallback is None:
+                    raise
+                return fallback
+            if self.error_policy == "last_known_good":
+                self._remember_last_known_good(hostname, config_values)
+        if self.cache_size:
+            self._remember_decision(key, _Decision(url, hostname, config_values, self.cache_ttl))
+        return config_values
 
-        config_values = parse_pac_value(value_from_js_func, self.socks_scheme)
-        if self._proxy_auth:
-            config_values = [add_proxy_auth(value, self._proxy_auth) for value in config_values]
+    @property
+    def constant_proxies(self):
+        """
+        The proxies for every URL, if the PAC file always gives the same result.
+        :meth:`get_proxies` then returns them without evaluating the PAC file. ``None`` otherwise.
 
-        self._cache[value_from_js_func] = config_values
+        :rtype: list[str]|None
+        """
+        if isinstance(self.pac, PACFile) and self.pac.constant_result is not None:
+            return self._parse(self.pac.constant_result)
 
+    def _parse(self, value_from_js_func):
+        """Parse a result of the PAC file, and add authentication."""
+        config_values = self._cache.get(value_from_js_func)
+        if config_values is None:
+            config_values = parse_pac_value(value_from_js_func, self.socks_scheme)
+            if self._proxy_auth:
+                config_values = [add_proxy_auth(value, self._proxy_auth) for value in config_values]
+            self._cache[value_from_js_func] = config_values
         return config_values
 
-    def get_proxy(self, url):
+    def _fallback(self, url, hostname, error):
+        """
+        :returns: The proxies to use according to :attr:`error_policy` after the PAC file failed,
+            or ``None`` to raise the error.
+        :rtype: list[str]|None
+        """
+        if self.error_policy == "direct":
+            fallback = ["DIRECT"]
+        elif self.error_policy == "last_known_good":
+            with self._decisions_lock:
+                fallback = self._last_known_good.get(hostname)
+        else:
+            return
+        if fallback is not None and not isinstance(error, PacUnavailableError):
+            import logging
+
+            logger = logging.getLogger(__name__)
+            logger.warning("PAC file failed for {}, using {} instead: {}".format(url, fallback, error))
+        return fallback
+
+    def _unavailable_error(self):
+        """
+        :returns: An error to handle instead of evaluating the PAC file, if it's in its cooldown after failing
+            repeatedly. ``None`` otherwise.
+        :rtype: PacUnavailableError|None
+        """
+        if self._suspended_until is None:
+            return
+        with self._decisions_lock:
+            if self._suspended_until is None:
+                return
+            remaining = self._suspended_until - monotonic()
+            if remaining > 0:
+                return PacUnavailableError(self._consecutive_errors, remaining, self._last_error)
+            # Try again. One more error starts another cooldown.
+            self._suspended_until = None
+            self._consecutive_errors = self.error_threshold - 1
+
+    def _record_error(self, error):
+        with self._decisions_lock:
+            self._consecutive_errors += 1
+            self._last_error = error
+            if not self.error_threshold or self._consecutive_errors < self.error_threshold:
+                return
+            self._suspended_until = monotonic() + self.error_cooldown
+        import logging
+
+        logger = logging.getLogger(__name__)
+        logger.warning(
+            "PAC file failed {} times in a row, not evaluating it for {}s: {}".format(
+                self._consecutive_errors, self.error_cooldown, error
+            )
+        )
+
+    def _record_success(self):
+        with self._decisions_lock:
+            self._consecutive_errors = 0
+            self._last_error = None
+
+    def adopt_last_known_good(self, other):
+        """
+        Take on the results that another resolver would fall back to under the ``last_known_good`` policy,
+        such as one for the previous version of the PAC file. Results this resolver already has are kept.
+
+        :param ProxyResolver other: Resolver to take results from.
+        """
+        if other is self:
+            return
+        with other._decisions_lock:
+            adopted = list(other._last_known_good.items())
+        with self._decisions_lock:
+            for hostname, proxies in adopted:
+                self._last_known_good.setdefault(hostname, proxies)
+            while len(self._last_known_good) > self.last_known_good_size:
+                self._last_known_good.popitem(last=False)
+
+    def _remember_last_known_good(self, hostname, proxies):
+        with self._decisions_lock:
+            self._last_known_good.pop(hostname, None)
+            self._last_known_good[hostname] = proxies
+            while len(self._last_known_good) > self.last_known_good_size:
+                self._last_known_good.popitem(last=False)
+
+    def _cached_decision(self, key):
+        with self._decisions_lock:
+            decision = self._decisions.get(key)
+            if decision is None:
+                return
+            if decision.expires_at is not None and decision.expires_at <= monotonic():
+                del self._decisions[key]
+                return
+            decision.hits += 1
+            self._decisions.pop(key)
+            self._decisions[key] = decision  # Most recently used.
+            return decision
+
+    def _remember_decision(self, key, decision):
+        with self._decisions_lock:
+            previous = self._decisions.pop(key, None)
+            if previous is not None:
+                decision.hits += previous.hits
+            self._decisions[key] = decision
+            while len(self._decisions) > self.cache_size:
+                self._decisions.popitem(last=False)
+
+    def hottest(self, count):
+        """
+        :param int count: Maximum number of results.
+        :returns: The cached results that have been used the most, most used first,
+            as ``(host, url, proxies)`` tuples. Empty if caching is disabled.
+        :rtype: list[tuple[str, str, list[str]]]
+        """
+        with self._decisions_lock:
+            decisions = sorted(self._decisions.values(), key=lambda d: d.hits, reverse=True)[:count]
+        return [(d.hostname, d.url, d.proxies) for d in decisions]
+
+    def warm_from(self, other, count):
+        """
+        Evaluate this resolver's PAC file for the hosts most used with another resolver, such as one for
+        the previous version of the PAC file, so that their results are cached before this resolver is put to use.
+
+        :param ProxyResolver other: Resolver to take hosts from.
+        :param int count: Number of hosts to take.
+        :returns: The hosts whose proxies differ between the two resolvers,
+            including those for which this resolver's PAC file failed.
+        :rtype: list[RouteChange]
+        """
+        changes = []
+        for hostname, url, old_proxies in other.hottest(count):
+            try:
+                new_proxies = self.get_proxies(url)
+            except Exception as e:  # noqa: BLE001
+                # Reported rather than raised, so that one failing host doesn't hold up the others.
+                changes.append(RouteChange(hostname, url, old_proxies, None, e))
+                continue
+            if new_proxies != old_proxies:
+                changes.append(RouteChange(hostname, url, old_proxies, new_proxies, None))
+        return changes
+
+    def resolution_key(self, url, hostname):
+        """
+        :returns: A key that is the same for any two URLs that the PAC file is certain to give the same result for:
+            the host, or the host and URL if the PAC file might read the URL.
+            Objects used as the PAC file without a ``reads_url`` attribute are assumed to read it.
+        """
+        return (hostname, url) if getattr(self.pac, "reads_url", True) else hostname
+
+    def _find_proxy_for_url(self, url, hostname):
+        """
+        Call ``FindProxyForURL()`` and parse its result,
+        or wait for the result of an identical call already in progress on another thread.
+        Only the thread that makes the call records its success or failure,
+        so that threads that share a failed call count as one error.
+
+        :rtype: list[str]
+        """
+        key = self.resolution_key(url, hostname)
+        with self._in_flight_lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.result = self._parse(self.pac.find_proxy_for_url(url, hostname))
+        except Exception as e:
+            flight.error = e
+            self._record_error(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            flight.done.set()
+        if self._consecutive_errors:
+            self._record_success()
+        return flight.result
+
+    def get_proxy(self, url, chain=None):
         """
         Get a proxy to use for a given URL, excluding any banned ones.
 
         :param str url: The URL for which to find an appropriate proxy.
+        :param list[str] chain: Proxies previously obtained from :meth:`get_proxies` for this URL.
+            If provided, the PAC file isn't consulted again.
         :return: A proxy to use for the URL,
             or the string 'DIRECT', which means a proxy is not to be used.
             Can be ``None``, which means to not attempt the request.
         :rtype: str|None
         """
-        proxies = self.get_proxies(url)
+        proxies = self.get_proxies(url) if chain is None else chain
         for proxy in proxies:
             if proxy == "DIRECT" or proxy not in self._offline_proxies:
                 return proxy
 
-    def get_proxy_for_requests(self, url):
+    def get_proxy_for_requests(self, url, chain=None):
         """
         Get proxy configuration for a given URL, in a form ready to use with the Requests library.
 
         :param str url: The URL for which to obtain proxy configuration.
+        :param list[str] chain: Proxies previously obtained from :meth:`get_proxies` for this URL.
+            If provided, the PAC file isn't consulted again.
         :returns: Proxy configuration in a form recognized by Requests, for use with the ``proxies`` parameter.
         :rtype: dict
         :raises ProxyConfigExhaustedError: If no proxy is configured or available,
             and 'DIRECT' is not configured as a fallback.
         """
-        proxy = self.get_proxy(url)
+        proxy = self.get_proxy(url, chain)
         if not proxy:
             raise ProxyConfigExhaustedError(url)
         return proxy_parameter_for_requests(proxy)
@@ -112,6 +392,32 @@ class ProxyResolver(object):
         self._offline_proxies.clear()
 
 
+class _Decision(object):
+    """A result of the PAC file, as remembered by :class:`ProxyResolver`."""
+
+    def __init__(self, url, hostname, proxies, ttl):
+        self.url = url
+        self.hostname = hostname
+        self.proxies = proxies
+        self.expires_at = None if ttl is None else monotonic() + ttl
+        self.hits = 1
+
+
+class _Flight(object):
+    """A PAC evaluation in progress, which other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
 def add_proxy_auth(possible_proxy_url, proxy_auth):
     """
     Add a username and password to a proxy URL, if the input value is a proxy URL.
@@ -154,3 +460,19 @@ def proxy_parameter_for_requests(proxy_url_or_direct):
 class ProxyConfigExhaustedError(Exception):
     def __init__(self, for_url):
         super(ProxyConfigExhaustedError, self).__init__("No proxy configured or available for '{}'".format(for_url))
+
+
+class PacUnavailableError(Exception):
+    """
+    The PAC file wasn't evaluated, as it failed too many times in a row.
+    See the `error_threshold` argument of :class:`ProxyResolver`.
+    """
+
+    def __init__(self, errors, remaining, last_error):
+        super(PacUnavailableError, self).__init__(
+            "PAC file failed {} times in a row, and won't be evaluated for another {:.1f}s. Last error: {}".format(
+                errors, remaining, last_error
+            )
+        )
+        #: The error from the last time the PAC file was evaluated.
+        self.last_error = last_error
@@ -0,0 +1,289 @@
+"""
+Evaluating PAC files in a separate process, with limits on time and memory.
+
+Once ``FindProxyForURL()`` has started, nothing can stop it from the thread that called it:
+a PAC file stuck in a loop holds its interpreter forever, and one that keeps allocating grows the process.
+:class:`Sandbox` loads the PAC file in a worker process instead. The worker is killed if a call takes too long,
+and can't grow beyond a memory limit. Either way, a new worker is started for the next call.
+
+Host name lookups made by the PAC file are sent back to the calling process and made there with :mod:`pypac.dns`,
+so that :func:`pypac.dns.preresolved` and :func:`pypac.dns.set_resolver` still apply.
+"""
+
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import warnings
+import weakref
+
+from pypac.parser import MalformedPacError, PacMemoryError, PacTimeoutError
+
+
+class Sandbox(object):
+    """
+    A PAC file loaded in a worker process. Used by :class:`PACFile <pypac.parser.PACFile>`
+    when it's given a `timeout` or `memory_limit`.
+
+    The worker evaluates one call at a time, so calls from several threads wait for each other.
+    The `timeout` of each call starts once the worker has taken it up.
+    """
+
+    def __init__(self, pac_js, options=None, timeout=None, memory_limit=None):
+        """
+        Start a worker process and load the PAC file in it.
+
+        :param str pac_js: JavaScript of the PAC file.
+        :param dict options: Arguments for :class:`PACFile <pypac.parser.PACFile>` in the worker process.
+        :param float timeout: Seconds allowed for loading the PAC file, and for each call to ``FindProxyForURL()``,
+            including the host name lookups it makes.
+        :param int memory_limit: Bytes of memory that the worker process may allocate after it has started,
+            to load and evaluate the PAC file. Only enforced on Linux.
+        :raises MalformedPacError: If the PAC file can't be loaded.
+        :raises PacTimeoutError: If loading the PAC file takes too long.
+        :raises PacMemoryError: If loading the PAC file takes too much memory.
+        """
+        if memory_limit is not None and not sys.platform.startswith("linux"):
+            warnings.warn("memory_limit is only enforced on Linux.")
+        self._pac_js = pac_js
+        self._options = options or {}
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        #: What the worker found out when loading the PAC file: ``reads_url``, ``constant_result``, and ``native``.
+        self.info = None
+        self._worker = None
+        # A worker evaluates one call at a time.
+        self._lock = threading.Lock()
+        self._finalizer = None
+        with self._lock:
+            self._start()
+
+    def find_proxy_for_url(self, url, host):
+        """
+        Call ``FindProxyForURL()`` in the worker process.
+
+        :param str url: The full URL.
+        :param str host: The URL's host.
+        :rtype: str
+        :raises PacTimeoutError: If the call takes too long.
+        :raises PacMemoryError: If the call takes too much memory.
+        :raises dukpy.JSRuntimeError: If the PAC file throws an error.
+        """
+        with self._lock:
+            if self._worker is None:
+                self._start()
+            _send(self._worker[0].stdin, [url, host])
+            return self._receive()
+
+    def close(self):
+        """Stop the worker process. Another is started if the PAC file is evaluated again."""
+        with self._lock:
+            self._stop()
+
+    def _start(self):
+        import subprocess
+
+        # Started afresh rather than forked, as this process may have other threads, and interpreters of its own.
+        # Not with multiprocessing, so that the caller's main module isn't imported again.
+        code = "import sys; sys.path.insert(0, {!r}); from pypac.sandbox import _serve; _serve()".format(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        process = subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        messages = queue.Queue()
+        reader = threading.Thread(target=_read_messages, args=(process.stdout, messages), name="pypac-sandbox")
+        reader.daemon = True
+        reader.start()
+        self._worker = (process, messages)
+        self._finalizer = weakref.finalize(self, _terminate, process)
+        _send(process.stdin, [self._pac_js, self._options, self.memory_limit])
+        try:
+            if self._receive(timeout=None) != "ready":
+                raise RuntimeError("Unexpected message from PAC worker process")
+            self.info = self._receive()
+        except MalformedPacError:
+            self._stop()
+            raise
+
+    def _stop(self):
+        if self._finalizer is not None:
+            self._finalizer()
+        self._worker = self._finalizer = None
+
+    def _receive(self, timeout=-1):
+        """
+        :returns: The answer from the worker, after making the host name lookups it asks for in the meantime.
+        :param float timeout: Seconds to wait. By default, :attr:`timeout`.
+        """
+        from dukpy import JSRuntimeError
+
+        from pypac import dns
+
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+        process, messages = self._worker
+        while True:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                message = messages.get(timeout=remaining)
+            except queue.Empty:
+                self._stop()
+                raise PacTimeoutError(timeout)
+            if message is None:
+                # The worker died, such as on failing to allocate memory outside the JavaScript engine.
+                self._stop()
+                if self.memory_limit is not None:
+                    raise PacMemoryError(self.memory_limit)
+                raise RuntimeError("PAC worker process exited with code {}".format(process.poll()))
+            kind = message[0]
+            if kind == "lookup":
+                _, func, host = message
+                try:
+                    _send(process.stdin, ["addresses", getattr(dns, func)(host)])
+                except socket.error as e:
+                    _send(process.stdin, ["lookup_error", str(e)])
+            elif kind == "ready":
+                return kind
+            elif kind == "result":
+                return message[1]
+            elif kind == "memory":
+                self._stop()
+                raise PacMemoryError(self.memory_limit)
+            elif kind == "malformed":
+                raise MalformedPacError(message[1])
+            elif kind == "js":
+                raise JSRuntimeError(message[1])
+            else:
+                raise RuntimeError(message[1])
+
+
+def _send(stream, message):
+    try:
+        stream.write(json.dumps(message).encode("utf-8") + b"\n")
+        stream.flush()
+    except (IOError, OSError):
+        # The process at the other end is gone. For a worker, its reader says so.
+        pass
+
+
+def _read_messages(stream, messages):
+    """Put each message from a worker into a queue, followed by ``None`` once it exits."""
+    for line in iter(stream.readline, b""):
+        messages.put(json.loads(line.decode("utf-8")))
+    messages.put(None)
+
+
+def _terminate(process):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+    process.stdin.close()
+    process.stdout.close()
+
+
+def _serve():
+    """
+    Run as a worker process: load the PAC file, and answer calls to ``FindProxyForURL()``
+    until standard input is closed.
+    """
+    # Imported before memory is limited.
+    import dukpy  # noqa: F401
+
+    from pypac import dns
+    from pypac.parser import PACFile
+
+    requests, replies = sys.stdin.buffer, sys.stdout.buffer
+    # Nothing else may write to the other process.
+    sys.stdout = sys.stderr
+
+    def receive():
+        line = requests.readline()
+        return json.loads(line.decode("utf-8")) if line else None
+
+    def forward(func):
+        def lookup(host):
+            _send(replies, ["lookup", func, host])
+            reply, value = receive()
+            if reply == "lookup_error":
+                raise socket.gaierror(socket.EAI_NONAME, value)
+            return value
+
+        return lookup
+
+    pac_js, options, memory_limit = receive()
+    dns.gethostbyname = forward("gethostbyname")
+    dns.getaddrinfo_addresses = forward("getaddrinfo_addresses")
+    if memory_limit is not None:
+        _limit_memory(memory_limit)
+    _send(replies, ["ready"])
+
+    # Whatever goes wrong is reported to the other process, which raises it there.
+    try:
+        pac = PACFile(pac_js, **options)
+        info = {"reads_url": pac.reads_url, "constant_result": pac.constant_result, "native": pac.native}
+        _send(replies, ["result", info])
+    except Exception as e:  # noqa: BLE001
+        _send_error(replies, e, memory_limit)
+        return
+
+    while True:
+        call = receive()
+        if call is None:
+            return
+        try:
+            _send(replies, ["result", pac.find_proxy_for_url(*call)])
+        except Exception as e:  # noqa: BLE001
+            if _send_error(replies, e, memory_limit):
+                return
+
+
+def _send_error(replies, e, memory_limit):
+    """
+    Tell the other process what went wrong.
+
+    :returns: Whether this process ran out of memory, and should exit.
+    :rtype: bool
+    """
+    from dukpy import JSRuntimeError
+
+    if isinstance(e, MemoryError) or (memory_limit is not None and _out_of_memory(e)):
+        _send(replies, ["memory", str(e)])
+        return True
+    if isinstance(e, MalformedPacError):
+        _send(replies, ["malformed", str(e)])
+    elif isinstance(e, JSRuntimeError):
+        _send(replies, ["js", str(e)])
+    else:
+        _send(replies, ["error", "{}: {}".format(type(e).__name__, e)])
+    return False
+
+
+def _out_of_memory(e):
+    """Whether an error from the JavaScript engine means that it ran out of memory."""
+    from dukpy import JSRuntimeError
+
+    if isinstance(e, MalformedPacError):
+        e = e.original_exc
+    if not isinstance(e, JSRuntimeError):
+        return False
+    message = str(e)
+    # QuickJS (dukpy >= 0.6.0) reports "out of memory", and Duktape "alloc failed".
+    if "out of memory" in message or "alloc failed" in message:
+        return True
+    # When memory runs out, the engine may not manage to create the usual error either.
+    return message.startswith(("InternalError: Invalid error message", "null", "DoubleError"))
+
+
+def _limit_memory(memory_limit):
+    """Allow this process to allocate `memory_limit` more bytes of address space than it has now."""
+    try:
+        import resource
+
+        with open("/proc/self/statm") as f:
+            in_use = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (ImportError, IOError, OSError):
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (in_use + memory_limit, resource.RLIM_INFINITY))
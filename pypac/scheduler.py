@@ -0,0 +1,110 @@
+"""
+Concurrent dispatch of many requests, with limits on how much work goes to each proxy at once.
+"""
+
+from collections import OrderedDict, deque, namedtuple
+
+from pypac._utils import monotonic
+
+#: Outcome of one request dispatched by :class:`ProxyScheduler`.
+#: ``proxy`` is the proxy the request was routed to when it was scheduled, ``DIRECT``, or :data:`EXHAUSTED`.
+#: It's ``None`` if the proxy couldn't be looked up, in which case ``exception`` says why.
+#: Exactly one of ``response`` and ``exception`` is set.
+MapResult = namedtuple("MapResult", ["request", "proxy", "response", "exception"])
+
+#: ``proxy`` of a :class:`MapResult` for a request whose proxies were all unavailable when it was scheduled.
+EXHAUSTED = "EXHAUSTED"
+
+
+class ProxyScheduler(object):
+    """
+    Runs work items on a thread pool, grouped by the proxy each one is routed to.
+    Each proxy gets its own queue, concurrency limit, and rate limit,
+    so that a slow or overloaded proxy doesn't hold up work destined for other proxies.
+    Proxies take turns when workers free up.
+    """
+
+    def __init__(self, max_workers=10, max_per_proxy=None, rate_per_proxy=None):
+        """
+        :param int max_workers: Size of the thread pool.
+        :param int max_per_proxy: Maximum number of items in progress for any one proxy. Unlimited by default.
+        :param float rate_per_proxy: Maximum number of items started per second for any one proxy.
+            Unlimited by default.
+        """
+        if max_per_proxy is not None and max_per_proxy < 1:
+            raise ValueError("max_per_proxy must be at least 1")
+        self.max_workers = max_workers
+        self.max_per_proxy = max_per_proxy
+        self.rate_per_proxy = rate_per_proxy
+
+    def run(self, items, proxy_for_item, work):
+        """
+        Run `work` for each item, and yield results in the order they complete.
+
+        :param items: Work items.
+        :param proxy_for_item: Callable that takes an item and returns the proxy it's routed to.
+            Called on the thread pool. If it raises an exception, `work` isn't run for the item,
+            and its result has the exception, with a ``proxy`` of ``None``.
+        :param work: Callable that takes an item and returns a response. Exceptions it raises are captured.
+        :rtype: collections.Iterable[MapResult]
+        """
+        import time
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        unrouted = deque(items)
+        queues = OrderedDict()
+        interval = 1.0 / self.rate_per_proxy if self.rate_per_proxy else 0
+        in_progress = {}
+        next_start = {}
+        # Futures of work in progress, and of items being routed.
+        futures = {}
+        routing = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while unrouted or queues or futures or routing:
+                wake_at = None
+                dispatched = True
+                while dispatched and len(futures) + len(routing) < self.max_workers:
+                    # Round-robin: start at most one item per proxy in each pass.
+                    dispatched = False
+                    for proxy in list(queues):
+                        if len(futures) + len(routing) >= self.max_workers:
+                            break
+                        if self.max_per_proxy is not None and in_progress[proxy] >= self.max_per_proxy:
+                            continue
+                        now = monotonic()
+                        if next_start[proxy] > now:
+                            wake_at = next_start[proxy] if wake_at is None else min(wake_at, next_start[proxy])
+                            continue
+                        next_start[proxy] = now + interval
+                        item = queues[proxy].popleft()
+                        if not queues[proxy]:
+                            del queues[proxy]
+                        futures[executor.submit(work, item)] = (item, proxy)
+                        in_progress[proxy] += 1
+                        dispatched = True
+                # Workers left over find out where further items go.
+                while unrouted and len(futures) + len(routing) < self.max_workers:
+                    item = unrouted.popleft()
+                    routing[executor.submit(proxy_for_item, item)] = item
+
+                timeout = None if wake_at is None else max(0, wake_at - monotonic())
+                if not futures and not routing:
+                    time.sleep(timeout or 0)
+                    continue
+                done, _ = wait(list(futures) + list(routing), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    exc = future.exception()
+                    if future in routing:
+                        item = routing.pop(future)
+                        if exc:
+                            yield MapResult(item, None, None, exc)
+                            continue
+                        proxy = future.result()
+                        queues.setdefault(proxy, deque()).append(item)
+                        in_progress.setdefault(proxy, 0)
+                        next_start.setdefault(proxy, 0)
+                        continue
+                    item, proxy = futures.pop(future)
+                    in_progress[proxy] -= 1
+                    yield MapResult(item, proxy, None if exc else future.result(), exc)
@@ -0,0 +1,484 @@
+"""
+Turn a PAC file into static proxy settings, for tools that only understand the ``HTTP_PROXY``, ``HTTPS_PROXY``,
+and ``NO_PROXY`` environment variables, such as curl.
+
+This works for PAC files that send everything through one proxy, except for hosts that are matched by
+domain name or address and sent directly. Anything else is reported, with the line it's on.
+"""
+
+from collections import namedtuple
+
+from pypac._js import UnsupportedSyntax, find_function, parse
+from pypac.parser import parse_pac_value
+
+#: Something in a PAC file that prevents or affects conversion, and the line it's on.
+Finding = namedtuple("Finding", ["line", "description"])
+
+# Which host names a NO_PROXY entry was made from matches: the name itself, its subdomains,
+# any name that ends with it, as dnsDomainIs() does when the domain doesn't start with a dot, or IP addresses.
+_HOST, _SUBDOMAINS, _SUFFIX, _ADDRESSES = "host", "subdomains", "suffix", "addresses"
+
+
+class StaticProxyConfig(object):
+    """
+    The result of :func:`compile_static`.
+    """
+
+    def __init__(self, proxy, no_proxy, unsupported, approximations):
+        #: Proxy URL for everything not in :attr:`no_proxy`, or ``None`` if everything goes directly.
+        self.proxy = proxy
+        #: Domain names, host names, and CIDR blocks to access directly.
+        self.no_proxy = no_proxy
+        #: Constructs that prevent the PAC file from being represented statically, as :data:`Finding` tuples.
+        self.unsupported = unsupported
+        #: Ways in which the static settings differ from the PAC file, as :data:`Finding` tuples.
+        self.approximations = approximations
+
+    @property
+    def is_static(self):
+        """Whether the PAC file could be represented statically."""
+        return not self.unsupported
+
+    def environ(self):
+        """
+        :returns: Environment variables with the settings, in both upper and lower case,
+            as programs differ in which they read.
+        :rtype: dict[str, str]
+        :raises ValueError: If the PAC file can't be represented statically.
+        """
+        if not self.is_static:
+            raise ValueError(
+                "PAC file can't be represented statically: "
+                + "; ".join("line {}: {}".format(line, description) for line, description in self.unsupported)
+            )
+        env = {}
+        if self.proxy:
+            env["HTTP_PROXY"] = env["HTTPS_PROXY"] = self.proxy
+            if self.no_proxy:
+                env["NO_PROXY"] = ",".join(self.no_proxy)
+        for name in list(env):
+            env[name.lower()] = env[name]
+        return env
+
+    def __repr__(self):
+        if not self.is_static:
+            return "<StaticProxyConfig unsupported={!r}>".format(self.unsupported)
+        return "<StaticProxyConfig proxy={!r} no_proxy={!r}>".format(self.proxy, self.no_proxy)
+
+
+def compile_static(pac, socks_scheme=None, approximate_dns=False):
+    """
+    Work out static proxy settings that are equivalent to a PAC file, if there are any.
+
+    The supported form is a ``FindProxyForURL()`` that returns a fixed value at the end,
+    preceded by ``if`` statements that return ``"DIRECT"`` when the host matches a
+    ``dnsDomainIs()``, ``shExpMatch()`` with a ``*.domain`` or exact pattern, ``host == "..."``,
+    or a loop of ``dnsDomainIs()`` over an array literal, combined with ``||``.
+    Programs differ in how they match ``NO_PROXY`` entries against host names,
+    so entries are written as they appear in the PAC file, with ``*.domain`` patterns becoming ``.domain``.
+    Most match an entry, with or without a leading dot, against both the domain and its subdomains.
+    Where the PAC file matches only one of those, such as with ``dnsDomainIs(host, ".domain")`` alone,
+    or matches names that merely end with the domain, as ``dnsDomainIs(host, "domain")`` does,
+    this is recorded in :attr:`StaticProxyConfig.approximations`.
+
+    :param pac: The PAC file, as a :class:`PACFile <pypac.parser.PACFile>` or its JavaScript source.
+    :param str socks_scheme: Scheme to assume for SOCKS proxies. `socks5` by default.
+    :param bool approximate_dns: Convert ``isInNet(host, ...)`` to a CIDR block in ``NO_PROXY``.
+        ``isInNet()`` also matches host names that resolve to an address in the block, but ``NO_PROXY``
+        only matches addresses, so this is recorded in :attr:`StaticProxyConfig.approximations`.
+    :rtype: StaticProxyConfig
+    :raises ValueError: If `pac` is a :class:`PACFile <pypac.parser.PACFile>` loaded with ``keep_source=False``.
+    """
+    source = pac if isinstance(pac, str) else pac.js
+    if source is None:
+        raise ValueError("The PAC file was loaded without keeping its source")
+    analysis = _Analysis(socks_scheme, approximate_dns)
+    try:
+        program = parse(source)
+    except UnsupportedSyntax as e:
+        analysis.unsupported(e.line, e.description)
+    else:
+        analysis.run(program)
+    return analysis.result()
+
+
+class _Analysis(object):
+    def __init__(self, socks_scheme, approximate_dns):
+        self.socks_scheme = socks_scheme
+        self.approximate_dns = approximate_dns
+        self.constants = {}
+        self.url = None
+        self.host = None
+        self.default = None
+        self.direct_rules = []  # (line, NO_PROXY entry, what it was made from).
+        self.proxy_rules = []  # (line, chain) of rules that return a proxy.
+        self.findings_unsupported = []
+        self.findings_approximate = []
+
+    def unsupported(self, line, description):
+        self.findings_unsupported.append(Finding(line, description))
+
+    def approximate(self, line, description):
+        self.findings_approximate.append(Finding(line, description))
+
+    def run(self, program):
+        entry = find_function(program, "FindProxyForURL")
+        if entry is None:
+            self.unsupported(1, "No FindProxyForURL() function")
+            return
+        if len(entry.params) < 2:
+            self.unsupported(entry.line, "FindProxyForURL() doesn't take the host parameter")
+            return
+        self.url, self.host = entry.params[:2]
+        for statement in program.body:
+            if statement.kind == "Function" or statement.kind == "Empty":
+                continue
+            if statement.kind == "Var" and all(_is_literal(value) for _, value in statement.declarations):
+                self.constants.update(statement.declarations)
+                continue
+            self.unsupported(statement.line, "Top-level code other than functions and constants")
+        if not self.statements(entry.body):
+            last_line = entry.body[-1].line if entry.body else entry.line
+            self.unsupported(last_line, "FindProxyForURL() can end without returning")
+
+    def statements(self, body):
+        """
+        Analyze statements in order, until one that always returns.
+
+        :returns: Whether the statements always return.
+        """
+        for index, statement in enumerate(body):
+            kind = statement.kind
+            if kind == "Empty":
+                continue
+            if kind == "Expression" and self.is_host_lowercasing(statement.expression):
+                continue
+            if kind == "Block":
+                if self.statements(statement.body):
+                    return True
+                continue
+            if kind == "Return":
+                self.returns(statement.value, statement.line)
+                return True
+            if kind == "If":
+                consequent = _single_return(statement.consequent)
+                if consequent is None:
+                    self.unsupported(statement.line, "'if' statement that does more than return a value")
+                    continue
+                self.rule(statement.test, consequent.value, statement.line)
+                if statement.alternate is not None:
+                    return self.statements([statement.alternate] + body[index + 1 :])
+                continue
+            if kind == "For":
+                loop = domain_loop(statement, self.host, self.constants)
+                if loop is None:
+                    self.unsupported(statement.line, "Loop")
+                    continue
+                domains, value = loop
+                self.rule_entries([_domain_match(domain) for domain in domains], value, statement.line)
+                continue
+            self.unsupported(statement.line, _describe(statement))
+        return False
+
+    def is_host_lowercasing(self, expression):
+        # host = host.toLowerCase() doesn't change anything, as NO_PROXY matching is case-insensitive.
+        return (
+            expression.kind == "Assign"
+            and expression.operator == "="
+            and _is_identifier(expression.target, self.host)
+            and _is_method_call(expression.value, self.host, "toLowerCase")
+        )
+
+    def returns(self, value, line):
+        if value is not None and value.kind == "Conditional":
+            self.rule(value.test, value.consequent, line)
+            self.returns(value.alternate, line)
+            return
+        chain = self.chain(value, line)
+        if chain is None:
+            return
+        if len(chain) > 1:
+            self.approximate(line, "Only the first of {!r} is used".format(value.value))
+        self.default = chain[0]
+
+    def chain(self, value, line):
+        if value is None or value.kind != "Literal" or not isinstance(value.value, str):
+            self.unsupported(line, "Returns a value that isn't a string literal")
+            return
+        chain = parse_pac_value(value.value, self.socks_scheme)
+        if not chain:
+            self.unsupported(line, "Returns no usable proxy")
+            return
+        return chain
+
+    def rule(self, test, value, line):
+        entries = self.condition(test)
+        if entries is not None:
+            self.rule_entries(entries, value, line)
+
+    def rule_entries(self, entries, value, line):
+        chain = self.chain(value, line)
+        if chain is None:
+            return
+        if chain[0] == "DIRECT":
+            if self.proxy_rules:
+                self.unsupported(line, "Returns DIRECT after an earlier rule returned a proxy")
+            self.direct_rules.extend((line, entry, kind) for entry, kind in entries)
+        else:
+            self.proxy_rules.append((line, chain[0]))
+
+    def condition(self, test):
+        """
+        :returns: NO_PROXY entries that match the hosts for which the condition is true,
+            with what each one was made from, or ``None`` if it can't be expressed that way.
+        :rtype: list[tuple[str, str]]|None
+        """
+        if test.kind == "Binary" and test.operator == "||":
+            left, right = self.condition(test.left), self.condition(test.right)
+            if left is None or right is None:
+                return
+            return left + right
+        if test.kind == "Binary" and test.operator in ("==", "==="):
+            for host_side, other in ((test.left, test.right), (test.right, test.left)):
+                if _is_identifier(host_side, self.host) and _is_string(other):
+                    return [(other.value, _HOST)]
+        if test.kind == "Call" and test.callee.kind == "Identifier":
+            name, args = test.callee.name, test.arguments
+            if name == "dnsDomainIs" and len(args) == 2 and self.is_host(args[0]) and _is_string(args[1]):
+                return [_domain_match(args[1].value)]
+            if name == "shExpMatch" and len(args) == 2 and self.is_host(args[0]) and _is_string(args[1]):
+                entry = _shexp_to_no_proxy(args[1].value)
+                if entry is None:
+                    self.unsupported(test.line, "shExpMatch() pattern {!r}".format(args[1].value))
+                    return
+                return [(entry, _SUBDOMAINS if entry.startswith(".") else _HOST)]
+            if name == "isInNet" and len(args) == 3 and all(_is_string(arg) for arg in args[1:]):
+                if not (
+                    self.is_host(args[0]) or _is_call(args[0], "dnsResolve") and self.is_host(args[0].arguments[0])
+                ):
+                    self.unsupported(test.line, "isInNet() of something other than the host")
+                    return
+                cidr = _cidr(args[1].value, args[2].value)
+                if cidr is None:
+                    self.unsupported(test.line, "isInNet() with a non-contiguous or invalid mask")
+                    return
+                if not self.approximate_dns:
+                    self.unsupported(test.line, "isInNet() matches host names by DNS lookup")
+                    return
+                self.approximate(test.line, "{} only matches IP addresses, not names that resolve to them".format(cidr))
+                return [(cidr, _ADDRESSES)]
+            self.unsupported(test.line, "Condition using {}()".format(name))
+            return
+        if any(_is_identifier(node, self.url) for node in test.walk()):
+            self.unsupported(test.line, "Condition on the URL")
+            return
+        self.unsupported(test.line, "Condition that isn't a match on the host")
+
+    def is_host(self, node):
+        return _is_identifier(node, self.host) or _is_method_call(node, self.host, "toLowerCase")
+
+    def result(self):
+        no_proxy = []
+        for _, entry, _ in self.direct_rules:
+            if entry not in no_proxy:
+                no_proxy.append(entry)
+        if self.default is not None:
+            if self.default == "DIRECT":
+                for line, _ in self.proxy_rules:
+                    self.unsupported(line, "Returns a proxy for some hosts, but DIRECT for everything else")
+                no_proxy = []
+            else:
+                for line, proxy in self.proxy_rules:
+                    if proxy != self.default:
+                        self.unsupported(line, "Returns a different proxy for some hosts")
+                self.inexact_entries()
+        proxy = None if self.default in (None, "DIRECT") else self.default
+        return StaticProxyConfig(
+            proxy, no_proxy, sorted(set(self.findings_unsupported)), sorted(set(self.findings_approximate))
+        )
+
+    def inexact_entries(self):
+        """Record the NO_PROXY entries that match different hosts from the PAC file."""
+        from pypac._utils import is_ipv4_address
+
+        matches = {}  # Lines and kinds of match, by domain.
+        for line, entry, kind in self.direct_rules:
+            domain = entry.lstrip(".").lower()
+            if kind != _ADDRESSES and not is_ipv4_address(domain):
+                lines, kinds = matches.setdefault(domain, ([], set()))
+                lines.append(line)
+                kinds.add(kind)
+        for domain, (lines, kinds) in matches.items():
+            if _SUFFIX in kinds:
+                description = "dnsDomainIs() also matches names that end with {!r} without a dot before it, like {!r}"
+                self.approximate(lines[0], description.format(domain, "x" + domain))
+            elif _SUBDOMAINS not in kinds:
+                self.approximate(lines[0], "NO_PROXY also matches subdomains of {!r}".format(domain))
+            elif _HOST not in kinds:
+                self.approximate(lines[0], "NO_PROXY also matches {!r} itself, not only its subdomains".format(domain))
+
+
+def domain_loop(statement, host, constants):
+    """
+    Recognize a loop that checks the host against each domain in an array literal::
+
+        for (var i = 0; i < domains.length; i++) {
+            if (dnsDomainIs(host, domains[i])) return "DIRECT";
+        }
+
+    :param Node statement: A ``For`` statement.
+    :param str host: Name of the host parameter.
+    :param dict constants: Top-level variables whose values are literals, by name.
+    :returns: The domains, and the ``Literal`` node that's returned when one matches, or ``None``.
+    :rtype: tuple[list[str], Node]|None
+    """
+    init, test, update = statement.init, statement.test, statement.update
+    if init is None or test is None or update is None:
+        return
+    if init.kind == "Var" and len(init.declarations) == 1:
+        index, start = init.declarations[0]
+    elif init.kind == "Assign" and init.operator == "=" and init.target.kind == "Identifier":
+        index, start = init.target.name, init.value
+    else:
+        return
+    if start is None or start.kind != "Literal" or start.value != 0:
+        return
+    if not (
+        test.kind == "Binary"
+        and test.operator == "<"
+        and _is_identifier(test.left, index)
+        and test.right.kind == "Member"
+        and not test.right.computed
+        and test.right.property.value == "length"
+        and test.right.object.kind == "Identifier"
+    ):
+        return
+    array_name = test.right.object.name
+    array = constants.get(array_name)
+    if array is None or array.kind != "Array" or not all(_is_string(element) for element in array.elements):
+        return
+    if not (
+        update.kind == "Update"
+        and update.operator == "++"
+        and _is_identifier(update.target, index)
+        or update.kind == "Assign"
+        and update.operator == "+="
+        and _is_identifier(update.target, index)
+        and update.value.kind == "Literal"
+        and update.value.value == 1
+    ):
+        return
+    body = statement.body
+    if body.kind == "Block" and len(body.body) == 1:
+        body = body.body[0]
+    if body.kind != "If" or body.alternate is not None:
+        return
+    returned = _single_return(body.consequent)
+    call = body.test
+    if returned is None or returned.value is None or returned.value.kind != "Literal":
+        return
+    if not (
+        _is_call(call, "dnsDomainIs")
+        and len(call.arguments) == 2
+        and _is_identifier(call.arguments[0], host)
+        and call.arguments[1].kind == "Member"
+        and call.arguments[1].computed
+        and _is_identifier(call.arguments[1].object, array_name)
+        and _is_identifier(call.arguments[1].property, index)
+    ):
+        return
+    return [element.value for element in array.elements], returned.value
+
+
+def _domain_match(domain):
+    """
+    :returns: The NO_PROXY entry for ``dnsDomainIs(host, domain)``, and what it was made from.
+    :rtype: tuple[str, str]
+    """
+    return domain, _SUBDOMAINS if domain.startswith(".") else _SUFFIX
+
+
+def _single_return(statement):
+    if statement.kind == "Block" and len(statement.body) == 1:
+        statement = statement.body[0]
+    if statement.kind == "Return":
+        return statement
+
+
+def _is_literal(node):
+    if node is None:
+        return True
+    if node.kind == "Literal":
+        return True
+    if node.kind == "Array":
+        return all(_is_literal(element) for element in node.elements)
+    return False
+
+
+def _is_string(node):
+    return node.kind == "Literal" and isinstance(node.value, str)
+
+
+def _is_identifier(node, name):
+    return node.kind == "Identifier" and node.name == name
+
+
+def _is_call(node, name):
+    return node.kind == "Call" and _is_identifier(node.callee, name)
+
+
+def _is_method_call(node, name, method):
+    return (
+        node.kind == "Call"
+        and not node.arguments
+        and node.callee.kind == "Member"
+        and not node.callee.computed
+        and _is_identifier(node.callee.object, name)
+        and node.callee.property.value == method
+    )
+
+
+def _describe(statement):
+    descriptions = {
+        "Var": "Variable declaration",
+        "Expression": "Expression statement",
+        "Function": "Nested function",
+        "While": "Loop",
+        "ForIn": "Loop",
+        "Break": "'break' statement",
+        "Continue": "'continue' statement",
+    }
+    return descriptions.get(statement.kind, statement.kind)
+
+
+def _shexp_to_no_proxy(pattern):
+    """
+    :returns: The NO_PROXY entry equivalent to a shell expression that matches host names,
+        or ``None`` if there isn't one.
+    """
+    if pattern.startswith("*.") and not any(char in pattern[2:] for char in "*?["):
+        return pattern[1:]
+    if not any(char in pattern for char in "*?["):
+        return pattern
+
+
+def _cidr(network, mask):
+    """
+    :returns: CIDR notation for a network and netmask, or ``None`` if the mask isn't contiguous.
+    """
+    from pypac._utils import is_ipv4_address
+
+    if not is_ipv4_address(network) or not is_ipv4_address(mask):
+        return
+    mask_bits = 0
+    for octet in mask.split("."):
+        mask_bits = (mask_bits << 8) | int(octet)
+    prefix = bin(mask_bits).count("1")
+    if mask_bits != (0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF:
+        return
+    network_bits = 0
+    for octet in network.split("."):
+        network_bits = (network_bits << 8) | int(octet)
+    network_bits &= mask_bits
+    address = ".".join(str((network_bits >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+    return "{}/{}".format(address, prefix)
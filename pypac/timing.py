@@ -0,0 +1,133 @@
+"""
+Tools for bounding and measuring the time PyPAC spends on a request.
+"""
+
+from contextlib import contextmanager
+
+from requests.exceptions import Timeout
+
+from pypac._utils import monotonic
+
+
+class Deadline(object):
+    """
+    A time budget shared by every stage of a request: PAC discovery, PAC evaluation, and each request attempt.
+    """
+
+    def __init__(self, seconds):
+        """
+        :param float seconds: Total time allowed, starting now.
+        """
+        self.seconds = seconds
+        self._expires_at = monotonic() + seconds
+
+    def remaining(self):
+        """
+        :returns: Seconds left before the deadline. Never negative.
+        :rtype: float
+        """
+        return max(0.0, self._expires_at - monotonic())
+
+    @property
+    def expired(self):
+        """Whether the deadline has passed."""
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        """
+        :param str stage: What is about to happen, for the error message.
+        :raises DeadlineExceededError: If the deadline has passed.
+        """
+        if self.expired:
+            raise DeadlineExceededError(self.seconds, stage)
+
+    def clamp(self, timeout):
+        """
+        Shorten a timeout so that it doesn't extend past the deadline.
+
+        :param timeout: ``timeout`` as given to Requests: a number, a (connect, read) tuple, or ``None``.
+        :returns: The timeout, with each part at most the remaining time.
+        """
+        remaining = self.remaining()
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+class RequestTimings(object):
+    """
+    Breakdown of where the time went while :class:`pypac.PACSession` served a request.
+    Available as the ``pac_timings`` attribute of responses.
+    """
+
+    def __init__(self):
+        #: Seconds spent discovering, downloading, and parsing the PAC file.
+        self.discovery = 0.0
+        #: Part of :attr:`discovery` spent waiting for another thread that was already searching for the PAC file.
+        self.discovery_wait = 0.0
+        #: Seconds spent evaluating the PAC file for the request URL.
+        self.resolve = 0.0
+        #: ``(proxy, seconds)`` for each attempt to send the request. ``proxy`` is ``DIRECT`` or ``None`` if unproxied.
+        self.attempts = []
+
+    @property
+    def total(self):
+        """Seconds spent on the request overall."""
+        return self.discovery + self.resolve + sum(seconds for _, seconds in self.attempts)
+
+    def __repr__(self):
+        return "<RequestTimings discovery={:.3f} resolve={:.3f} attempts={!r}>".format(
+            self.discovery, self.resolve, self.attempts
+        )
+
+
+class DiscoveryTimings(object):
+    """
+    Breakdown of where the time went while :func:`pypac.get_pac` searched for a PAC file.
+    Pass one to :func:`pypac.get_pac` using the ``timings`` keyword to have it filled in.
+    """
+
+    #: Reading the PAC URL or path from the OS settings.
+    OS_SETTINGS = "os_settings"
+    #: Reading a PAC file from the filesystem, if the OS settings point to one.
+    LOCAL_FILE = "local_file"
+    #: Looking up the name of this host, for WPAD.
+    HOSTNAME = "hostname"
+    #: Assembling the PAC URLs to try.
+    WPAD_CANDIDATES = "wpad_candidates"
+    #: Consulting the discovery cache, if one is used.
+    CACHE = "cache"
+    #: Downloading the PAC file.
+    DOWNLOAD = "download"
+    #: Parsing the PAC file.
+    PARSE = "parse"
+
+    def __init__(self):
+        #: ``(stage, seconds)`` for each stage that ran, in order.
+        self.stages = []
+
+    @contextmanager
+    def measure(self, stage):
+        """Context manager that records the time spent in its body as the given stage."""
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.stages.append((stage, monotonic() - started))
+
+    @property
+    def total(self):
+        """Seconds spent on discovery overall."""
+        return sum(seconds for _, seconds in self.stages)
+
+    def __repr__(self):
+        return "<DiscoveryTimings {}>".format(" ".join("{}={:.3f}".format(stage, s) for stage, s in self.stages))
+
+
+class DeadlineExceededError(Timeout):
+    def __init__(self, seconds, stage):
+        super(DeadlineExceededError, self).__init__("Deadline of {}s exceeded before {}".format(seconds, stage))
+        #: Breakdown of where the time went, if known.
+        self.timings = None
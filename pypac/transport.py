@@ -0,0 +1,189 @@
+"""
+An HTTPX transport that routes requests according to a PAC file, with proxy failover.
+Requires the ``httpx`` extra.
+"""
+
+import asyncio
+
+import httpx
+
+from pypac.aio import AsyncProxyResolver
+from pypac.api import get_pac
+from pypac.resolver import ProxyConfigExhaustedError
+
+
+def default_proxy_fail_response_filter(response):
+    return False
+
+
+def default_proxy_fail_exception_filter(exc):
+    return isinstance(exc, (httpx.ProxyError, httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class AsyncPACTransport(httpx.AsyncBaseTransport):
+    """
+    Asynchronous HTTPX transport that discovers and complies with a PAC file,
+    with the same proxy selection and failover behaviour as :class:`pypac.PACSession`.
+    Each proxy gets its own connection pool, which is reused across requests.
+
+    Use it with an ``httpx.AsyncClient``::
+
+        async with httpx.AsyncClient(transport=AsyncPACTransport()) as client:
+            response = await client.get("https://example.org")
+
+    The proxy that served each response, or ``DIRECT``, is in the response's ``extensions`` as ``pac_proxy``.
+    Requests may be sent more than once during failover, so their bodies must be re-readable.
+    """
+
+    def __init__(
+        self,
+        pac=None,
+        proxy_auth=None,
+        pac_enabled=True,
+        response_proxy_fail_filter=None,
+        exception_proxy_fail_filter=None,
+        socks_scheme="socks5",
+        max_workers=4,
+        **transport_kwargs,
+    ):
+        """
+        :param PACFile pac: The PAC file to consult for proxy configuration info.
+            If not provided, then upon the first request, :func:`pypac.get_pac` is called with default arguments
+            in order to find a PAC file. This happens on a worker thread.
+        :param requests.auth.HTTPProxyAuth proxy_auth: Username and password proxy authentication.
+        :param bool pac_enabled: Set to ``False`` to disable all PAC functionality, including PAC auto-discovery.
+        :param response_proxy_fail_filter: Callable that takes an ``httpx.Response`` and returns
+            a boolean for whether the response means the proxy used for the request should no longer be used.
+            Only the status and headers are available. By default, the response is not inspected.
+        :param exception_proxy_fail_filter: Callable that takes an exception and returns
+            a boolean for whether the exception means the proxy used for the request should no longer be used.
+            By default, ``httpx.ProxyError``, ``httpx.ConnectError``, and ``httpx.ConnectTimeout`` are matched.
+        :param str socks_scheme: Scheme to use when PAC file returns a SOCKS proxy. `socks5` by default.
+        :param int max_workers: Number of threads for evaluating the PAC file.
+        :param transport_kwargs: Passed to each ``httpx.AsyncHTTPTransport``, such as ``limits``, ``verify``,
+            and ``retries``.
+        """
+        self._pac = pac
+        self._tried_get_pac = pac is not None
+        self._pac_lock = None
+        self._resolver = None
+        self._proxy_auth = proxy_auth
+        self._socks_scheme = socks_scheme
+        self._max_workers = max_workers
+        self._transport_kwargs = transport_kwargs
+        self._transports = {}
+
+        #: Set to ``False`` to disable all PAC functionality, including PAC auto-discovery.
+        self.pac_enabled = pac_enabled
+        self._response_proxy_failure_filter = response_proxy_fail_filter or default_proxy_fail_response_filter
+        self._exc_proxy_failure_filter = exception_proxy_fail_filter or default_proxy_fail_exception_filter
+
+        if pac:
+            self._use_pac(pac)
+
+    def _use_pac(self, pac):
+        self._resolver = AsyncProxyResolver(
+            pac, proxy_auth=self._proxy_auth, socks_scheme=self._socks_scheme, max_workers=self._max_workers
+        )
+
+    @property
+    def proxy_resolver(self):
+        """
+        Resolver for the PAC file in use, or ``None`` if there isn't one.
+
+        :rtype: pypac.aio.AsyncProxyResolver|None
+        """
+        return self._resolver
+
+    async def get_pac(self):
+        """
+        Search for, download, and parse PAC file if it hasn't already been done.
+        Concurrent callers share one search.
+
+        :returns: The obtained PAC file, if any.
+        :rtype: PACFile|None
+        :raises MalformedPacError: If something that claims to be a PAC file was downloaded but could not be parsed.
+        """
+        if not self.pac_enabled:
+            return
+        if not self._tried_get_pac:
+            if self._pac_lock is None:
+                self._pac_lock = asyncio.Lock()
+            async with self._pac_lock:
+                if not self._tried_get_pac:
+                    pac = await asyncio.get_running_loop().run_in_executor(None, get_pac)
+                    self._tried_get_pac = True
+                    if pac:
+                        self._use_pac(pac)
+        return self._resolver.pac if self._resolver else None
+
+    def transport_for(self, proxy):
+        """
+        :param str proxy: Proxy URL, or ``DIRECT``.
+        :returns: The transport that sends requests through the proxy. Created on first use.
+        :rtype: httpx.AsyncHTTPTransport
+        """
+        transport = self._transports.get(proxy)
+        if transport is None:
+            proxy_kwargs = {} if proxy == "DIRECT" else {"proxy": proxy}
+            transport = httpx.AsyncHTTPTransport(**dict(self._transport_kwargs, **proxy_kwargs))
+            self._transports[proxy] = transport
+        return transport
+
+    async def handle_async_request(self, request):
+        """
+        :raises ProxyConfigExhaustedError: If the PAC file provided no usable proxy configuration.
+        :raises MalformedPacError: If something that claims to be a PAC file was downloaded but could not be parsed.
+        """
+        await self.get_pac()
+        resolver = self._resolver if self.pac_enabled else None
+        if not resolver:
+            return await self.transport_for("DIRECT").handle_async_request(request)
+
+        url = str(request.url)
+        chain = await resolver.get_proxies(url)
+        proxy = resolver.resolver.get_proxy(url, chain)
+        if not proxy:
+            raise ProxyConfigExhaustedError(url)
+
+        while True:
+            try:
+                response = await self.transport_for(proxy).handle_async_request(request)
+            except Exception as request_exc:
+                if proxy != "DIRECT" and self._exc_proxy_failure_filter(request_exc):
+                    next_proxy = self._failover(resolver, proxy, url, chain)
+                    if next_proxy:
+                        proxy = next_proxy
+                        continue
+                raise
+
+            if proxy != "DIRECT" and self._response_proxy_failure_filter(response):
+                next_proxy = self._failover(resolver, proxy, url, chain)
+                if next_proxy:
+                    await response.aclose()
+                    proxy = next_proxy
+                    continue
+
+            response.extensions["pac_proxy"] = proxy
+            return response
+
+    def _failover(self, resolver, proxy, url, chain):
+        """
+        Ban a proxy, and get the next one to try.
+
+        :returns: The next proxy, or ``None`` if there are none left, in which case all proxies are unbanned.
+        :rtype: str|None
+        """
+        resolver.ban_proxy(proxy)
+        next_proxy = resolver.resolver.get_proxy(url, chain)
+        if not next_proxy:
+            resolver.unban_all()
+        return next_proxy
+
+    async def aclose(self):
+        """Close the connection pools for all proxies."""
+        transports, self._transports = list(self._transports.values()), {}
+        for transport in transports:
+            await transport.aclose()
+        if self._resolver:
+            self._resolver.close()
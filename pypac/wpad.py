@@ -3,6 +3,7 @@ Tools for the Web Proxy Auto-Discovery Protocol.
 """
 
 _psl = None
+_local_hostnames = {}  # By reverse_dns.
 
 
 def _get_psl():
@@ -15,6 +16,39 @@ def _get_psl():
     return _psl
 
 
+def local_hostname(reverse_dns=True):
+    """
+    Get the fully-qualified name of this host, for generating WPAD URLs.
+    The result is remembered for the rest of the process.
+
+    :param bool reverse_dns: Use :func:`socket.getfqdn`, which may do a slow reverse DNS lookup.
+        If ``False``, the host name is used as-is if it's qualified,
+        and otherwise the canonical name from a forward lookup of it is used.
+    :rtype: str
+    """
+    hostname = _local_hostnames.get(reverse_dns)
+    if hostname is None:
+        import socket
+
+        if reverse_dns:
+            hostname = socket.getfqdn()
+        else:
+            hostname = socket.gethostname()
+            if "." not in hostname:
+                try:
+                    canonical_name = socket.getaddrinfo(hostname, None, 0, 0, 0, socket.AI_CANONNAME)[0][3]
+                except (socket.error, IndexError):
+                    canonical_name = None
+                hostname = canonical_name or hostname
+        _local_hostnames[reverse_dns] = hostname
+    return hostname
+
+
+def forget_local_hostname():
+    """Forget the host name remembered by :func:`local_hostname`, such as after it has changed."""
+    _local_hostnames.clear()
+
+
 def proxy_urls_from_dns(local_hostname=None):
     """
     Generate URLs from which to look for a PAC file, based on a hostname.
@@ -0,0 +1,137 @@
+import asyncio
+import socket
+import time
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from pypac.aio import AsyncProxyResolver
+from pypac.parser import PACFile
+
+dns_pac_js = """
+function FindProxyForURL(url, host) {
+    if (isInNet(host, "10.0.0.0", "255.0.0.0")) return "DIRECT";
+    return "PROXY " + dnsResolve(host) + ":8080; DIRECT";
+}
+"""
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _fixed_dns(host):
+    return {"intranet.local": ["10.1.2.3"], "example.org": ["2001:db8::1", "203.0.113.7"]}.get(host, [])
+
+
+def _no_blocking_dns(*args):
+    raise AssertionError("Blocking DNS lookup")
+
+
+def test_get_proxies():
+    resolver = AsyncProxyResolver(PACFile(dns_pac_js), dns_resolver=_fixed_dns)
+
+    async def main():
+        return (
+            await resolver.get_proxies("http://example.org/"),
+            await resolver.get_proxy("http://intranet.local/"),
+            await resolver.get_proxies("http://unknown.local/"),
+        )
+
+    with patch("socket.gethostbyname", side_effect=_no_blocking_dns):
+        example, intranet, unknown = _run(main())
+    assert example == ["http://203.0.113.7:8080", "DIRECT"]
+    assert intranet == "DIRECT"
+    assert unknown == ["http://:8080", "DIRECT"]
+    resolver.close()
+
+
+def test_constant_pac():
+    async def no_dns(host):
+        raise AssertionError("DNS lookup for a constant PAC file")
+
+    resolver = AsyncProxyResolver(
+        PACFile('function FindProxyForURL(url, host) { return "DIRECT"; }'), dns_resolver=no_dns
+    )
+    assert _run(resolver.get_proxies("http://example.org/")) == ["DIRECT"]
+    resolver.close()
+
+
+def test_banning():
+    resolver = AsyncProxyResolver(PACFile(dns_pac_js), dns_resolver=_fixed_dns)
+    resolver.ban_proxy("http://203.0.113.7:8080")
+    assert _run(resolver.get_proxy("http://example.org/")) == "DIRECT"
+    resolver.unban_all()
+    assert _run(resolver.get_proxy("http://example.org/")) == "http://203.0.113.7:8080"
+
+
+def test_coalesce_same_host():
+    pac = PACFile(dns_pac_js)
+    resolver = AsyncProxyResolver(pac, dns_resolver=_fixed_dns, max_workers=8)
+    assert not pac.reads_url
+
+    def slow_find_proxy_for_url(url, host):
+        time.sleep(0.05)
+        return "PROXY p:80"
+
+    async def main():
+        urls = ["http://example.org/%d" % i for i in range(20)] + ["http://intranet.local/"]
+        return await asyncio.gather(*[resolver.get_proxies(url) for url in urls])
+
+    with patch.object(pac, "find_proxy_for_url", side_effect=slow_find_proxy_for_url) as find_proxy:
+        results = _run(main())
+    assert find_proxy.call_count == 2
+    assert results == [["http://p:80"]] * 21
+
+
+def test_no_coalescing_when_pac_reads_url():
+    pac = PACFile('function FindProxyForURL(url, host) { return url.indexOf("/a") > 0 ? "DIRECT" : "PROXY p:80"; }')
+    resolver = AsyncProxyResolver(pac, dns_resolver=_fixed_dns)
+    assert pac.reads_url
+
+    async def main():
+        return await asyncio.gather(
+            resolver.get_proxies("http://example.org/a"), resolver.get_proxies("http://example.org/b")
+        )
+
+    assert _run(main()) == [["DIRECT"], ["http://p:80"]]
+
+
+def test_event_loop_not_blocked():
+    """The event loop keeps running while the PAC file is evaluated."""
+    pac = PACFile(dns_pac_js)
+    resolver = AsyncProxyResolver(pac, dns_resolver=_fixed_dns)
+    ticks = []
+
+    def slow_find_proxy_for_url(url, host):
+        time.sleep(0.2)
+        return "DIRECT"
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.time())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(resolver.get_proxies("http://example.org/"), ticker())
+
+    with patch.object(pac, "find_proxy_for_url", side_effect=slow_find_proxy_for_url):
+        _run(main())
+    assert ticks[-1] - ticks[0] < 0.2
+
+
+def test_default_dns_resolver():
+    resolver = AsyncProxyResolver(PACFile(dns_pac_js))
+
+    def fake_getaddrinfo(host, port, *args, **kwargs):
+        if host == "intranet.local":
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("10.9.9.9", 0))]
+        raise socket.gaierror()
+
+    with patch("socket.getaddrinfo", side_effect=fake_getaddrinfo), patch(
+        "socket.gethostbyname", side_effect=_no_blocking_dns
+    ):
+        assert _run(resolver.get_proxies("http://intranet.local/")) == ["DIRECT"]
+        assert _run(resolver.get_proxies("http://nowhere.local/")) == ["http://:8080", "DIRECT"]
@@ -13,12 +13,26 @@ try:
 except ImportError:
     from mock import Mock, patch
 
-from pypac.api import PACSession, collect_pac_urls, download_pac, get_pac, pac_context_for_url
+from pypac.api import (
+    PACSession,
+    _race_proxy_connect,
+    _revalidate_cached_pac,
+    _with_connect_timeout,
+    clear_pac_context_cache,
+    collect_pac_urls,
+    download_pac,
+    get_pac,
+    pac_context_for_url,
+)
+from pypac.cache import DiscoveryCache
 from pypac.parser import MalformedPacError, PACFile
 from pypac.resolver import proxy_parameter_for_requests
+from pypac.timing import Deadline, DeadlineExceededError, DiscoveryTimings
 
 proxy_pac_js_tpl = 'function FindProxyForURL(url, host) { return "%s"; }'
 direct_pac_js = proxy_pac_js_tpl % "DIRECT"
+# Not constant, so that it's evaluated for each request.
+failover_pac_js = 'function FindProxyForURL(url, host) { return host ? "PROXY a:80; PROXY b:80; DIRECT" : ""; }'
 valid_pac_headers = {"content-type": "application/x-ns-proxy-autoconfig"}
 arbitrary_url = "http://example.org"
 arbitrary_pac_url = arbitrary_url + "/proxy.pac"
@@ -74,6 +88,29 @@ class TestApiFunctions(object):
                     "http://wpad.local/wpad.dat",
                 ]
 
+    def test_get_pac_stages(self):
+        timings = DiscoveryTimings()
+        with patch("pypac.api.ON_WINDOWS", True), patch(
+            "pypac.api.autoconfig_url_from_registry", return_value=arbitrary_pac_url
+        ) as read_registry, patch("pypac.api.local_hostname", return_value="host.dns.local") as hostname, patch(
+            "pypac.api.download_pac", return_value=direct_pac_js
+        ) as download:
+            assert get_pac(reverse_dns=False, timings=timings)
+        assert read_registry.call_count == 1
+        hostname.assert_called_once_with(False)
+        assert download.call_args[0][0] == [
+            arbitrary_pac_url,
+            "http://wpad.dns.local/wpad.dat",
+            "http://wpad.local/wpad.dat",
+        ]
+        assert [stage for stage, _ in timings.stages] == [
+            "os_settings",
+            "hostname",
+            "wpad_candidates",
+            "download",
+            "parse",
+        ]
+
     def test_download_pac_timeout(self):
         assert download_pac([arbitrary_pac_url], timeout=0.001) is None
 
@@ -102,6 +139,55 @@ class TestApiFunctions(object):
             assert log.levelno == logging.WARNING
             assert ex_warn in log.msg
 
+    def test_download_pac_deadline(self):
+        deadline = Deadline(0)
+        with _patch_request_base() as request, pytest.raises(DeadlineExceededError):
+            download_pac([arbitrary_pac_url], deadline=deadline)
+        request.assert_not_called()
+
+    @staticmethod
+    def _fake_wpad(outcomes):
+        """Fake responses for PAC URLs, as (delay, PAC JS or None) by URL."""
+        import time
+
+        def fake_request(method, url, **kwargs):
+            delay, pac_js = outcomes[url]
+            time.sleep(min(delay, kwargs["timeout"]))
+            if pac_js is None or delay > kwargs["timeout"]:
+                raise requests.exceptions.ConnectionError()
+            return Mock(spec=requests.Response, ok=True, headers=valid_pac_headers, text=pac_js)
+
+        return _patch_request_base(side_effect=fake_request)
+
+    @pytest.mark.parametrize(
+        "outcomes,expected_pac,max_seconds",
+        [
+            # Highest-priority success wins, even if a lower-priority one finished first.
+            ([(0.2, None), (0.1, "b"), (0, "c")], "b", 0.3),
+            # No waiting for lower-priority candidates once a higher-priority one has won.
+            ([(0.05, "a"), (1, "b")], "a", 0.5),
+            # The timeout covers all candidates together.
+            ([(1, "a"), (1, "b"), (1, "c")], None, 0.5),
+        ],
+    )
+    def test_download_pac_parallel(self, outcomes, expected_pac, max_seconds):
+        import time
+
+        urls = ["http://wpad{}/wpad.dat".format(i) for i in range(len(outcomes))]
+        with self._fake_wpad(dict(zip(urls, outcomes))):
+            started = time.time()
+            assert download_pac(urls, timeout=0.25, parallel=True) == expected_pac
+            assert time.time() - started < max_seconds
+
+    def test_download_pac_parallel_deadline(self):
+        with self._fake_wpad({arbitrary_pac_url: (1, None)}), pytest.raises(DeadlineExceededError):
+            download_pac([arbitrary_pac_url], timeout=5, deadline=Deadline(0.1), parallel=True)
+
+    def test_download_pac_sequential_deadline(self):
+        """Running out of time on the last candidate raises, rather than reporting that there's no PAC file."""
+        with self._fake_wpad({arbitrary_pac_url: (1, None)}), pytest.raises(DeadlineExceededError):
+            download_pac([arbitrary_pac_url], timeout=5, deadline=Deadline(0.1))
+
     def test_registry_filesystem_path(self):
         """
         The AutoConfigURL from the Windows Registry can also be a filesystem path.
@@ -132,6 +218,23 @@ def _patch_get_pac(return_value):
     return patch("pypac.api.get_pac", return_value=return_value)
 
 
+@pytest.fixture
+def listening_proxy():
+    """Address of a local socket that accepts connections, and one that refuses them."""
+    import socket
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    refuser = socket.socket()
+    refuser.bind(("127.0.0.1", 0))  # Bound but not listening.
+    try:
+        yield "127.0.0.1:%d" % listener.getsockname()[1], "127.0.0.1:%d" % refuser.getsockname()[1]
+    finally:
+        listener.close()
+        refuser.close()
+
+
 class TestRequests(object):
     """Test the behaviour of the Requests library that PyPAC expects."""
 
@@ -272,6 +375,56 @@ class TestPACSession(object):
                 ],
             )
 
+    def test_pac_failover_reuses_chain(self):
+        """Failover walks the proxies from the first PAC evaluation instead of evaluating the PAC again."""
+        pac = PACFile(failover_pac_js)
+        sess = PACSession(pac=pac)
+
+        def fake_request(method, url, proxies=None, **kwargs):
+            if proxies and proxies["http"] is not None:
+                raise ProxyError()
+
+        with _patch_request_base(side_effect=fake_request) as request, patch.object(
+            pac, "find_proxy_for_url", wraps=pac.find_proxy_for_url
+        ) as find_proxy:
+            sess.get(arbitrary_url)
+            assert find_proxy.call_count == 1
+            _assert_request_calls(
+                request,
+                [
+                    ("GET", arbitrary_url, proxy_parameter_for_requests("http://a:80")),
+                    ("GET", arbitrary_url, proxy_parameter_for_requests("http://b:80")),
+                    ("GET", arbitrary_url, proxy_parameter_for_requests("DIRECT")),
+                ],
+            )
+
+    def test_pac_failover_reresolve(self):
+        """Opt into consulting the PAC again for each failover."""
+        pac = PACFile(failover_pac_js)
+        sess = PACSession(pac=pac, reresolve_on_failover=True)
+
+        def fake_request(method, url, proxies=None, **kwargs):
+            if proxies and proxies["http"] == "http://a:80":
+                raise ProxyError()
+
+        with _patch_request_base(side_effect=fake_request), patch.object(
+            pac, "find_proxy_for_url", wraps=pac.find_proxy_for_url
+        ) as find_proxy:
+            sess.get(arbitrary_url)
+            assert find_proxy.call_count == 2
+
+    def test_pac_error_policy(self):
+        """The PAC file goes over its time limit, and the request is sent directly."""
+        pac = PACFile(
+            'function FindProxyForURL(url, host) { while (host == "example.org") {} return "PROXY a:80"; }', timeout=0.5
+        )
+        sess = PACSession(pac=pac, pac_error_policy="direct")
+        with _patch_request_base() as request:
+            sess.get(arbitrary_url)
+            _assert_request_calls(request, [("GET", arbitrary_url, proxy_parameter_for_requests("DIRECT"))])
+        with pytest.raises(ValueError):
+            PACSession(pac_error_policy="ignore")
+
     def test_pac_failover_to_direct(self):
         """Proxy fails. Next in line is DIRECT keyword."""
         sess = PACSession(pac=PACFile(proxy_pac_js))
@@ -392,7 +545,432 @@ class TestPACSession(object):
             )
 
 
+class TestProxyConnectTimeout(object):
+    @pytest.mark.parametrize(
+        "timeout,connect_timeout,expected",
+        [
+            (30, 2, (2, 30)),
+            (1, 2, (1, 1)),
+            ((5, 60), 2, (2, 60)),
+            (None, 2, (2, None)),
+            (30, None, (30, 30)),
+        ],
+    )
+    def test_with_connect_timeout(self, timeout, connect_timeout, expected):
+        assert _with_connect_timeout(timeout, connect_timeout) == expected
+
+    def test_connect_timeout_applies_to_pac_proxies_only(self):
+        sess = PACSession(pac=PACFile(proxy_pac_js), proxy_connect_timeout=0.5)
+        timeouts = []
+
+        def fake_request(method, url, proxies=None, **kwargs):
+            timeouts.append(kwargs.get("timeout"))
+            if proxies["http"]:
+                raise ConnectTimeout()
+
+        with _patch_request_base(side_effect=fake_request):
+            sess.get(arbitrary_url, timeout=30)
+        assert timeouts == [(0.5, 30), 30]
+
+    def test_race_proxy_connect(self, listening_proxy):
+        alive, dead = listening_proxy
+        winner, failed = _race_proxy_connect(["http://" + dead, "http://" + alive], 5, 1)
+        assert winner == "http://" + alive
+        assert failed == ["http://" + dead]
+        assert _race_proxy_connect(["http://" + dead, "http://" + dead], 5, 1) == (None, ["http://" + dead] * 2)
+
+    def test_session_races_proxies(self, listening_proxy):
+        alive, dead = listening_proxy
+        sess = PACSession(
+            pac=PACFile(proxy_pac_js_tpl % "PROXY {}; PROXY {}; DIRECT".format(dead, alive)), proxy_race_delay=5
+        )
+        with _patch_request_base() as request:
+            sess.get(arbitrary_url)
+            sess.get(arbitrary_url)
+        _assert_request_calls(
+            request,
+            [
+                ("GET", arbitrary_url, proxy_parameter_for_requests("http://" + alive)),
+                ("GET", arbitrary_url, proxy_parameter_for_requests("http://" + alive)),
+            ],
+        )
+
+
+class TestDeadline(object):
+    def test_timings_on_response(self):
+        sess = PACSession(pac=PACFile(proxy_pac_js))
+        mock_ok = Mock(spec=requests.Response, status_code=204)
+
+        def fake_request(method, url, proxies=None, **kwargs):
+            if proxies["http"]:
+                raise ProxyError()
+            return mock_ok
+
+        with _patch_request_base(side_effect=fake_request):
+            resp = sess.get(arbitrary_url)
+        assert [proxy for proxy, _ in resp.pac_timings.attempts] == [fake_proxy_url, None]
+        assert resp.pac_timings.total >= resp.pac_timings.resolve
+
+    def test_timeout_clamped_to_deadline(self):
+        sess = PACSession(pac=PACFile(proxy_pac_js), deadline=5)
+        with _patch_request_base() as request:
+            sess.get(arbitrary_url, timeout=30)
+            assert request.call_args[1]["timeout"] <= 5
+            sess.get(arbitrary_url, timeout=(1, 30), deadline=10)
+            connect_timeout, read_timeout = request.call_args[1]["timeout"]
+            assert connect_timeout == 1
+            assert 5 < read_timeout <= 10
+
+    def test_deadline_exceeded_during_failover(self):
+        sess = PACSession(pac=PACFile(proxy_pac_js_tpl % "PROXY a:80; PROXY b:80; DIRECT"))
+
+        def slow_failing_proxy(method, url, proxies=None, **kwargs):
+            import time
+
+            time.sleep(0.1)
+            raise ProxyError()
+
+        with _patch_request_base(side_effect=slow_failing_proxy) as request:
+            with pytest.raises(DeadlineExceededError) as e:
+                sess.get(arbitrary_url, deadline=0.05)
+        assert request.call_count == 1
+        assert [proxy for proxy, _ in e.value.timings.attempts] == ["http://a:80"]
+
+    def test_deadline_covers_discovery(self):
+        sess = PACSession(deadline=5)
+        with _patch_get_pac(None) as gp, _patch_request_base():
+            sess.get(arbitrary_url)
+        assert isinstance(gp.call_args[1]["deadline"], Deadline)
+
+
+class TestSingleFlightDiscovery(object):
+    @staticmethod
+    def _slow_get_pac(started, release):
+        def get_pac_side_effect(**kwargs):
+            started.set()
+            release.wait(5)
+            return PACFile(proxy_pac_js)
+
+        return patch("pypac.api.get_pac", side_effect=get_pac_side_effect)
+
+    def test_concurrent_first_requests(self):
+        import threading
+
+        sess = PACSession()
+        started, release = threading.Event(), threading.Event()
+        responses = []
+
+        def send():
+            responses.append(sess.get(arbitrary_url))
+
+        with self._slow_get_pac(started, release) as gp, _patch_request_base(
+            return_value=Mock(spec=requests.Response, status_code=204)
+        ) as request:
+            threads = [threading.Thread(target=send) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            started.wait(5)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        assert gp.call_count == 1
+        assert request.call_count == 10
+        for _, kwargs in request.call_args_list:
+            assert kwargs["proxies"] == fake_proxies_requests_arg
+        assert len(responses) == 10
+        assert sum(1 for resp in responses if resp.pac_timings.discovery_wait > 0) >= 9
+
+    @pytest.mark.parametrize(
+        "policy,expected_proxies", [("direct", proxy_parameter_for_requests("DIRECT")), ("env", None)]
+    )
+    def test_pending_policy(self, policy, expected_proxies):
+        import threading
+
+        sess = PACSession(pending_pac_policy=policy)
+        started, release = threading.Event(), threading.Event()
+        with self._slow_get_pac(started, release) as gp, _patch_request_base() as request:
+            first = threading.Thread(target=sess.get, args=(arbitrary_url,))
+            first.start()
+            started.wait(5)
+            sess.get(arbitrary_url)
+            _assert_request_calls(request, [("GET", arbitrary_url, expected_proxies)])
+            release.set()
+            first.join(5)
+            sess.get(arbitrary_url)
+        assert gp.call_count == 1
+        _assert_request_calls(request, [("GET", arbitrary_url, fake_proxies_requests_arg)])
+
+    def test_unknown_pending_policy(self):
+        with pytest.raises(ValueError):
+            PACSession(pending_pac_policy="later")
+
+
+class TestPrefetch(object):
+    def test_prefetch(self):
+        with _patch_get_pac(PACFile(proxy_pac_js)) as gp, _patch_request_base() as request:
+            sess = PACSession(prefetch=True)
+            sess._prefetch_thread.join(5)
+            assert sess.pac_discovery_time is not None
+            sess.get(arbitrary_url)
+        gp.assert_called_once_with()
+        _assert_request_calls(request, [("GET", arbitrary_url, fake_proxies_requests_arg)])
+
+    def test_prefetch_ignored_with_pac(self):
+        with _patch_get_pac(None) as gp:
+            sess = PACSession(pac=PACFile(proxy_pac_js), prefetch=True)
+        assert sess._prefetch_thread is None
+        gp.assert_not_called()
+
+    @pytest.mark.parametrize("policy", ["wait", "direct"])
+    def test_requests_during_prefetch(self, policy):
+        import threading
+
+        release = threading.Event()
+
+        def slow_get_pac(**kwargs):
+            release.wait(5)
+            return PACFile(proxy_pac_js)
+
+        with patch("pypac.api.get_pac", side_effect=slow_get_pac), _patch_request_base(
+            return_value=Mock(spec=requests.Response, status_code=204)
+        ) as request:
+            sess = PACSession(prefetch=True, pending_pac_policy=policy)
+            threading.Timer(0.1, release.set).start()
+            resp = sess.get(arbitrary_url)
+            sess._prefetch_thread.join(5)
+        if policy == "wait":
+            _assert_request_calls(request, [("GET", arbitrary_url, fake_proxies_requests_arg)])
+            assert resp.pac_timings.discovery_wait > 0
+        else:
+            _assert_request_calls(request, [("GET", arbitrary_url, proxy_parameter_for_requests("DIRECT"))])
+            assert resp.pac_timings.discovery_wait == 0
+
+    def test_prefetch_error(self, caplog):
+        with patch("pypac.api.get_pac", side_effect=MalformedPacError()) as gp:
+            sess = PACSession(prefetch=True)
+            sess._prefetch_thread.join(5)
+        assert "Background PAC discovery failed" in caplog.text
+        with _patch_get_pac(None) as gp, _patch_request_base():
+            sess.get(arbitrary_url)
+        gp.assert_called_once_with()
+
+
+class TestDiscoveryCache(object):
+    key = [True, True, None, "host.example"]
+
+    @pytest.fixture(autouse=True)
+    def hostname(self):
+        with patch("pypac.api.local_hostname", return_value="host.example") as hostname:
+            yield hostname
+
+    @staticmethod
+    def _pac_response(status_code=200, text=direct_pac_js, **headers):
+        return Mock(
+            spec=requests.Response,
+            ok=True,
+            status_code=status_code,
+            text=text,
+            headers=dict(valid_pac_headers, **headers),
+        )
+
+    def test_found_then_cached(self, tmp_path):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        with patch("pypac.api.collect_pac_urls", return_value=["http://a/wpad.dat", arbitrary_pac_url]), patch(
+            "pypac.api._fetch_pac", side_effect=[None, self._pac_response(etag='"v1"')]
+        ):
+            assert get_pac(discovery_cache=cache).find_proxy_for_url("/", "x") == "DIRECT"
+        entry = cache.load(self.key)
+        assert (entry["pac_url"], entry["etag"]) == (arbitrary_pac_url, '"v1"')
+
+        with patch("pypac.api.collect_pac_urls") as collect, patch("pypac.api._revalidate_cached_pac") as revalidate:
+            assert get_pac(discovery_cache=cache).find_proxy_for_url("/", "x") == "DIRECT"
+        collect.assert_not_called()
+        assert revalidate.call_args[0][:2] == (cache, entry)
+
+    def test_not_found_then_cached(self, tmp_path):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        with patch("pypac.api.collect_pac_urls", return_value=[arbitrary_pac_url]), patch(
+            "pypac.api._fetch_pac", return_value=None
+        ):
+            assert get_pac(discovery_cache=cache) is None
+        with patch("pypac.api.collect_pac_urls") as collect:
+            assert get_pac(discovery_cache=cache) is None
+            assert get_pac(discovery_cache=cache, from_dns=False) is None
+        assert collect.call_count == 1
+
+    def test_not_used_after_hostname_change(self, tmp_path, hostname):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        with patch("pypac.api._fetch_pac", return_value=None):
+            assert get_pac(discovery_cache=cache) is None
+        hostname.return_value = "host.elsewhere.example"
+        with patch("pypac.api._fetch_pac", return_value=self._pac_response()):
+            assert get_pac(discovery_cache=cache).source.url == "http://wpad.elsewhere.example/wpad.dat"
+
+    def test_not_used_after_os_settings_change(self, tmp_path):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        with patch("pypac.api._fetch_pac", return_value=None):
+            assert get_pac(discovery_cache=cache) is None
+        with patch("pypac.api._autoconfig_url_from_os_settings", return_value=arbitrary_pac_url), patch(
+            "pypac.api._fetch_pac", return_value=self._pac_response()
+        ):
+            assert get_pac(discovery_cache=cache).source.url == arbitrary_pac_url
+
+    def test_session(self, tmp_path):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        cache.store_not_found(self.key)
+        with patch("pypac.api.collect_pac_urls") as collect, _patch_request_base():
+            PACSession(discovery_cache=cache).get(arbitrary_url)
+        collect.assert_not_called()
+
+    def test_os_settings_file_before_cache(self, tmp_path):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        cache.store_not_found(self.key)
+        path = str(tmp_path / "proxy.pac")
+        with open(path, "w") as f:
+            f.write(proxy_pac_js)
+        with patch("pypac.api.ON_WINDOWS", True), patch("pypac.api.autoconfig_url_from_registry", return_value=path):
+            assert get_pac(discovery_cache=cache).source.path == path
+
+    @pytest.mark.parametrize("status_code,expected_js", [(304, direct_pac_js), (200, proxy_pac_js)])
+    def test_revalidate(self, tmp_path, status_code, expected_js):
+        cache = DiscoveryCache(str(tmp_path / "pac.json"))
+        cache.store_found(self.key, arbitrary_pac_url, direct_pac_js, '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT")
+        entry = cache.load(self.key)
+        resp = self._pac_response(status_code, proxy_pac_js, etag='"v2"')
+        with patch("pypac.api._fetch_pac", return_value=resp) as fetch:
+            _revalidate_cached_pac(cache, entry, 2)
+        assert fetch.call_args[1]["headers"] == {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+        }
+        updated = cache.load(self.key)
+        assert updated["pac_js"] == expected_js
+        assert updated["stored_at"] >= entry["stored_at"]
+
+
+class TestRefresh(object):
+    def test_get_pac_records_source(self, tmp_path):
+        with _patch_download_pac(direct_pac_js):
+            assert get_pac(url=arbitrary_pac_url).source.candidate_urls == [arbitrary_pac_url]
+        path = str(tmp_path / "proxy.pac")
+        with open(path, "w") as f:
+            f.write(direct_pac_js)
+        with patch("pypac.api.ON_WINDOWS", True), patch("pypac.api.autoconfig_url_from_registry", return_value=path):
+            assert get_pac().source.path == path
+
+    def test_refresh_swaps_resolver(self):
+        sess = PACSession(pac=PACFile(direct_pac_js))
+        new_pac = PACFile(proxy_pac_js)
+        with patch("pypac.api.fetch_if_changed", side_effect=[None, new_pac]):
+            assert not sess.refresh_pac()
+            assert sess.refresh_pac()
+        assert sess.get_pac() is new_pac
+
+    def test_refresh_during_request(self):
+        sess = PACSession(pac=PACFile(direct_pac_js))
+        new_pac = PACFile(proxy_pac_js)
+
+        def fake_request(method, url, proxies=None, **kwargs):
+            # PAC changes while the request is in progress.
+            with patch("pypac.api.fetch_if_changed", return_value=new_pac):
+                sess.refresh_pac()
+            if proxies["http"] is None:
+                raise ProxyError()
+            return Mock(spec=requests.Response, status_code=204)
+
+        with _patch_request_base(side_effect=fake_request) as request:
+            with pytest.raises(ProxyError):
+                sess.get(arbitrary_url)
+            _assert_request_calls(request, [("GET", arbitrary_url, proxy_parameter_for_requests("DIRECT"))])
+            sess.get(arbitrary_url)
+            _assert_request_calls(request, [("GET", arbitrary_url, fake_proxies_requests_arg)])
+
+    def test_refresh_warm_swap(self):
+        sess = PACSession(pac=PACFile(direct_pac_js), resolution_cache_size=10, warm_swap_hosts=5)
+        with _patch_request_base():
+            sess.get(arbitrary_url)
+            sess.get("http://other.example.org/")
+        assert sess.route_changes is None
+        new_pac = PACFile(
+            "function FindProxyForURL(url, host) { "
+            'return host == "other.example.org" ? "DIRECT" : "PROXY fake.local:8080; DIRECT"; }'
+        )
+        with patch("pypac.api.fetch_if_changed", return_value=new_pac):
+            assert sess.refresh_pac()
+        assert [(c.host, c.old_proxies, c.new_proxies) for c in sess.route_changes] == [
+            ("example.org", ["DIRECT"], [fake_proxy_url, "DIRECT"])
+        ]
+
+    def test_refresh_warm_swap_errors(self):
+        host_pac = PACFile('function FindProxyForURL(url, host) { return "PROXY " + host + ":80"; }')
+        sess = PACSession(pac=host_pac, resolution_cache_size=10, warm_swap_hosts=5)
+        with _patch_request_base():
+            sess.get(arbitrary_url)
+            sess.get("http://other.example.org/")
+        new_pac = PACFile(
+            'function FindProxyForURL(url, host) { if (host == "example.org") throw "broken"; return "DIRECT"; }'
+        )
+        with patch("pypac.api.fetch_if_changed", return_value=new_pac):
+            assert sess.refresh_pac()
+        assert sess.get_pac() is new_pac
+        assert sorted((c.host, c.new_proxies, c.error is not None) for c in sess.route_changes) == [
+            ("example.org", None, True),
+            ("other.example.org", ["DIRECT"], False),
+        ]
+
+    def test_refresh_keeps_last_known_good(self):
+        sess = PACSession(pac=PACFile(failover_pac_js), pac_error_policy="last_known_good", pac_error_threshold=1)
+        with _patch_request_base():
+            sess.get(arbitrary_url)
+        broken_pac = PACFile('function FindProxyForURL(url, host) { if (host == "example.org") throw "broken"; }')
+        with patch("pypac.api.fetch_if_changed", return_value=broken_pac):
+            assert sess.refresh_pac()
+        with _patch_request_base() as request:
+            sess.get(arbitrary_url)
+            sess.get(arbitrary_url)
+            _assert_request_calls(
+                request,
+                [("GET", arbitrary_url, proxy_parameter_for_requests("http://a:80"))] * 2,
+            )
+
+    def test_refresh_during_failover(self):
+        """Failover bans proxies in, and continues with, the version of the PAC file the request started with."""
+        sess = PACSession(pac=PACFile(failover_pac_js), reresolve_on_failover=True)
+        old_resolver = sess._proxy_resolver
+        new_pac = PACFile(proxy_pac_js)
+
+        def fake_request(method, url, proxies=None, **kwargs):
+            with patch("pypac.api.fetch_if_changed", return_value=new_pac):
+                sess.refresh_pac()
+            if proxies["http"] == "http://a:80":
+                raise ProxyError()
+            return Mock(spec=requests.Response, status_code=204)
+
+        with _patch_request_base(side_effect=fake_request) as request:
+            sess.get(arbitrary_url)
+        assert [call[1]["proxies"]["http"] for call in request.call_args_list] == ["http://a:80", "http://b:80"]
+        assert old_resolver._offline_proxies == {"http://a:80"}
+        assert not sess._proxy_resolver._offline_proxies
+
+    def test_background_refresh(self):
+        import threading
+
+        refreshed = threading.Event()
+        with patch("pypac.api.fetch_if_changed", side_effect=lambda pac: refreshed.set()):
+            sess = PACSession(pac=PACFile(direct_pac_js), refresh_interval=0.01)
+            assert refreshed.wait(5)
+            sess.close()
+            sess._refresh_thread.join(5)
+        assert not sess._refresh_thread.is_alive()
+
+
 class TestContextManager(object):
+    @pytest.fixture(autouse=True)
+    def fresh_cache(self):
+        clear_pac_context_cache()
+        yield
+        clear_pac_context_cache()
+
     def test_no_pac_no_env(self, monkeypatch):
         monkeypatch.delenv("HTTP_PROXY", raising=False)
         monkeypatch.delenv("HTTPS_PROXY", raising=False)
@@ -421,3 +999,63 @@ class TestContextManager(object):
                 assert os.environ["HTTP_PROXY"] == ""
                 assert os.environ["HTTPS_PROXY"] == ""
         assert os.environ["HTTP_PROXY"] == "http://env"
+
+    def test_pac_reused(self, monkeypatch):
+        monkeypatch.delenv("HTTP_PROXY", raising=False)
+        with _patch_get_pac(PACFile(proxy_pac_js)) as gp:
+            for _ in range(3):
+                with pac_context_for_url(arbitrary_url):
+                    assert os.environ["HTTP_PROXY"] == fake_proxy_url
+        assert gp.call_count == 1
+        assert "HTTP_PROXY" not in os.environ
+
+    def test_no_pac_reused(self):
+        with _patch_get_pac(None) as gp:
+            for _ in range(3):
+                with pac_context_for_url(arbitrary_url):
+                    pass
+        assert gp.call_count == 1
+
+    def test_refresh(self, monkeypatch):
+        import time
+
+        monkeypatch.setenv("HTTP_PROXY", "http://env")
+        old_pac = PACFile(proxy_pac_js_tpl % "DIRECT")
+        with _patch_get_pac(old_pac) as gp, patch(
+            "pypac.api.fetch_if_changed", return_value=PACFile(proxy_pac_js)
+        ) as fetch_if_changed:
+            with pac_context_for_url(arbitrary_url, max_age=0):
+                assert os.environ["HTTP_PROXY"] == ""
+            # Stale, so refreshed in the background. The old PAC file is used meanwhile.
+            with pac_context_for_url(arbitrary_url, max_age=0):
+                assert os.environ["HTTP_PROXY"] in ("", fake_proxy_url)
+            proxies = []
+            for _ in range(50):
+                with pac_context_for_url(arbitrary_url):
+                    proxies.append(os.environ["HTTP_PROXY"])
+                if proxies[-1]:
+                    break
+                time.sleep(0.1)
+        assert proxies[-1] == fake_proxy_url
+        fetch_if_changed.assert_called_once_with(old_pac)
+        assert gp.call_count == 1
+
+    def test_overlapping_contexts(self, monkeypatch):
+        monkeypatch.setenv("HTTP_PROXY", "http://env")
+        pac = PACFile('function FindProxyForURL(url, host) { return host == "a" ? "PROXY a:80" : "PROXY b:80"; }')
+        first, second = pac_context_for_url("http://a/", pac=pac), pac_context_for_url("http://b/", pac=pac)
+        first.__enter__()
+        second.__enter__()
+        assert os.environ["HTTP_PROXY"] == "http://b:80"
+        # Exiting out of order, as threads may.
+        first.__exit__(None, None, None)
+        assert os.environ["HTTP_PROXY"] == "http://b:80"
+        second.__exit__(None, None, None)
+        assert os.environ["HTTP_PROXY"] == "http://env"
+
+    def test_restored_on_error(self, monkeypatch):
+        monkeypatch.setenv("HTTP_PROXY", "http://env")
+        with pytest.raises(ValueError):
+            with pac_context_for_url(arbitrary_url, pac=PACFile(proxy_pac_js)):
+                raise ValueError()
+        assert os.environ["HTTP_PROXY"] == "http://env"
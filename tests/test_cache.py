@@ -0,0 +1,80 @@
+import json
+import time
+
+import pytest
+
+from pypac.cache import DiscoveryCache
+
+key = [True, True]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiscoveryCache(str(tmp_path / "pac.json"), ttl=60, negative_ttl=10)
+
+
+def test_empty(cache):
+    assert cache.load(key) is None
+
+
+def test_found(cache):
+    cache.store_found(key, "http://wpad/wpad.dat", "js", etag='"1"', last_modified=None)
+    entry = cache.load(key)
+    assert entry["pac_url"] == "http://wpad/wpad.dat"
+    assert entry["pac_js"] == "js"
+    assert entry["etag"] == '"1"'
+    assert cache.load([True, False]) is None
+
+
+def test_not_found(cache):
+    cache.store_not_found(key)
+    assert cache.load(key)["pac_url"] is None
+
+
+@pytest.mark.parametrize("found,age,fresh", [(True, 30, True), (True, 90, False), (False, 5, True), (False, 30, False)])
+def test_ttl(cache, found, age, fresh):
+    if found:
+        cache.store_found(key, "http://wpad/wpad.dat", "js")
+    else:
+        cache.store_not_found(key)
+    with open(cache.path) as f:
+        entry = json.load(f)
+    entry["stored_at"] = time.time() - age
+    with open(cache.path, "w") as f:
+        json.dump(entry, f)
+    assert (cache.load(key) is not None) is fresh
+    if not fresh and found:
+        cache.touch(entry)
+        assert cache.load(key) is not None
+
+
+def test_corrupt(cache):
+    with open(cache.path, "w") as f:
+        f.write("{not json")
+    assert cache.load(key) is None
+    cache.clear()
+    cache.clear()
+    assert cache.load(key) is None
+
+
+def test_unwritable(tmp_path, caplog):
+    cache = DiscoveryCache(str(tmp_path / "missing" / "pac.json"))
+    cache.store_not_found(key)
+    assert "Could not write PAC discovery cache" in caplog.text
+
+
+def test_concurrent_writes(cache, tmp_path, caplog):
+    import threading
+
+    def write(i):
+        for _ in range(20):
+            cache.store_found(key, "http://wpad/{}.dat".format(i), "js")
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.load(key)["pac_url"].startswith("http://wpad/")
+    assert [path.name for path in tmp_path.iterdir()] == ["pac.json"]
+    assert "Could not write" not in caplog.text
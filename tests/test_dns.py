@@ -0,0 +1,136 @@
+import socket
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from pypac import dns
+from pypac.parser_functions import dnsResolve, isResolvable
+from pypac.parser_functions_ex import dnsResolveEx
+
+
+def _no_blocking_dns(*args):
+    raise AssertionError("Blocking DNS lookup")
+
+
+def test_preresolved():
+    answers = {"a.local": ["2001:db8::1", "10.0.0.1"], "gone.local": []}
+    with patch("socket.gethostbyname", side_effect=_no_blocking_dns), patch(
+        "socket.getaddrinfo", side_effect=_no_blocking_dns
+    ), dns.preresolved(answers):
+        assert dns.gethostbyname("a.local") == "10.0.0.1"
+        assert dns.getaddrinfo_addresses("a.local") == ["2001:db8::1", "10.0.0.1"]
+        assert dnsResolve("a.local") == "10.0.0.1"
+        assert dnsResolveEx("a.local") == "2001:db8::1;10.0.0.1"
+        assert dnsResolve("gone.local") == ""
+        assert not isResolvable("gone.local")
+        with pytest.raises(socket.gaierror):
+            dns.getaddrinfo_addresses("gone.local")
+
+
+def test_preresolved_fallback():
+    with patch("socket.gethostbyname", return_value="10.1.1.1") as gethostbyname, dns.preresolved({}):
+        assert dnsResolve("other.local") == "10.1.1.1"
+    gethostbyname.assert_called_once_with("other.local")
+
+
+def test_preresolved_ipv6_only():
+    with dns.preresolved({"v6.local": ["2001:db8::1"]}):
+        with pytest.raises(socket.gaierror):
+            dns.gethostbyname("v6.local")
+
+
+@pytest.fixture
+def cooperative_resolver():
+    yield dns.set_resolver
+    dns.set_resolver(None)
+
+
+def test_set_resolver(cooperative_resolver):
+    def resolve(host):
+        if host == "error.local":
+            raise socket.gaierror("nope")
+        return {"a.local": ["2001:db8::1", "10.0.0.1"]}.get(host, [])
+
+    cooperative_resolver(resolve)
+    with patch("socket.gethostbyname", side_effect=_no_blocking_dns), patch(
+        "socket.getaddrinfo", side_effect=_no_blocking_dns
+    ):
+        assert dnsResolve("a.local") == "10.0.0.1"
+        assert dnsResolveEx("a.local") == "2001:db8::1;10.0.0.1"
+        assert not isResolvable("gone.local")
+        assert not isResolvable("error.local")
+        with dns.preresolved({"a.local": ["10.9.9.9"]}):
+            assert dnsResolve("a.local") == "10.9.9.9"
+
+
+def test_set_resolver_gevent(cooperative_resolver):
+    gevent = pytest.importorskip("gevent")
+    from pypac.parser import PACFile
+
+    def resolve(host):
+        gevent.sleep(0.2)
+        return ["10.0.0.{}".format(len(host))]
+
+    cooperative_resolver(resolve)
+    pac = PACFile('function FindProxyForURL(url, host) { return "PROXY " + dnsResolve(host) + ":80"; }')
+    hosts = ["h{}.local".format("x" * i) for i in range(20)]
+    jobs = [gevent.spawn(pac.find_proxy_for_url, "http://{}/".format(host), host) for host in hosts]
+    # Lookups yield to the hub, so the evaluations overlap instead of taking 0.2s each.
+    gevent.joinall(jobs, timeout=2, raise_error=True)
+    assert [job.value for job in jobs] == ["PROXY 10.0.0.{}:80".format(len(host)) for host in hosts]
+
+
+def test_lookups_outside_interpreter_lock(cooperative_resolver):
+    """Lookups aren't made while the interpreter is locked, even if the PAC file catches errors."""
+    from pypac.parser import PACFile
+
+    pac = PACFile(
+        "function FindProxyForURL(url, host) {"
+        '  try { var ip = dnsResolve(host); } catch (e) { return "PROXY wrong:80"; }'
+        '  return isResolvable("other.local") ? "PROXY " + ip + ":80" : "DIRECT";'
+        "}"
+    )
+    looked_up = []
+
+    def resolve(host):
+        assert not pac._lock.locked()
+        looked_up.append(host)
+        return ["10.0.0.1"]
+
+    cooperative_resolver(resolve)
+    assert pac.find_proxy_for_url("http://a.local/", "a.local") == "PROXY 10.0.0.1:80"
+    assert looked_up == ["a.local", "other.local"]
+
+
+def test_concurrent_lookups(cooperative_resolver):
+    """Threads evaluating one PAC file don't wait for each other's lookups."""
+    import threading
+    import time
+
+    from pypac.parser import PACFile
+
+    def resolve(host):
+        time.sleep(0.1)
+        return ["10.0.0.{}".format(len(host))]
+
+    cooperative_resolver(resolve)
+    pac = PACFile('function FindProxyForURL(url, host) { return "PROXY " + dnsResolve(host) + ":80"; }')
+    hosts = ["h{}.local".format("x" * i) for i in range(20)]
+    results = {}
+
+    def evaluate(host):
+        results[host] = pac.find_proxy_for_url("http://{}/".format(host), host)
+
+    threads = [threading.Thread(target=evaluate, args=(host,)) for host in hosts]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # One lookup after another would take 2s.
+    assert time.time() - start < 1
+    assert results == {host: "PROXY 10.0.0.{}:80".format(len(host)) for host in hosts}
@@ -0,0 +1,119 @@
+import pytest
+import requests
+import requests.sessions
+import requests.utils
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from pypac import hooks
+from pypac.api import clear_pac_context_cache
+from pypac.parser import PACFile
+from pypac.resolver import ProxyConfigExhaustedError
+
+pac_js = """
+function FindProxyForURL(url, host) {
+    if (host == "direct.example.org") return "DIRECT";
+    if (host == "nowhere.example.org") return "";
+    return "PROXY " + host.split(".")[0] + ".proxy.local:8080";
+}
+"""
+
+
+@pytest.fixture(autouse=True)
+def uninstall():
+    clear_pac_context_cache()
+    yield
+    hooks.uninstall()
+    clear_pac_context_cache()
+
+
+def _urllib_request(url):
+    from pypac.hooks import urllib_request
+
+    return urllib_request.Request(url)
+
+
+def test_install_uninstall():
+    from pypac.hooks import urllib_request
+
+    original = requests.utils.get_environ_proxies
+    hooks.install(PACFile(pac_js))
+    hooks.install(PACFile(pac_js))
+    assert hooks.is_installed()
+    assert requests.utils.get_environ_proxies is hooks.get_environ_proxies
+    assert requests.sessions.get_environ_proxies is hooks.get_environ_proxies
+    assert urllib_request.ProxyHandler is hooks.PACProxyHandler
+    hooks.uninstall()
+    hooks.uninstall()
+    assert not hooks.is_installed()
+    assert requests.utils.get_environ_proxies is original
+    assert requests.sessions.get_environ_proxies is original
+    assert urllib_request.ProxyHandler is not hooks.PACProxyHandler
+
+
+def test_requests_per_url(monkeypatch):
+    monkeypatch.setenv("HTTP_PROXY", "http://env:80")
+    hooks.install(PACFile(pac_js))
+    sess = requests.Session()
+    for url, expected in [
+        ("http://a.example.org/", "http://a.proxy.local:8080"),
+        ("http://b.example.org/", "http://b.proxy.local:8080"),
+    ]:
+        settings = sess.merge_environment_settings(url, {}, None, None, None)
+        assert settings["proxies"] == {"http": expected, "https": expected}
+    settings = sess.merge_environment_settings("http://direct.example.org/", {}, None, None, None)
+    assert not settings["proxies"]
+    # Explicit proxies win.
+    settings = sess.merge_environment_settings("http://a.example.org/", {"http": "http://x:1"}, None, None, None)
+    assert settings["proxies"]["http"] == "http://x:1"
+    with pytest.raises(ProxyConfigExhaustedError):
+        sess.merge_environment_settings("http://nowhere.example.org/", {}, None, None, None)
+
+
+def test_requests_without_pac(monkeypatch):
+    monkeypatch.setenv("HTTP_PROXY", "http://env:80")
+    hooks.install()
+    with patch("pypac.api.get_pac", return_value=None) as gp:
+        assert requests.utils.get_environ_proxies("http://a.example.org/")["http"] == "http://env:80"
+        assert requests.utils.get_environ_proxies("http://b.example.org/")["http"] == "http://env:80"
+    assert gp.call_count == 1
+
+
+def test_shared_discovered_pac():
+    hooks.install()
+    with patch("pypac.api.get_pac", return_value=PACFile(pac_js)) as gp:
+        assert hooks.proxy_for_url("http://a.example.org/") == "http://a.proxy.local:8080"
+        assert hooks.proxy_for_url("http://b.example.org/") == "http://b.proxy.local:8080"
+    assert gp.call_count == 1
+
+
+def test_urllib_per_url(monkeypatch):
+    from pypac.hooks import urllib_request
+
+    monkeypatch.delenv("NO_PROXY", raising=False)
+    monkeypatch.delenv("no_proxy", raising=False)
+    hooks.install(PACFile(pac_js))
+    handler = urllib_request.ProxyHandler()
+    assert isinstance(handler, hooks.PACProxyHandler)
+    assert any(isinstance(h, hooks.PACProxyHandler) for h in urllib_request.build_opener().handlers)
+
+    req = _urllib_request("http://a.example.org/path")
+    handler.http_open(req)
+    assert req.host == "a.proxy.local:8080"
+    req = _urllib_request("http://b.example.org/path")
+    handler.http_open(req)
+    assert req.host == "b.proxy.local:8080"
+    req = _urllib_request("http://direct.example.org/path")
+    handler.http_open(req)
+    assert req.host == "direct.example.org"
+
+
+def test_urllib_explicit_proxies():
+    hooks.install(PACFile(pac_js))
+    handler = hooks.PACProxyHandler({"http": "http://x:1"})
+    req = _urllib_request("https://a.example.org/path")
+    assert handler.https_open(req) is None
+    assert req.host == "a.example.org"
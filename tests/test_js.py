@@ -0,0 +1,111 @@
+import pytest
+
+from pypac._js import UnsupportedSyntax, find_function, parse, tokenize
+
+
+def _values(source):
+    return [(token.kind, token.value) for token in tokenize(source)][:-1]
+
+
+def test_tokenize():
+    assert _values("var x = 'a\\'b' + \"\\x41\\u0042\"; // comment") == [
+        ("keyword", "var"),
+        ("name", "x"),
+        ("punct", "="),
+        ("string", "a'b"),
+        ("punct", "+"),
+        ("string", "AB"),
+        ("punct", ";"),
+    ]
+    assert _values("x === 0x1F /* c */ >>>= 1.5e1") == [
+        ("name", "x"),
+        ("punct", "==="),
+        ("number", 31),
+        ("punct", ">>>="),
+        ("number", 15),
+    ]
+
+
+@pytest.mark.parametrize(
+    "source,regex_count",
+    [
+        ("a / b / c", 0),
+        ("x = /a\\/[/]b/gi.test(y)", 1),
+        ("if (/^ab/.test(h)) return", 1),
+        ("(a) / 2", 0),
+        ("return /a/", 1),
+    ],
+)
+def test_tokenize_regex_or_division(source, regex_count):
+    assert sum(1 for token in tokenize(source) if token.kind == "regex") == regex_count
+
+
+def test_tokenize_lines():
+    tokens = tokenize("a\n/* x\ny */ b\n'c'")
+    assert [(token.line, token.newline_before) for token in tokens[:3]] == [(1, False), (3, True), (4, True)]
+
+
+@pytest.mark.parametrize("source", ["'abc", "/* abc", "a = /abc", "a # b"])
+def test_tokenize_invalid(source):
+    with pytest.raises(UnsupportedSyntax):
+        tokenize(source)
+
+
+def test_parse():
+    program = parse(
+        """
+        var domains = ["a.com", ".b.com"];
+        function FindProxyForURL(url, host) {
+            host = host.toLowerCase()
+            if (isPlainHostName(host) || dnsDomainIs(host, ".local")) return "DIRECT";
+            else if (!isResolvable(host)) { return "PROXY a:1" }
+            for (var i = 0; i < domains.length; i++) if (dnsDomainIs(host, domains[i])) return "DIRECT";
+            return host.length > 3 ? "PROXY b:2" : "PROXY c:3";
+        }
+        """
+    )
+    assert [statement.kind for statement in program.body] == ["Var", "Function"]
+    function = find_function(program, "FindProxyForURL")
+    assert function.params == ["url", "host"]
+    assert [statement.kind for statement in function.body] == ["Expression", "If", "For", "Return"]
+    condition = function.body[1].test
+    assert (condition.kind, condition.operator) == ("Binary", "||")
+    assert [node.name for node in condition.walk() if node.kind == "Identifier"] == [
+        "isPlainHostName",
+        "host",
+        "dnsDomainIs",
+        "host",
+    ]
+    assert function.body[3].value.kind == "Conditional"
+    assert function.body[3].line == 8
+
+
+def test_parse_precedence():
+    expression = parse("a || b && c == d + e * f").body[0].expression
+    assert expression.operator == "||"
+    assert expression.right.operator == "&&"
+    assert expression.right.right.operator == "=="
+    assert expression.right.right.right.operator == "+"
+    assert expression.right.right.right.right.operator == "*"
+
+
+def test_parse_return_newline():
+    function = parse("function f() { return\n1 }").body[0]
+    assert function.body[0].value is None
+
+
+@pytest.mark.parametrize(
+    "source,description,line",
+    [
+        ("switch (x) {}", "'switch' statement", 1),
+        ("\ntry {} catch (e) {}", "'try' statement", 2),
+        ("x = new Date()", "'new' expression", 1),
+        ("a: for (;;) {}", "Labelled statement", 1),
+        ("f(", "Unexpected end of input", 1),
+        ("a b", "Expected ';', found 'b'", 1),
+    ],
+)
+def test_parse_unsupported(source, description, line):
+    with pytest.raises(UnsupportedSyntax) as e:
+        parse(source)
+    assert (e.value.description, e.value.line) == (description, line)
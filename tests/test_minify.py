@@ -0,0 +1,76 @@
+import hashlib
+
+import pytest
+
+from pypac._js import UnsupportedSyntax
+from pypac.minify import minify
+from pypac.parser import PACFile
+from pypac.static import compile_static
+
+pac_js = """
+/*
+ * Proxy configuration.
+ */
+var proxy = "PROXY " + "proxy.example" + ":8080";  // Main proxy.
+
+function FindProxyForURL(url, host) {
+    var n = host.length
+    n++
+    if (isPlainHostName(host)) {
+        return "DIRECT";
+    }
+    if (/^www\\./i.test(host) && n - 1 > 3) return proxy + "; " + "DIRECT";
+    return n * "2" + "0" + "-" + - -n + +"1" + (1 .toString()) + "a" + "b".length;
+}
+"""
+
+
+def test_minify():
+    minified = minify(pac_js)
+    assert minified == (
+        'var proxy="PROXY proxy.example:8080";function FindProxyForURL(url,host){var n=host.length\n'
+        "n++\n"
+        'if(isPlainHostName(host)){return"DIRECT";}\n'
+        'if(/^www\\./i.test(host)&&n-1>3)return proxy+"; "+"DIRECT";'
+        'return n*"2"+"0"+"-"+- -n+ +"1"+(1 .toString())+"a"+"b".length;}'
+    )
+
+
+@pytest.mark.parametrize(
+    "source,expected",
+    [
+        ('x = "a" + "b" + "c";', 'x="abc";'),
+        ('x = "a" + "b" * 2;', 'x="a"+"b"*2;'),
+        ('x = y - "a" + "b";', 'x=y-"a"+"b";'),
+        ('x = "a" + "b\\n" + y;', 'x="ab\\n"+y;'),
+        ("return 'a' +\n'b'", 'return"ab"'),
+        ("return\nx", "return\nx"),
+        ("a = b\n(c)", "a=b\n(c)"),
+        ("a + ++b - --c", "a+ ++b- --c"),
+        ("x = a / /re/.source.length", "x=a/ /re/.source.length"),
+        ("if (a < !--b) x", "if(a< !--b)x"),
+    ],
+)
+def test_minify_cases(source, expected):
+    assert minify(source) == expected
+
+
+def test_minify_unsupported():
+    with pytest.raises(UnsupportedSyntax):
+        minify("var s = 'unterminated")
+
+
+@pytest.mark.parametrize("host", ["plain", "www.example.org", "a.example.org", "www.b"])
+def test_minified_same_result(host):
+    url = "http://{}/".format(host)
+    assert PACFile(pac_js, minify=True).find_proxy_for_url(url, host) == PACFile(pac_js).find_proxy_for_url(url, host)
+
+
+def test_keep_source():
+    pac = PACFile(pac_js, minify=True, keep_source=False)
+    assert pac.js is None
+    assert pac.sha256 == hashlib.sha256(pac_js.encode("utf-8")).hexdigest()
+    assert pac.find_proxy_for_url("http://plain/", "plain") == "DIRECT"
+    assert PACFile(pac_js).js == pac_js
+    with pytest.raises(ValueError):
+        compile_static(pac)
@@ -0,0 +1,325 @@
+import random
+import socket
+
+import pytest
+from dukpy import evaljs
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from pypac._js import UnsupportedSyntax, parse
+from pypac.native import DomainSet, FallbackToJavaScript, compile_pac, find_domain_loops, rewrite_domain_loops
+from pypac.parser import PACFile
+
+# Duktape (dukpy < 0.6.0) rounds number literals beyond 2**53 up, rather than to the nearest double.
+duktape = evaljs('typeof Duktape != "undefined"')
+duktape_rounding = pytest.mark.xfail(duktape, reason="Duktape rounds number literals beyond 2**53 up", strict=True)
+
+corporate_pac_js = """
+var bypass = ["intranet.example", ".corp.example", "Partner.Example"];
+var proxyPort = 8080;
+
+function isBypassed(h) {
+    for (var i = 0; i < bypass.length; i++) {
+        if (dnsDomainIs(h, bypass[i])) return true;
+    }
+    return false;
+}
+
+function FindProxyForURL(url, host) {
+    if (isPlainHostName(host) || isBypassed(host)) return "DIRECT";
+    if (shExpMatch(host, "*.cdn.example") || dnsDomainIs(host, "static.example") || host == "Exact.Example")
+        return "PROXY cdn.proxy:" + proxyPort;
+    if (shExpMatch(host, "api.example")) return "PROXY api.proxy:80";
+    if (isInNet(host, "10.0.0.0", "255.0.0.0") || isInNet(dnsResolve(host), "192.168.1.0", "255.255.255.0"))
+        return "DIRECT";
+    if (dnsDomainIs(host, ".cdn.example")) return "PROXY never.proxy:80";
+    if (isInNet(host, "172.16.0.0", "255.240.0.0")) return "PROXY private.proxy:80";
+    if (url.substring(0, 6) == "https:") return "PROXY secure.proxy:443; DIRECT";
+    if (/^(www|web)\\d*\\./i.test(host)) return "PROXY web.proxy:" + (proxyPort + host.split(".").length);
+    var label = host.substr(0, host.indexOf("."));
+    return label.length > 3 ? "PROXY " + label.toUpperCase() + ".proxy:3128" : "DIRECT";
+}
+"""
+
+expressions_pac_js = """
+var table = {"a": 1, "b": "two"};
+function pick(values, i) { return values[i % values.length]; }
+function FindProxyForURL(url, host) {
+    var n = host.length, s = "", parts = host.split(".");
+    for (var k in parts) { s += parts[k].charAt(0); }
+    while (n > 20) { n -= 7; if (n % 2 == 0) continue; n--; }
+    var t = typeof table[parts[0]];
+    var x = n * 3 / 2 - (n >> 1) + (n & 5) + "" + (n == "5") + (null == undefined) + (n === "5");
+    if (t == "number" || table[parts[0]] === "two") return "PROXY " + t + ":" + table[parts[0]];
+    if (host.lastIndexOf("o") > 2 && !(host.slice(-4) != ".org")) return "PROXY org:" + host.lastIndexOf("o");
+    if (host.match(/^(\\w+)-(\\d+)/)) return "PROXY " + host.match(/^(\\w+)-(\\d+)/).join("_") + ":1";
+    return "PROXY " + pick(["p", "q", "r"], n) + s + ":" + (x.length > 0 ? x : 0) + "; " + host.replace("a", "A");
+}
+"""
+
+
+def _fake_dns(host):
+    """Deterministic stand-in for DNS resolution."""
+    if host[0].isdigit():
+        return host
+    if host.endswith(".unresolvable"):
+        raise socket.gaierror(socket.EAI_NONAME, host)
+    digest = sum(ord(char) * (i + 1) for i, char in enumerate(host))
+    first = random.Random(digest).choice([10, 172, 192])
+    second = {10: digest % 256, 172: 16 + digest % 20, 192: 168}[first]
+    return "{}.{}.{}.{}".format(first, second, digest % 3, digest % 256)
+
+
+def _generated_hosts(seed, count):
+    rng = random.Random(seed)
+    labels = ["www", "www2", "web", "api", "cdn", "static", "intranet", "corp", "partner", "a", "b", "ab-12", "x"]
+    suffixes = [
+        "example",
+        "cdn.example",
+        "corp.example",
+        "static.example",
+        "org",
+        "unresolvable",
+        "Example",
+        "CDN.EXAMPLE",
+    ]
+    hosts = ["localhost", "api.example", "Exact.Example", "exact.example", "intranet.example", "partner.example"]
+    hosts += ["10.1.2.3", "172.20.0.1", "172.32.0.1", "192.168.1.9", "192.168.2.9", "8.8.8.8"]
+    while len(hosts) < count:
+        host = ".".join(rng.choice(labels) for _ in range(rng.randint(0, 3)))
+        hosts.append((host + "." if host else "") + rng.choice(suffixes))
+    return hosts
+
+
+def assert_same_as_javascript(pac_js, hosts):
+    """Differential test: the compiled PAC file must agree with the JavaScript engine for every host and URL."""
+    with patch("pypac.dns.gethostbyname", side_effect=_fake_dns):
+        js_pac = PACFile(pac_js)
+        native_pac = compile_pac(pac_js)
+        for host in hosts:
+            for url in ("http://{}/".format(host), "https://{}/path?q=1".format(host)):
+                expected = js_pac.find_proxy_for_url(url, host)
+                assert native_pac.find_proxy_for_url(url, host) == expected, (url, host)
+
+
+@pytest.mark.parametrize("pac_js", [corporate_pac_js, expressions_pac_js], ids=["corporate", "expressions"])
+def test_differential(pac_js):
+    assert_same_as_javascript(pac_js, _generated_hosts(pac_js, 300))
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "1e21",
+        "-1e21",
+        "1e20 * 10",
+        "123456789012345678901",
+        pytest.param("9007199254740993", marks=duktape_rounding),
+        pytest.param("0x20000000000001", marks=duktape_rounding),
+        "123456789 * 987654321",
+        "9007199254740992 + 1",
+        "1.5e-5",
+        "1e-7",
+        "0.000001",
+        "1 / 3",
+        "2e-7 * 3",
+        "1e300 * 1e10",
+        "host.length * 1e20",
+    ],
+)
+def test_differential_numbers(expression):
+    """Numbers follow JavaScript's double precision and formatting."""
+    pac_js = 'function FindProxyForURL(url, host) {{ return "PROXY a:" + ({}); }}'.format(expression)
+    assert_same_as_javascript(pac_js, ["a.example", "longer.example"])
+
+
+def test_differential_rule_table():
+    rng = random.Random(1)
+    domains = ["d{}.example".format(i) for i in range(60)]
+    rules = []
+    for i, domain in enumerate(domains):
+        test = rng.choice(
+            [
+                'dnsDomainIs(host, ".{}")',
+                'shExpMatch(host, "*{}")',
+                'shExpMatch(host, "{}")',
+                'host == "{}"',
+                'isInNet(host, "10.%d.0.0", "255.255.0.0")' % i,
+            ]
+        ).format(domain)
+        rules.append('    if ({} || dnsDomainIs(host, "{}.alias")) return "PROXY p{}:80";'.format(test, domain, i))
+    pac_js = 'function FindProxyForURL(url, host) {{\n{}\n    return "DIRECT";\n}}'.format("\n".join(rules))
+    hosts = ["10.{}.1.1".format(i) for i in range(0, 70, 3)]
+    for domain in domains:
+        hosts += [domain, "www." + domain, domain.upper(), "x" + domain, domain + ".alias", "a." + domain + ".alias"]
+    assert_same_as_javascript(pac_js, hosts)
+
+
+def test_first_matching_rule_wins():
+    native_pac = compile_pac(
+        """
+        function FindProxyForURL(url, host) {
+            if (dnsDomainIs(host, "b.example")) return "PROXY first:80";
+            if (isPlainHostName(host)) return "DIRECT";
+            if (dnsDomainIs(host, ".example") || host == "a.b.example") return "PROXY second:80";
+            if (dnsDomainIs(host, "")) return "PROXY last:80";
+        }
+        """
+    )
+    assert native_pac.find_proxy_for_url("http://a.b.example/", "a.b.example") == "PROXY first:80"
+    assert native_pac.find_proxy_for_url("http://c.example/", "c.example") == "PROXY second:80"
+    assert native_pac.find_proxy_for_url("http://c/", "c") == "DIRECT"
+    assert native_pac.find_proxy_for_url("http://c.other/", "c.other") == "PROXY last:80"
+
+
+def test_network_rules_resolve_lazily():
+    native_pac = compile_pac(
+        """
+        function FindProxyForURL(url, host) {
+            if (dnsDomainIs(host, ".example")) return "DIRECT";
+            if (isInNet(host, "10.0.0.0", "255.0.0.0")) return "PROXY ten:80";
+            return "PROXY other:80";
+        }
+        """
+    )
+    with patch("pypac.dns.gethostbyname", return_value="10.0.0.1") as resolve:
+        assert native_pac.find_proxy_for_url("http://a.example/", "a.example") == "DIRECT"
+        assert not resolve.called
+        assert native_pac.find_proxy_for_url("http://a.other/", "a.other") == "PROXY ten:80"
+        resolve.assert_called_once_with("a.other")
+
+
+@pytest.mark.parametrize(
+    "pac_js",
+    [
+        "function FindProxyForURL(url, host) { switch (host) { default: return 'DIRECT'; } }",
+        "function FindProxyForURL(url, host) { return new Date().getDay() ? 'DIRECT' : ''; }",
+        "var count = 0; function FindProxyForURL(url, host) { count++; return 'DIRECT'; }",
+        "function FindProxyForURL(url, host) { return [].concat(host) + ''; }",
+        "function FindProxyForURL(url, host) { var f = function() {}; return 'DIRECT'; }",
+        "function FindProxyForURL(url, host) { return Math.max(1, 2) + ''; }",
+        "function FindProxyForURL(url, host) { return /a/g.test(host) ? 'DIRECT' : ''; }",
+        "alert('loaded'); function FindProxyForURL(url, host) { return 'DIRECT'; }",
+        "function FindProxy(url, host) { return 'DIRECT'; }",
+    ],
+)
+def test_unsupported(pac_js):
+    with pytest.raises(UnsupportedSyntax):
+        compile_pac(pac_js)
+
+
+def test_runtime_fallback():
+    pac_js = "function FindProxyForURL(url, host) { return host.replace('a', '$&$&') + ''; }"
+    native_pac = compile_pac(pac_js)
+    with pytest.raises(FallbackToJavaScript):
+        native_pac.find_proxy_for_url("http://a/", "a")
+    pac = PACFile(pac_js, native=True)
+    assert pac.native
+    assert pac.find_proxy_for_url("http://a/", "a") == "aa"
+
+
+def test_pacfile_native_option():
+    pac = PACFile(corporate_pac_js, native=True)
+    assert pac.native
+    assert pac._native.entry_name == "FindProxyForURL"
+    assert not PACFile(corporate_pac_js).native
+    pac = PACFile("function FindProxyForURL(url, host) { return new Date() ? 'DIRECT' : ''; }", native=True)
+    assert not pac.native
+    assert pac.find_proxy_for_url("http://a/", "a") == "DIRECT"
+    pac = PACFile("function FindProxyForURLEx(url, host) { return 'PROXY ' + host + ':80'; }", native=True)
+    assert pac._native.entry_name == "FindProxyForURLEx"
+    assert pac.find_proxy_for_url("http://a/", "a") == "PROXY a:80"
+
+
+domain_loop_pac_js = """
+var blocked = ["ads.example", ".Tracker.example", "example.net"];
+var other = [".other.example"];
+function isBlocked(h) {
+    for (var i = 0; i < blocked.length; i++)
+        if (dnsDomainIs(h, blocked[i])) return true;
+    return false;
+}
+function FindProxyForURL(url, host) {
+    if (isBlocked(host)) return "PROXY blackhole:1";
+    for (var j = 0; j < other.length; j++) {
+        if (dnsDomainIs(host, other[j])) return "PROXY other:80";
+    }
+    if (j > 0) return "PROXY after:" + j;
+    return "DIRECT";
+}
+"""
+
+shadowed_domain_loop_pac_js = """
+function dnsDomainIs(h, d) { return h == d; }
+var domains = [".example.com", "example.net"];
+function FindProxyForURL(url, host) {
+    for (var i = 0; i < domains.length; i++) {
+        if (dnsDomainIs(host, domains[i])) return "PROXY p:80";
+    }
+    return "DIRECT";
+}
+"""
+
+
+def test_domain_set():
+    domains = DomainSet(["ads.example", ".Tracker.example", ""])
+    assert len(domains) == 3
+    assert domains("x.tracker.EXAMPLE")
+    assert domains("anything")
+    domains = DomainSet(["ads.example", ".tracker.example"])
+    assert domains("badads.example")
+    assert not domains("tracker.example")
+    assert not domains("ads.example.com")
+
+
+def test_find_domain_loops():
+    loops = find_domain_loops(parse(domain_loop_pac_js))
+    # The loop over `other` is left alone, as its index is used afterwards.
+    assert [(loop.host, loop.array, loop.domains, loop.value.value) for loop in loops] == [
+        ("h", "blocked", ["ads.example", ".Tracker.example", "example.net"], True)
+    ]
+    assert not find_domain_loops(parse(domain_loop_pac_js + "function f() { return blocked.length; }"))
+    # dnsDomainIs() may not be the PAC function.
+    assert not find_domain_loops(parse(shadowed_domain_loop_pac_js))
+    assert not find_domain_loops(parse(domain_loop_pac_js + "var dnsDomainIs = shExpMatch;"))
+    assert not find_domain_loops(parse(domain_loop_pac_js + "function f() { dnsDomainIs = shExpMatch; }"))
+    assert not find_domain_loops(parse(domain_loop_pac_js.replace("isBlocked(h)", "isBlocked(h, dnsDomainIs)")))
+
+
+def test_rewrite_domain_loops():
+    rewritten, lookups = rewrite_domain_loops(domain_loop_pac_js)
+    assert "_pypacDomainSet0(h)) return true;" in rewritten
+    assert "blocked[i]" not in rewritten
+    assert rewritten.count("\n") == domain_loop_pac_js.count("\n")
+    assert list(lookups) == ["_pypacDomainSet0"]
+    assert lookups["_pypacDomainSet0"]("a.tracker.example")
+
+
+def test_shadowed_dns_domain_is():
+    native_pac = compile_pac(shadowed_domain_loop_pac_js)
+    js_pac = PACFile(shadowed_domain_loop_pac_js)
+    for host in ("a.example.com", ".example.com", "example.net", "myexample.net"):
+        url = "http://{}/".format(host)
+        assert native_pac.find_proxy_for_url(url, host) == js_pac.find_proxy_for_url(url, host), host
+    assert native_pac.find_proxy_for_url("http://a.example.com/", "a.example.com") == "DIRECT"
+
+
+@pytest.mark.parametrize("native", [False, True])
+def test_domain_loops_differential(native):
+    hosts = ["ads.example", "x.ADS.example", "tracker.example", "a.tracker.example", "example.net", "myexample.net"]
+    hosts += ["a.other.example", "other.example", "example.org", "plain"]
+    original = PACFile(domain_loop_pac_js)
+    pac = PACFile(domain_loop_pac_js, native=native, domain_sets=True)
+    assert pac.native == native
+    for host in hosts:
+        url = "http://{}/".format(host)
+        assert pac.find_proxy_for_url(url, host) == original.find_proxy_for_url(url, host), host
+
+
+def test_domain_sets_shadowed():
+    pac = PACFile(shadowed_domain_loop_pac_js, domain_sets=True)
+    assert pac.find_proxy_for_url("http://a.example.com/", "a.example.com") == "DIRECT"
+    assert pac.find_proxy_for_url("http://example.net/", "example.net") == "PROXY p:80"
@@ -62,6 +62,119 @@ class TestPacFile(object):
         # dukpy >= 0.6.0: "Maximum call stack size exceeded"
         assert "stack" in str(e.value)
 
+    def test_concurrent_evaluation(self):
+        """Evaluations from several threads, with Python functions that release the GIL, don't interfere."""
+        import threading
+        import time
+
+        try:
+            from unittest.mock import patch
+        except ImportError:
+            from mock import patch
+
+        def slow_gethostbyname(host):
+            time.sleep(0.01)
+            return "10.0.0.%s" % host.split(".")[0]
+
+        pac = PACFile('function FindProxyForURL(url, host) { return "PROXY " + dnsResolve(host) + ":80"; }')
+        results = {}
+
+        def evaluate(i):
+            results[i] = pac.find_proxy_for_url("/", "%d.example.com" % i)
+
+        with patch("socket.gethostbyname", side_effect=slow_gethostbyname):
+            threads = [threading.Thread(target=evaluate, args=(i,)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert results == {i: "PROXY 10.0.0.%d:80" % i for i in range(10)}
+
+    def test_concurrent_evaluation_with_slow_lookups(self):
+        """
+        The interpreter crashes if several threads use it at once, such as while one of them makes a lookup.
+        Evaluated in another process, so that a crash doesn't take the tests with it.
+        """
+        import subprocess
+        import sys
+
+        code = """
+import threading, time
+from pypac import dns
+from pypac.parser import PACFile
+
+pac = PACFile(
+    'function FindProxyForURL(url, host) {'
+    '  var a = []; for (var i = 0; i < 50; i++) a.push(host + i);'
+    '  return "PROXY " + dnsResolve(host) + ":80; " + a.join(",").length;'
+    '}'
+)
+# Not deferred, so that other threads run while lookups are made during evaluation.
+dns.gethostbyname = lambda host: (time.sleep(0.01), "10.0.0.%d" % len(host))[1]
+wrong = []
+
+def evaluate(i):
+    for j in range(5):
+        host = "%d-%d.example" % (i, j)
+        if not pac.find_proxy_for_url("/", host).startswith("PROXY 10.0.0.%d:80; " % len(host)):
+            wrong.append(host)
+
+threads = [threading.Thread(target=evaluate, args=(i,)) for i in range(20)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(len(wrong))
+"""
+        process = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, timeout=60, check=False)
+        assert process.returncode == 0
+        assert process.stdout.strip() == b"0"
+
+    @pytest.mark.parametrize(
+        "pac_js,expected",
+        [
+            ('function FindProxyForURL(url, host) { return "DIRECT"; }', False),
+            ('function FindProxyForURL() { return "DIRECT"; }', False),
+            ('function FindProxyForURL(url, host) { return host.url ? "DIRECT" : "PROXY a:80"; }', False),
+            ('function FindProxyForURL(url, host) { return url.length > 9 ? "DIRECT" : "PROXY a:80"; }', True),
+            ('function FindProxyForURL(u, h) { return f(u); } function f(x) { return "DIRECT"; }', True),
+            ('function FindProxyForURL(url, host) { return arguments[0] ? "DIRECT" : "PROXY a:80"; }', True),
+            ('function FindProxyForURLEx(url, host) { return url ? "DIRECT" : "PROXY a:80"; }', True),
+            (
+                'function FindProxyForURL(u, h) { return "DIRECT"; } var FindProxyForURL = function(u) { return u; };',
+                True,
+            ),
+            ('var FindProxyForURL = function(url, host) { return "DIRECT"; };', True),
+        ],
+    )
+    def test_reads_url(self, pac_js, expected):
+        assert PACFile(pac_js).reads_url is expected
+
+    @pytest.mark.parametrize(
+        "pac_js,expected",
+        [
+            ('function FindProxyForURL(url, host) { return "DIRECT"; }', "DIRECT"),
+            ('function FindProxyForURL(url, host) { return "PROXY a:80;" + " " + "DIRECT"; }', "PROXY a:80; DIRECT"),
+            ('function FindProxyForURLEx(url, host) { ; return "PROXY a:80"; }', "PROXY a:80"),
+            ('var p = "DIRECT"; function FindProxyForURL(url, host) { return p; }', None),
+            ('function FindProxyForURL(url, host) { return "PROXY " + host; }', None),
+            ('function FindProxyForURL(url, host) { f(); return "DIRECT"; } function f() {}', None),
+            (
+                (
+                    'function FindProxyForURL(u, h) { return "DIRECT"; }'
+                    ' var FindProxyForURL = function(u, h) { return h == "0.0.0.0" ? "DIRECT" : "PROXY a:80"; };'
+                ),
+                None,
+            ),
+        ],
+    )
+    def test_constant_result(self, pac_js, expected):
+        pac = PACFile(pac_js)
+        assert pac.constant_result == expected
+        assert (pac._context is None) is (expected is not None)
+        if expected is not None:
+            assert pac.find_proxy_for_url("http://a/", "a") == expected
+
 
 dummy_js = 'function FindProxyForURL(url, host) {return %s ? "DIRECT" : "PROXY 0.0.0.0:80";}'
 
@@ -0,0 +1,104 @@
+import os
+
+import pytest
+import requests
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from pypac.parser import MalformedPacError, PACFile
+from pypac.refresh import PACSource, fetch_if_changed
+
+pac_js_tpl = 'function FindProxyForURL(url, host) { return "%s"; }'
+direct_pac_js = pac_js_tpl % "DIRECT"
+proxy_pac_js = pac_js_tpl % "PROXY fake.local:8080"
+pac_url = "http://wpad.local/wpad.dat"
+
+
+def _pac(js, source):
+    pac = PACFile(js)
+    pac.source = source
+    return pac
+
+
+def _response(status_code=200, text=proxy_pac_js, **headers):
+    headers.setdefault("content-type", "application/x-ns-proxy-autoconfig")
+    return Mock(spec=requests.Response, ok=True, status_code=status_code, text=text, headers=headers)
+
+
+def test_no_source():
+    assert fetch_if_changed(PACFile(direct_pac_js)) is None
+
+
+def test_file(tmp_path):
+    path = str(tmp_path / "proxy.pac")
+    with open(path, "w") as f:
+        f.write(direct_pac_js)
+    pac = _pac(direct_pac_js, PACSource(path=path, mtime=os.path.getmtime(path)))
+    assert fetch_if_changed(pac) is None
+
+    with open(path, "w") as f:
+        f.write(proxy_pac_js)
+    os.utime(path, (0, 12345))
+    new_pac = fetch_if_changed(pac)
+    assert new_pac.find_proxy_for_url("/", "x") == "PROXY fake.local:8080"
+    assert new_pac.source.mtime == 12345
+    assert fetch_if_changed(new_pac) is None
+
+    os.remove(path)
+    assert fetch_if_changed(new_pac) is None
+
+
+def test_file_without_source(tmp_path):
+    path = str(tmp_path / "proxy.pac")
+    with open(path, "w") as f:
+        f.write(direct_pac_js)
+    pac = PACFile(direct_pac_js, minify=True, keep_source=False)
+    pac.source = PACSource(path=path, mtime=0)
+    # Touched but unchanged: compared by hash.
+    assert fetch_if_changed(pac) is None
+    assert pac.source.mtime == os.path.getmtime(path)
+
+    with open(path, "w") as f:
+        f.write(proxy_pac_js)
+    os.utime(path, (0, 12345))
+    new_pac = fetch_if_changed(pac)
+    assert new_pac.find_proxy_for_url("/", "x") == "PROXY fake.local:8080"
+    assert new_pac.js is None
+
+
+def test_url_not_modified():
+    pac = _pac(direct_pac_js, PACSource(url=pac_url, etag='"v1"', last_modified="yesterday"))
+    with patch("pypac.api._fetch_pac", return_value=_response(304)) as fetch:
+        assert fetch_if_changed(pac) is None
+    assert fetch.call_args[1]["headers"] == {"If-None-Match": '"v1"', "If-Modified-Since": "yesterday"}
+
+
+def test_url_changed():
+    pac = _pac(direct_pac_js, PACSource(url=pac_url, etag='"v1"'))
+    with patch("pypac.api._fetch_pac", return_value=_response(etag='"v2"')):
+        new_pac = fetch_if_changed(pac)
+    assert new_pac.find_proxy_for_url("/", "x") == "PROXY fake.local:8080"
+    assert (new_pac.source.url, new_pac.source.etag) == (pac_url, '"v2"')
+
+
+def test_url_same_content_keeps_validators():
+    pac = _pac(direct_pac_js, PACSource(candidate_urls=["http://a/wpad.dat", pac_url]))
+    with patch("pypac.api._fetch_pac", side_effect=[None, _response(text=direct_pac_js, etag='"v1"')]):
+        assert fetch_if_changed(pac) is None
+    assert (pac.source.url, pac.source.etag) == (pac_url, '"v1"')
+
+
+def test_url_unreachable():
+    pac = _pac(direct_pac_js, PACSource(url=pac_url))
+    with patch("pypac.api._fetch_pac", return_value=None):
+        assert fetch_if_changed(pac) is None
+
+
+def test_url_malformed():
+    pac = _pac(direct_pac_js, PACSource(url=pac_url))
+    with patch("pypac.api._fetch_pac", return_value=_response(text="function FindProxyForURL(")):
+        with pytest.raises(MalformedPacError):
+            fetch_if_changed(pac)
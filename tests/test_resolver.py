@@ -1,12 +1,14 @@
 import pytest
+from dukpy import JSRuntimeError
 from requests.auth import HTTPProxyAuth
 from requests.utils import get_auth_from_url
 
-from pypac.parser import PACFile, proxy_url
-from pypac.resolver import ProxyConfigExhaustedError, ProxyResolver, add_proxy_auth
+from pypac.parser import PACFile, PacTimeoutError, proxy_url
+from pypac.resolver import PacUnavailableError, ProxyConfigExhaustedError, ProxyResolver, add_proxy_auth
 
 mock_proxy_auth = HTTPProxyAuth("user", "pwd")
 arbitrary_url = "http://example.org"
+host_pac_js = 'function FindProxyForURL(url, host) { return "PROXY " + host + ":80"; }'
 
 
 def _get_resolver(js_func_return_value, proxy_auth=None):
@@ -38,6 +40,15 @@ def test_proxy_failover():
     assert res.get_proxy(arbitrary_url) == "DIRECT"
 
 
+def test_proxy_failover_with_chain():
+    res = _get_resolver("PROXY first:8080; PROXY second:8080; DIRECT")
+    chain = res.get_proxies(arbitrary_url)
+    res.ban_proxy("http://first:8080")
+    assert res.get_proxy(arbitrary_url, chain) == "http://second:8080"
+    assert res.get_proxy(arbitrary_url, ["http://first:8080"]) is None
+    assert res.get_proxy_for_requests(arbitrary_url, ["DIRECT"]) == {"http": None, "https": None}
+
+
 def test_proxy_failover_no_fallback():
     res = _get_resolver("PROXY first:8080")
     res.ban_proxy("http://first:8080")
@@ -91,3 +102,346 @@ def test_url_host_port_excluded():
     )
     for url in ("http://foo/bar", "http://foo:80/bar"):
         assert res.get_proxy(url) == "http://PASS:80"
+
+
+def _concurrent_get_proxies(res, urls):
+    import threading
+
+    results = {}
+
+    def resolve(url):
+        results[url] = res.get_proxies(url)
+
+    threads = [threading.Thread(target=resolve, args=(url,)) for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def _slow_lookup(calls):
+    def gethostbyname(host):
+        import time
+
+        calls.append(host)
+        time.sleep(0.2)
+        return "10.0.0.1"
+
+    return gethostbyname
+
+
+@pytest.mark.parametrize(
+    "pac_js,expected_evaluations",
+    [
+        ('function FindProxyForURL(url, host) { return "PROXY " + dnsResolve(host) + ":80"; }', 1),
+        ('function FindProxyForURL(url, host) { return "PROXY " + dnsResolve(host) + ":80" + url.slice(0, 0); }', 5),
+    ],
+)
+def test_coalesce_concurrent_resolutions(pac_js, expected_evaluations):
+    try:
+        from unittest.mock import patch
+    except ImportError:
+        from mock import patch
+
+    res = ProxyResolver(PACFile(pac_js))
+    calls = []
+    urls = ["http://example.org/{}".format(i) for i in range(5)]
+    with patch("socket.gethostbyname", side_effect=_slow_lookup(calls)):
+        results = _concurrent_get_proxies(res, urls)
+    assert results == {url: ["http://10.0.0.1:80"] for url in urls}
+    assert len(calls) == expected_evaluations
+    assert not res._in_flight
+
+
+def test_duck_typed_pac():
+    class HostPAC(object):
+        def find_proxy_for_url(self, url, host):
+            return "PROXY " + host + ":80"
+
+    res = ProxyResolver(HostPAC(), cache_size=10)
+    assert res.get_proxies("http://a/1") == ["http://a:80"]
+    assert res.get_proxies("http://a/2") == ["http://a:80"]
+    # Cached by URL, as it may read the URL.
+    assert len(res.hottest(5)) == 2
+
+
+def test_coalesce_error_shared():
+    try:
+        from unittest.mock import Mock
+    except ImportError:
+        from mock import Mock
+    import threading
+
+    started, release = threading.Event(), threading.Event()
+
+    def failing_evaluation(url, host):
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    pac = Mock(reads_url=False, find_proxy_for_url=Mock(side_effect=failing_evaluation))
+    res = ProxyResolver(pac)
+    errors = []
+
+    def resolve():
+        try:
+            res.get_proxies(arbitrary_url)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=resolve) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 3
+    assert pac.find_proxy_for_url.call_count <= 3
+    assert not res._in_flight
+
+
+def _counting_resolver(pac_js, **kwargs):
+    try:
+        from unittest.mock import patch
+    except ImportError:
+        from mock import patch
+
+    pac = PACFile(pac_js)
+    res = ProxyResolver(pac, **kwargs)
+    return res, patch.object(pac, "find_proxy_for_url", wraps=pac.find_proxy_for_url)
+
+
+def test_resolution_cache():
+    res, find_proxy_for_url = _counting_resolver(
+        'function FindProxyForURL(url, host) { return "PROXY " + host + ":80"; }', cache_size=2
+    )
+    with find_proxy_for_url as evaluate:
+        for url in ("http://a/1", "http://a/2", "http://b/", "http://a/3", "http://c/"):
+            res.get_proxies(url)
+        assert evaluate.call_count == 3
+        assert res.hottest(5) == [("a", "http://a/1", ["http://a:80"]), ("c", "http://c/", ["http://c:80"])]
+        assert res.hottest(1) == [("a", "http://a/1", ["http://a:80"])]
+        # b was forgotten when c was added, as a was used more recently.
+        res.get_proxies("http://b/")
+        assert evaluate.call_count == 4
+
+
+def test_resolution_cache_disabled():
+    res, find_proxy_for_url = _counting_resolver(host_pac_js)
+    with find_proxy_for_url as evaluate:
+        res.get_proxies(arbitrary_url)
+        res.get_proxies(arbitrary_url)
+    assert evaluate.call_count == 2
+    assert res.hottest(5) == []
+
+
+def test_resolution_cache_by_url():
+    pac = PACFile(
+        'function FindProxyForURL(url, host) { return url.substring(0, 6) == "https:" ? "PROXY a:1" : "DIRECT"; }'
+    )
+    res = ProxyResolver(pac, cache_size=10)
+    assert res.get_proxies("http://example.org/") == ["DIRECT"]
+    assert res.get_proxies("https://example.org/") == ["http://a:1"]
+
+
+def test_resolution_cache_ttl():
+    try:
+        from unittest.mock import patch
+    except ImportError:
+        from mock import patch
+
+    res, find_proxy_for_url = _counting_resolver(host_pac_js, cache_size=5, cache_ttl=10)
+    with find_proxy_for_url as evaluate, patch("pypac.resolver.monotonic", return_value=100):
+        res.get_proxies(arbitrary_url)
+        res.get_proxies(arbitrary_url)
+        assert evaluate.call_count == 1
+    with find_proxy_for_url as evaluate, patch("pypac.resolver.monotonic", return_value=110):
+        res.get_proxies(arbitrary_url)
+        assert evaluate.call_count == 1
+
+
+def test_warm_from():
+    old = ProxyResolver(PACFile(host_pac_js), cache_size=10)
+    for url in ("http://a/", "http://a/", "http://b/", "http://c/"):
+        old.get_proxies(url)
+    new, find_proxy_for_url = _counting_resolver(
+        'function FindProxyForURL(url, host) { return host == "b" ? "DIRECT" : "PROXY " + host + ":80"; }',
+        cache_size=10,
+    )
+    changes = new.warm_from(old, 2)
+    assert [(c.host, c.old_proxies, c.new_proxies) for c in changes] == [("b", ["http://b:80"], ["DIRECT"])]
+    with find_proxy_for_url as evaluate:
+        new.get_proxies("http://a/")
+        new.get_proxies("http://b/")
+    assert evaluate.call_count == 0
+
+
+def test_warm_from_errors():
+    old = ProxyResolver(PACFile(host_pac_js), cache_size=10)
+    for url in ("http://a/", "http://b/"):
+        old.get_proxies(url)
+    new = ProxyResolver(
+        PACFile('function FindProxyForURL(url, host) { if (host == "a") throw "broken"; return "PROXY b:80"; }'),
+        cache_size=10,
+    )
+    changes = new.warm_from(old, 2)
+    assert [(c.host, c.url, c.old_proxies, c.new_proxies) for c in changes] == [
+        ("a", "http://a/", ["http://a:80"], None)
+    ]
+    assert isinstance(changes[0].error, JSRuntimeError)
+
+
+def test_constant_pac():
+    res, find_proxy_for_url = _counting_resolver(
+        'function FindProxyForURL(url, host) { return "PROXY a:80; " + "DIRECT"; }', proxy_auth=mock_proxy_auth
+    )
+    assert res.pac.constant_result == "PROXY a:80; DIRECT"
+    with find_proxy_for_url as evaluate:
+        assert res.get_proxies(arbitrary_url) == [add_proxy_auth("http://a:80", mock_proxy_auth), "DIRECT"]
+        assert res.get_proxies("http://other/") == res.constant_proxies
+    assert evaluate.call_count == 0
+    assert ProxyResolver(PACFile(host_pac_js)).constant_proxies is None
+
+
+def _failing_pac(failures):
+    """A PAC file that gives a host-dependent result, except that it fails while `failures` is non-empty."""
+    try:
+        from unittest.mock import patch
+    except ImportError:
+        from mock import patch
+
+    pac = PACFile(host_pac_js)
+    find_proxy_for_url = pac.find_proxy_for_url
+
+    def evaluate(url, host):
+        if failures:
+            raise PacTimeoutError(1)
+        return find_proxy_for_url(url, host)
+
+    return pac, patch.object(pac, "find_proxy_for_url", side_effect=evaluate)
+
+
+@pytest.mark.parametrize(
+    "policy,expected",
+    [("direct", ["DIRECT"]), ("last_known_good", ["http://example.org:80"])],
+)
+def test_error_policy(policy, expected):
+    failures = []
+    pac, patched = _failing_pac(failures)
+    res = ProxyResolver(pac, error_policy=policy)
+    with patched:
+        assert res.get_proxies(arbitrary_url) == ["http://example.org:80"]
+        failures.append(True)
+        assert res.get_proxies(arbitrary_url) == expected
+        if policy == "last_known_good":
+            with pytest.raises(PacTimeoutError):
+                res.get_proxies("http://other/")
+
+
+def test_error_policy_raise():
+    pac, patched = _failing_pac([True])
+    with patched, pytest.raises(PacTimeoutError):
+        ProxyResolver(pac).get_proxies(arbitrary_url)
+    with pytest.raises(ValueError):
+        ProxyResolver(pac, error_policy="ignore")
+
+
+def test_error_threshold_shared_evaluation():
+    """Threads that share one failed evaluation count as one error."""
+    try:
+        from unittest.mock import Mock
+    except ImportError:
+        from mock import Mock
+    import threading
+    import time
+
+    started, release = threading.Event(), threading.Event()
+
+    def failing_evaluation(url, host):
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    pac = Mock(reads_url=False, find_proxy_for_url=Mock(side_effect=failing_evaluation))
+    res = ProxyResolver(pac, error_threshold=3, error_cooldown=10)
+    errors = []
+
+    def resolve():
+        try:
+            res.get_proxies(arbitrary_url)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=resolve) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 4
+    assert pac.find_proxy_for_url.call_count == 1
+    assert res._consecutive_errors == 1
+    # Not suspended: the PAC file is evaluated again.
+    with pytest.raises(ValueError):
+        res.get_proxies(arbitrary_url)
+    assert pac.find_proxy_for_url.call_count == 2
+
+
+@pytest.mark.parametrize("policy", ["raise", "last_known_good"])
+def test_error_threshold(policy):
+    try:
+        from unittest.mock import patch
+    except ImportError:
+        from mock import patch
+
+    failures = [True]
+    pac, patched = _failing_pac(failures)
+    res = ProxyResolver(pac, error_policy=policy, error_threshold=2, error_cooldown=10)
+    with patched as evaluate, patch("pypac.resolver.monotonic", return_value=100) as now:
+        for _ in range(2):
+            with pytest.raises(PacTimeoutError):
+                res.get_proxies(arbitrary_url)
+        # Suspended: not evaluated at all.
+        with pytest.raises(PacUnavailableError) as error:
+            res.get_proxies(arbitrary_url)
+        assert isinstance(error.value.last_error, PacTimeoutError)
+        assert evaluate.call_count == 2
+
+        # After the cooldown, one more failure suspends it again.
+        now.return_value = 110
+        with pytest.raises(PacTimeoutError):
+            res.get_proxies(arbitrary_url)
+        with pytest.raises(PacUnavailableError):
+            res.get_proxies(arbitrary_url)
+        assert evaluate.call_count == 3
+
+        now.return_value = 120
+        failures.pop()
+        assert res.get_proxies(arbitrary_url) == ["http://example.org:80"]
+        failures.append(True)
+        with pytest.raises(PacTimeoutError):
+            res.get_proxies("http://other/")
+        # The success reset the count, so it takes two more failures to suspend it.
+        with pytest.raises(PacTimeoutError):
+            res.get_proxies("http://other/")
+        assert evaluate.call_count == 6
+
+
+def test_adopt_last_known_good():
+    old = ProxyResolver(PACFile(host_pac_js), error_policy="last_known_good")
+    old.get_proxies("http://a/")
+    old.get_proxies("http://b/")
+    failures = [True]
+    pac, patched = _failing_pac(failures)
+    new = ProxyResolver(pac, error_policy="last_known_good")
+    new._remember_last_known_good("b", ["DIRECT"])
+    new.adopt_last_known_good(old)
+    with patched:
+        assert new.get_proxies("http://a/") == ["http://a:80"]
+        assert new.get_proxies("http://b/") == ["DIRECT"]
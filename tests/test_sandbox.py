@@ -0,0 +1,94 @@
+import socket
+import sys
+
+import pytest
+from dukpy import JSRuntimeError
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from pypac import dns
+from pypac.parser import MalformedPacError, PACFile, PacMemoryError, PacTimeoutError
+
+pac_js = """
+function FindProxyForURL(url, host) {
+    if (host == "loop") while (true) {}
+    if (host == "big") {
+        var a = [];
+        while (true) a.push("item " + a.length);
+    }
+    if (host == "throw") throw new Error("thrown");
+    return "PROXY " + dnsResolve(host) + ":80";
+}
+"""
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Memory limits only apply on Linux")
+
+
+@pytest.fixture(scope="module")
+def pac():
+    return PACFile(pac_js, timeout=2, memory_limit=64 * 1024 * 1024)
+
+
+def test_evaluate(pac):
+    assert pac._sandbox is not None
+    assert not pac.reads_url
+    assert pac.find_proxy_for_url("http://10.0.0.1/", "10.0.0.1") == "PROXY 10.0.0.1:80"
+
+
+def test_lookups_in_calling_process(pac):
+    with dns.preresolved({"intranet.example": ["10.1.2.3"]}):
+        assert pac.find_proxy_for_url("http://intranet.example/", "intranet.example") == "PROXY 10.1.2.3:80"
+    with patch("pypac.dns.gethostbyname", side_effect=socket.gaierror(socket.EAI_NONAME, "x")):
+        assert pac.find_proxy_for_url("http://nowhere.example/", "nowhere.example") == "PROXY :80"
+
+
+def test_timeout(pac):
+    with pytest.raises(PacTimeoutError):
+        pac.find_proxy_for_url("http://loop/", "loop")
+    # A new worker process takes over.
+    assert pac.find_proxy_for_url("http://10.0.0.1/", "10.0.0.1") == "PROXY 10.0.0.1:80"
+
+
+@linux_only
+def test_memory_limit(pac):
+    with pytest.raises(PacMemoryError):
+        pac.find_proxy_for_url("http://big/", "big")
+    assert pac.find_proxy_for_url("http://10.0.0.1/", "10.0.0.1") == "PROXY 10.0.0.1:80"
+
+
+@pytest.mark.parametrize(
+    "message,expected",
+    [
+        ("InternalError: out of memory", True),
+        ("Error: alloc failed", True),
+        ("DoubleError: error in error handling", True),
+        ("null", True),
+        ("Error: thrown", False),
+    ],
+)
+def test_out_of_memory_messages(message, expected):
+    from pypac.sandbox import _out_of_memory
+
+    assert _out_of_memory(JSRuntimeError(message)) is expected
+    assert _out_of_memory(MalformedPacError(original_exc=JSRuntimeError(message))) is expected
+
+
+def test_javascript_error(pac):
+    with pytest.raises(JSRuntimeError):
+        pac.find_proxy_for_url("http://throw/", "throw")
+
+
+def test_load_errors():
+    with pytest.raises(PacTimeoutError):
+        PACFile("while (true) {}\n" + pac_js, timeout=1)
+    with pytest.raises(MalformedPacError):
+        PACFile("function FindProxyForURL(url, host) { return undefinedVariable; }", timeout=1)
+
+
+def test_constant_result_stops_worker():
+    pac = PACFile('function FindProxyForURL(url, host) { return "DIRECT"; }', timeout=1)
+    assert pac.constant_result == "DIRECT"
+    assert pac._sandbox is None
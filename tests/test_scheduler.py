@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+import requests
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+from pypac.api import PACSession
+from pypac.parser import PACFile
+from pypac.resolver import ProxyConfigExhaustedError
+from pypac.scheduler import EXHAUSTED, ProxyScheduler
+
+routing_pac_js = """
+function FindProxyForURL(url, host) {
+    if (dnsDomainIs(host, ".slow.local")) return "PROXY slow:80";
+    if (dnsDomainIs(host, ".fast.local")) return "PROXY fast:80";
+    return "DIRECT";
+}
+"""
+
+
+class ConcurrencyTracker(object):
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self.current = {}
+        self.peak = {}
+        self.starts = {}
+
+    def __call__(self, key):
+        with self._lock:
+            self.current[key] = self.current.get(key, 0) + 1
+            self.peak[key] = max(self.peak.get(key, 0), self.current[key])
+            self.starts.setdefault(key, []).append(time.time())
+        time.sleep(self.delay)
+        with self._lock:
+            self.current[key] -= 1
+        return key
+
+
+def test_max_per_proxy():
+    tracker = ConcurrencyTracker()
+    scheduler = ProxyScheduler(max_workers=8, max_per_proxy=2)
+    items = ["a"] * 10 + ["b"] * 10
+    results = list(scheduler.run(items, lambda item: item, tracker))
+    assert len(results) == 20
+    assert tracker.peak == {"a": 2, "b": 2}
+    assert all(result.response == result.proxy for result in results)
+
+
+def test_busy_proxy_does_not_starve_others():
+    tracker = ConcurrencyTracker()
+    scheduler = ProxyScheduler(max_workers=4, max_per_proxy=1)
+    results = list(scheduler.run(["a"] * 5 + ["b"], lambda item: item, tracker))
+    # "b" doesn't wait behind the queue for "a".
+    assert [result.proxy for result in results].index("b") <= 1
+
+
+def test_rate_per_proxy():
+    tracker = ConcurrencyTracker(delay=0)
+    scheduler = ProxyScheduler(max_workers=4, rate_per_proxy=20)
+    list(scheduler.run(["a"] * 4, lambda item: item, tracker))
+    starts = tracker.starts["a"]
+    assert starts[-1] - starts[0] >= 3 / 20.0 * 0.9
+
+
+def test_exceptions_captured():
+    def work(item):
+        raise ValueError(item)
+
+    (result,) = list(ProxyScheduler().run(["x"], lambda item: "DIRECT", work))
+    assert result.response is None
+    assert isinstance(result.exception, ValueError)
+
+
+def test_invalid_max_per_proxy():
+    with pytest.raises(ValueError):
+        ProxyScheduler(max_per_proxy=0)
+
+
+def test_session_map():
+    sess = PACSession(pac=PACFile(routing_pac_js))
+    tracker = ConcurrencyTracker()
+    pac = sess._proxy_resolver.pac
+
+    def fake_request(method, url, proxies=None, **kwargs):
+        tracker(proxies["http"])
+        return Mock(spec=requests.Response, status_code=200, url=url, method=method)
+
+    urls = ["http://%d.slow.local/" % i for i in range(6)] + ["http://%d.fast.local/" % i for i in range(6)]
+    requests_to_send = urls + [{"method": "POST", "url": "http://x.slow.local/"}, "http://direct.local/"]
+    with patch("requests.Session.request", side_effect=fake_request), patch.object(
+        pac, "find_proxy_for_url", wraps=pac.find_proxy_for_url
+    ) as find_proxy:
+        results = list(sess.map(requests_to_send, max_workers=6, max_per_proxy=2))
+    assert find_proxy.call_count == len(requests_to_send)  # The PAC is evaluated once per request.
+    assert len(results) == len(requests_to_send)
+    assert tracker.peak == {"http://slow:80": 2, "http://fast:80": 2, None: 1}
+    by_proxy = {}
+    for result in results:
+        assert result.exception is None
+        by_proxy.setdefault(result.proxy, []).append(result)
+    assert sorted(by_proxy) == ["DIRECT", "http://fast:80", "http://slow:80"]
+    (post,) = [result for result in by_proxy["http://slow:80"] if isinstance(result.request, dict)]
+    assert post.response.method == "POST"
+
+
+def test_routing_errors_captured():
+    def route(item):
+        if item == "bad":
+            raise ValueError(item)
+        return "DIRECT"
+
+    results = list(ProxyScheduler().run(["good", "bad"], route, lambda item: item))
+    (bad,) = [result for result in results if result.request == "bad"]
+    assert bad.proxy is None and bad.response is None
+    assert isinstance(bad.exception, ValueError)
+    (good,) = [result for result in results if result.request == "good"]
+    assert good.response == "good"
+
+
+def test_routing_on_workers():
+    """Items are routed concurrently, on the thread pool."""
+    tracker = ConcurrencyTracker(delay=0.1)
+    start = time.time()
+    results = list(ProxyScheduler(max_workers=5).run(["a"] * 5, tracker, lambda item: item))
+    assert time.time() - start < 0.4
+    assert tracker.peak == {"a": 5}
+    assert len(results) == 5
+
+
+def test_session_map_errors():
+    pac_js = """
+    function FindProxyForURL(url, host) {
+        if (host == "broken.local") throw new Error("broken");
+        return "PROXY gone:80";
+    }
+    """
+    sess = PACSession(pac=PACFile(pac_js))
+    sess._proxy_resolver.ban_proxy("http://gone:80")
+    results = list(sess.map(["http://broken.local/", "http://ok.local/"]))
+    (broken,) = [result for result in results if result.request == "http://broken.local/"]
+    assert broken.proxy is None
+    assert "broken" in str(broken.exception)
+    (exhausted,) = [result for result in results if result.request == "http://ok.local/"]
+    assert exhausted.proxy == EXHAUSTED
+    assert isinstance(exhausted.exception, ProxyConfigExhaustedError)
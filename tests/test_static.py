@@ -0,0 +1,136 @@
+import pytest
+
+from pypac.parser import PACFile
+from pypac.static import compile_static
+
+static_pac_js = """
+var bypass = ["example.net", ".example.org"];
+
+function FindProxyForURL(url, host) {
+    host = host.toLowerCase();
+    if (dnsDomainIs(host, ".corp.local") || shExpMatch(host, "*.example.com") || host == "intranet")
+        return "DIRECT";
+    for (var i = 0; i < bypass.length; i++) {
+        if (dnsDomainIs(host, bypass[i])) return "DIRECT";
+    }
+    if (isInNet(host, "10.0.0.0", "255.0.0.0")) return "DIRECT";
+    return "PROXY proxy.local:8080";
+}
+"""
+
+
+def test_compile_static():
+    config = compile_static(PACFile(static_pac_js), approximate_dns=True)
+    assert config.is_static
+    assert config.proxy == "http://proxy.local:8080"
+    assert config.no_proxy == [".corp.local", ".example.com", "intranet", "example.net", ".example.org", "10.0.0.0/8"]
+    assert [line for line, _ in config.approximations] == [6, 6, 6, 8, 8, 11]
+    env = config.environ()
+    assert env["HTTPS_PROXY"] == env["http_proxy"] == "http://proxy.local:8080"
+    assert env["no_proxy"] == ".corp.local,.example.com,intranet,example.net,.example.org,10.0.0.0/8"
+
+
+def test_compile_static_dns():
+    config = compile_static(static_pac_js)
+    assert not config.is_static
+    assert [line for line, _ in config.unsupported] == [11]
+    with pytest.raises(ValueError) as e:
+        config.environ()
+    assert "line 11: isInNet()" in str(e.value)
+
+
+@pytest.mark.parametrize(
+    "pac_js,proxy,approximations",
+    [
+        ('function FindProxyForURL(url, host) { return "DIRECT"; }', None, 0),
+        ('function FindProxyForURL(url, host) { return "PROXY a:1; DIRECT"; }', "http://a:1", 1),
+        (
+            'function FindProxyForURL(url, host) { return dnsDomainIs(host, ".a") ? "DIRECT" : "SOCKS a:1"; }',
+            "socks5://a:1",
+            1,
+        ),
+        (
+            'function FindProxyForURL(url, host) { if (host == "a") return "DIRECT"; else return "PROXY a:1"; }',
+            "http://a:1",
+            1,
+        ),
+    ],
+)
+def test_compile_static_forms(pac_js, proxy, approximations):
+    config = compile_static(pac_js)
+    assert config.is_static
+    assert config.proxy == proxy
+    assert len(config.approximations) == approximations
+
+
+@pytest.mark.parametrize(
+    "condition,matched,approximation",
+    [
+        ('dnsDomainIs(host, ".a.com") || host == "a.com"', ["a.com", "x.a.com"], None),
+        ('shExpMatch(host, "*.a.com") || shExpMatch(host, "A.com")', ["a.com", "x.a.com"], None),
+        ('dnsDomainIs(host, ".a.com")', ["x.a.com"], "NO_PROXY also matches 'a.com' itself, not only its subdomains"),
+        ('host == "a.com"', ["a.com"], "NO_PROXY also matches subdomains of 'a.com'"),
+        (
+            'dnsDomainIs(host, "a.com")',
+            ["a.com", "x.a.com", "xa.com"],
+            "dnsDomainIs() also matches names that end with 'a.com' without a dot before it, like 'xa.com'",
+        ),
+        ('host == "10.1.2.3"', ["10.1.2.3"], None),
+    ],
+)
+def test_compile_static_domain_matching(condition, matched, approximation):
+    """NO_PROXY entries that match a bare domain or its subdomains differently from the PAC file are reported."""
+    pac_js = 'function FindProxyForURL(url, host) {\n if (%s) return "DIRECT";\n return "PROXY p:1"; }' % condition
+    pac = PACFile(pac_js)
+    hosts = ["a.com", "x.a.com", "xa.com", "10.1.2.3"]
+    assert [host for host in hosts if pac.find_proxy_for_url("/", host) == "DIRECT"] == matched
+    config = compile_static(pac)
+    assert config.is_static
+    assert config.approximations == ([(2, approximation)] if approximation else [])
+
+
+@pytest.mark.parametrize(
+    "body,line,description",
+    [
+        ('if (isPlainHostName(host)) return "DIRECT";', 3, "Condition using isPlainHostName()"),
+        ('if (url.substring(0, 5) == "http:") return "DIRECT";', 3, "Condition on the URL"),
+        ('if (shExpMatch(host, "*corp*")) return "DIRECT";', 3, "shExpMatch() pattern '*corp*'"),
+        ('if (dnsDomainIs(host, ".a")) return "PROXY other:1";', 3, "Returns a different proxy for some hosts"),
+        ('var ip = dnsResolve(host);', 3, "Variable declaration"),
+        ('if (host == "a") { alert(host); return "DIRECT"; }', 3, "'if' statement that does more than return a value"),
+        ('if (isInNet(host, "10.0.0.0", "255.0.255.0")) return "DIRECT";',
+         3, "isInNet() with a non-contiguous or invalid mask"),
+    ],
+)  # fmt: skip
+def test_compile_static_unsupported(body, line, description):
+    pac_js = "function FindProxyForURL(url, host) {\n    host = host.toLowerCase();\n    %s\n    return 'PROXY a:1';\n}"
+    config = compile_static(pac_js % body)
+    assert config.unsupported == [(line, description)]
+
+
+def test_compile_static_order():
+    config = compile_static(
+        """function FindProxyForURL(url, host) {
+            if (dnsDomainIs(host, ".a")) return "PROXY a:1";
+            if (dnsDomainIs(host, ".b")) return "DIRECT";
+            return "PROXY a:1";
+        }"""
+    )
+    assert config.unsupported == [(3, "Returns DIRECT after an earlier rule returned a proxy")]
+
+
+def test_compile_static_proxy_for_some():
+    config = compile_static(
+        'function FindProxyForURL(url, host) { if (dnsDomainIs(host, ".a")) return "PROXY a:1"; return "DIRECT"; }'
+    )
+    assert config.unsupported == [(1, "Returns a proxy for some hosts, but DIRECT for everything else")]
+
+
+def test_compile_static_no_return():
+    config = compile_static('function FindProxyForURL(url, host) {\n if (host == "a") return "DIRECT";\n}')
+    assert config.unsupported == [(2, "FindProxyForURL() can end without returning")]
+
+
+def test_compile_static_syntax():
+    config = compile_static("function FindProxyForURL(url, host) {\n switch (host) {} }")
+    assert config.unsupported == [(2, "'switch' statement")]
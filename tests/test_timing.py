@@ -0,0 +1,58 @@
+import time
+
+import pytest
+from requests.exceptions import Timeout
+
+from pypac.timing import Deadline, DeadlineExceededError, DiscoveryTimings, RequestTimings
+
+
+def test_deadline_remaining():
+    deadline = Deadline(10)
+    assert 9 < deadline.remaining() <= 10
+    assert not deadline.expired
+    deadline.check("anything")
+
+
+def test_deadline_expired():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.remaining() == 0
+    assert deadline.expired
+    with pytest.raises(DeadlineExceededError) as e:
+        deadline.check("PAC discovery")
+    assert "before PAC discovery" in str(e.value)
+    assert isinstance(e.value, Timeout)
+
+
+@pytest.mark.parametrize(
+    "timeout,expected",
+    [
+        (None, 10),
+        (1, 1),
+        (30, 10),
+        ((1, 30), (1, 10)),
+        ((None, 2), (10, 2)),
+    ],
+)
+def test_deadline_clamp(timeout, expected):
+    assert Deadline(10).clamp(timeout) == pytest.approx(expected, abs=0.5)
+
+
+def test_request_timings_total():
+    timings = RequestTimings()
+    timings.discovery = 1.0
+    timings.resolve = 0.5
+    timings.attempts = [("http://a:80", 2.0), (None, 0.25)]
+    assert timings.total == 3.75
+
+
+def test_discovery_timings():
+    timings = DiscoveryTimings()
+    with timings.measure(timings.HOSTNAME):
+        time.sleep(0.01)
+    with pytest.raises(ValueError):
+        with timings.measure(timings.PARSE):
+            raise ValueError()
+    assert [stage for stage, _ in timings.stages] == ["hostname", "parse"]
+    assert timings.total >= 0.01
+    assert "hostname=" in repr(timings)
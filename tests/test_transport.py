@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+httpx = pytest.importorskip("httpx")
+
+from pypac.parser import PACFile  # noqa: E402
+from pypac.resolver import ProxyConfigExhaustedError  # noqa: E402
+from pypac.transport import AsyncPACTransport  # noqa: E402
+
+
+class StandInProxy(object):
+    """HTTP proxy that answers every request itself, with its name in the body."""
+
+    def __init__(self, name, status=200):
+        self.name = name
+        self.status = status
+        self.connections = 0
+        self.requests = []
+        self.server = None
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server.sockets[0].getsockname()[1])
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                self.requests.append(head.split(b" ")[1].decode())
+                await asyncio.sleep(0.01)
+                body = self.name.encode()
+                writer.write(
+                    "HTTP/1.1 {} X\r\nContent-Length: {}\r\n\r\n".format(self.status, len(body)).encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _closed_port():
+    import socket
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _pac(*proxies):
+    return PACFile('function FindProxyForURL(url, host) {{ return "{}"; }}'.format("; ".join(proxies)))
+
+
+def _proxy(url):
+    return "PROXY " + url.split("://")[1]
+
+
+def test_routes_through_pac_proxy():
+    async def main():
+        async with StandInProxy("good") as proxy:
+            transport = AsyncPACTransport(_pac(_proxy(proxy.url), "DIRECT"))
+            async with httpx.AsyncClient(transport=transport) as client:
+                response = await client.get("http://example.test/path")
+            return response, proxy.requests
+
+    response, requests = asyncio.run(main())
+    assert response.text == "good"
+    assert response.extensions["pac_proxy"].startswith("http://127.0.0.1:")
+    assert requests == ["http://example.test/path"]
+
+
+def test_failover_on_refused_proxy():
+    async def main():
+        async with StandInProxy("good") as proxy:
+            dead = "http://127.0.0.1:{}".format(_closed_port())
+            transport = AsyncPACTransport(_pac(_proxy(dead), _proxy(proxy.url)))
+            async with httpx.AsyncClient(transport=transport) as client:
+                first = await client.get("http://example.test/")
+                second = await client.get("http://example.test/")
+            return first, second, transport.proxy_resolver.resolver._offline_proxies, dead
+
+    first, second, banned, dead = asyncio.run(main())
+    assert first.text == second.text == "good"
+    assert banned == {dead}
+
+
+def test_response_filter_failover():
+    async def main():
+        async with StandInProxy("bad", status=503) as bad, StandInProxy("good") as good:
+            transport = AsyncPACTransport(
+                _pac(_proxy(bad.url), _proxy(good.url)),
+                response_proxy_fail_filter=lambda response: response.status_code == 503,
+            )
+            async with httpx.AsyncClient(transport=transport) as client:
+                return (await client.get("http://example.test/")).text
+
+    assert asyncio.run(main()) == "good"
+
+
+def test_exhausted_raises_original_and_unbans():
+    async def main():
+        dead = "http://127.0.0.1:{}".format(_closed_port())
+        transport = AsyncPACTransport(_pac(_proxy(dead)))
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(httpx.ConnectError):
+                await client.get("http://example.test/")
+        return transport.proxy_resolver.resolver._offline_proxies
+
+    assert asyncio.run(main()) == set()
+
+
+def test_no_proxy_configured():
+    async def main():
+        transport = AsyncPACTransport(PACFile('function FindProxyForURL(url, host) { return ""; }'))
+        async with httpx.AsyncClient(transport=transport) as client:
+            with pytest.raises(ProxyConfigExhaustedError):
+                await client.get("http://example.test/")
+
+    asyncio.run(main())
+
+
+def test_connection_reuse_under_concurrency():
+    async def main():
+        async with StandInProxy("good") as proxy:
+            transport = AsyncPACTransport(
+                _pac(_proxy(proxy.url)), limits=httpx.Limits(max_connections=5, max_keepalive_connections=5)
+            )
+            async with httpx.AsyncClient(transport=transport) as client:
+                urls = ["http://example.test/{}".format(i) for i in range(100)]
+                responses = await asyncio.gather(*[client.get(url) for url in urls])
+            return responses, proxy.connections
+
+    responses, connections = asyncio.run(main())
+    assert [r.text for r in responses] == ["good"] * 100
+    assert connections <= 5
+
+
+def test_lazy_get_pac_once():
+    async def main(proxy_url):
+        transport = AsyncPACTransport()
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await asyncio.gather(*[client.get("http://example.test/") for _ in range(10)])
+
+    async def run():
+        async with StandInProxy("good") as proxy:
+            with patch("pypac.transport.get_pac", return_value=_pac(_proxy(proxy.url))) as gp:
+                responses = await main(proxy.url)
+            return responses, gp
+
+    responses, gp = asyncio.run(run())
+    assert [r.text for r in responses] == ["good"] * 10
+    gp.assert_called_once_with()
+
+
+def test_pac_disabled():
+    with patch("pypac.transport.get_pac") as gp:
+
+        async def main():
+            transport = AsyncPACTransport(pac_enabled=False)
+            assert await transport.get_pac() is None
+            assert transport.transport_for("DIRECT") is transport.transport_for("DIRECT")
+            await transport.aclose()
+
+        asyncio.run(main())
+    gp.assert_not_called()
@@ -7,7 +7,7 @@ try:
 except ImportError:
     from mock import patch
 
-from pypac.wpad import proxy_urls_from_dns
+from pypac.wpad import forget_local_hostname, local_hostname, proxy_urls_from_dns
 
 
 @pytest.mark.parametrize("bad_host", [" ", ".", ".foo", "bar."])
@@ -41,3 +41,36 @@ def test_this_host():
 def test_host_fqdn(host_fqdn, expected_wpad, description):
     print(description)
     assert proxy_urls_from_dns(host_fqdn) == expected_wpad
+
+
+@pytest.mark.parametrize(
+    "hostname,canonical_name,expected",
+    [
+        ("pc.corp.local", None, "pc.corp.local"),
+        ("pc", "pc.corp.local", "pc.corp.local"),
+        ("pc", "", "pc"),
+    ],
+)
+def test_local_hostname_without_reverse_dns(hostname, canonical_name, expected):
+    forget_local_hostname()
+    addrinfo = [(2, 1, 6, canonical_name, ("10.0.0.1", 0))]
+    try:
+        with patch("socket.gethostname", return_value=hostname), patch(
+            "socket.getaddrinfo", return_value=addrinfo
+        ) as getaddrinfo, patch("socket.getfqdn") as getfqdn:
+            assert local_hostname(reverse_dns=False) == expected
+        assert getaddrinfo.called == ("." not in hostname)
+        assert not getfqdn.called
+    finally:
+        forget_local_hostname()
+
+
+def test_local_hostname_remembered():
+    forget_local_hostname()
+    try:
+        with patch("socket.getfqdn", return_value="foo.example.local") as getfqdn:
+            assert local_hostname() == "foo.example.local"
+            assert local_hostname() == "foo.example.local"
+        assert getfqdn.call_count == 1
+    finally:
+        forget_local_hostname()